@@ -1,18 +1,64 @@
 import argparse
+import json
+import logging
 import sys
-from src.elo_predictor import *
-from src.elo_ratings import *
-from src.find_opt_seed import *
+# the modules of every action are imported once the action is known, see src/startup.py
+from src.startup import import_action, measure_startup
+from src.instrumentation import instrumentation
+from src.diagnostics import diagnostics
 
 if __name__ == '__main__':
 	try:
 		# parsing arguments of the main script
 		parser = argparse.ArgumentParser(description="Chess winner predictor")
 		# add arguments to the parser
-		parser.add_argument("action", help='valid actions: [get_data, compute_ratings, '
-										   'eval_predictor, predict_test_games]')
-		parser.add_argument("version", help='the version of the ratings for the predictor: [v1, v2, v4]')
+		parser.add_argument("action", help='valid actions: [get_data, compute_ratings, stream_ratings, '
+										   'export_ratings, eval_predictor, predict_test_games, find_optimal_seed, '
+										   'param_search, serve, online_ratings, compile_predictor, '
+										   'check_startup, benchmark]')
+		parser.add_argument("version", help='the version of the ratings for the predictor: [v1, v2, v3, v4], '
+											'all is also valid for compute_ratings')
 		parser.add_argument('-e', "--evaluation", help='use evaluation dataset for the predictor')
+		parser.add_argument("--engine", default='players', choices=['players', 'arrays', 'batched'],
+							help='rating engine used to compute the ratings')
+		parser.add_argument('-c', "--checkpoints", action='store_true',
+							help='save yearly checkpoints and resume the ratings from the latest valid one')
+		parser.add_argument("--history", action='store_true',
+							help='compute_ratings and stream_ratings also save the rating history of every year for '
+								 'the predictor, online_ratings publishes it with --publish')
+		parser.add_argument("--cold-after", type=int,
+							help='compute_ratings and stream_ratings move the players without games in this many '
+								 'years out of memory to an sqlite file, only with the players engine')
+		parser.add_argument("--workers", type=int, help='number of processes for param_search (all cpus by default) '
+														'and for get_data and predict_test_games (one by default)')
+		parser.add_argument("--port", type=int, help='local port of the prediction server (8765 by default)')
+		parser.add_argument("--log-file", default='./data/io/games.log',
+							help='append-only json lines file with the finished games for online_ratings')
+		parser.add_argument("--publish", action='store_true',
+							help='online_ratings also saves the ratings of the current year for the predictor')
+		parser.add_argument("--search-space", help='json file with the lists of values of the parameters '
+												  'for param_search')
+		parser.add_argument("--candidates", type=int, help='number of random candidates for param_search, '
+														   'all the combinations by default')
+		parser.add_argument("--early-stop", type=float, help='param_search stops the candidates with an accuracy '
+															 'this many points below the best one at the end of a training year')
+		parser.add_argument("--scales", default='small',
+							help='comma separated scales of the synthetic data for benchmark: small, medium, large')
+		parser.add_argument("--output", help='json file of the benchmark results, a new file at data/benchmarks '
+											 'by default')
+		parser.add_argument("--profile", action='store_true',
+							help='measure the time and the items of every stage and save a report at data/profiles, '
+								 'also enabled with the CHESS_PROFILE environment variable')
+		parser.add_argument("--cprofile", help='comma separated stages to run under cProfile, for example '
+											   'update_year,export (CHESS_CPROFILE environment variable)')
+		parser.add_argument("--diagnostics", action='store_true',
+							help='count the repeated events (unknown players, players without ratings...) by category '
+								 'and player, log only some samples and give a summary at the end, also enabled with '
+								 'the CHESS_DIAGNOSTICS environment variable')
+		parser.add_argument("--log-level", default='DEBUG', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+							help='level of the messages written to project.log')
+		parser.add_argument("--imports-only", action='store_true',
+							help='only import the modules of the action and exit, to measure the startup time')
 		args = parser.parse_args()
 		action = args.action
 		version = args.version
@@ -21,6 +67,10 @@ if __name__ == '__main__':
 			parser.print_help()
 			sys.exit(1)
 
+		import_action(action)
+		if args.imports_only:
+			sys.exit(0)
+
 		print(f"Action = {action}")
 		if version and version =='v0':
 			print("Ignoring version")
@@ -36,27 +86,78 @@ if __name__ == '__main__':
 		# TODO Add logging parameters into a yaml file
 		logging.basicConfig(filename='project.log', format='%(asctime)s %(levelname)-8s '
 														   '[%(filename)s:%(lineno)d] %(message)s',
-							level=logging.DEBUG)
+							level=getattr(logging, args.log_level))
 		logger = logging.getLogger('project_logger')
+		if args.profile or args.cprofile:
+			instrumentation.enable(args.cprofile.split(',') if args.cprofile else ())
+		else:
+			instrumentation.enable_from_environment()
+		if args.diagnostics:
+			diagnostics.enable()
+		else:
+			diagnostics.enable_from_environment()
 		full = not args.evaluation
 		if action == "get_data":
+			from src.io_utils import get_training_dataset
 			logger.info("Parsing training data. Ignoring version.")
-			success = get_training_dataset(full)
+			success = get_training_dataset(full, workers=args.workers or 1)
 			logger.debug(f"Result of the process= {success}")
 
 		elif action == 'compute_ratings':
+			from src.io_utils import iter_ini_players, prepare_ini_players, read_train_dataset
+			from src.elo_ratings import generate_ratings, generate_versions_ratings
 			logger.debug(f"Computing separate ratings for version {version}")
 			# read optional parameter eval
 			train_df = read_train_dataset(full)
 
 			# read initial ratings
 			# TODO add a yaml parameter for the ini_ratings file
-			players_list = prepare_ini_players("rating_2014.txt", train_df)
+			if args.cold_after is not None:
+				# the initial players go straight to the store of the players out of memory
+				players_list = iter_ini_players("rating_2014.txt", train_df)
+			else:
+				players_list = prepare_ini_players("rating_2014.txt", train_df)
 
 			# Generate separate ratings
-			generate_ratings(players_list, train_df, version, export=True)
+			if version == 'all':
+				# all versions in a single pass over the games
+				versions = ['v1', 'v2', 'v3', 'v4'] if full else ['v1_val', 'v2_val', 'v3_val', 'v4_val']
+				generate_versions_ratings(players_list, train_df, versions, export=True, engine=args.engine,
+										  checkpoints=args.checkpoints, history=args.history, cold_after=args.cold_after)
+			else:
+				generate_ratings(players_list, train_df, version, export=True, engine=args.engine,
+								 checkpoints=args.checkpoints, history=args.history, cold_after=args.cold_after)
+
+		elif action == 'stream_ratings':
+			from src.io_utils import get_classic_ratings, get_stream_players, stream_games
+			from src.elo_ratings import generate_streaming_ratings
+			logger.debug(f"Computing ratings for version {version} streaming the training files")
+			# TODO Add a yaml parameter for the split-date of the evaluation data
+			end_date = None if full else '2020-01-01'
+			games = stream_games("./data/train/", end_date)
+			# all the players are in the year files from the start, as in compute_ratings
+			players = get_stream_players("./data/train/", end_date)
+
+			# TODO add a yaml parameter for the ini_ratings file
+			ini_ratings = get_classic_ratings("rating_2014.txt")
+			generate_streaming_ratings(games, ini_ratings, version, export=True, history=args.history,
+									   cold_after=args.cold_after, players=players)
+
+		elif action == 'export_ratings':
+			from src.snapshots import export_snapshots
+			logger.info(f"Exporting the ratings snapshots of version {version}")
+			years = export_snapshots(version)
+			logger.debug(f"Exported years {years}")
+
+		elif action == 'compile_predictor':
+			from src.predictor_artifact import compile_predictor
+			logger.info(f"Compiling the ratings of version {version} for the predictor")
+			years = compile_predictor(version)
+			logger.debug(f"Compiled years {years}")
 
 		elif action == 'eval_predictor':
+			from src.io_utils import read_evaluation_files
+			from src.elo_predictor import EloPredictor
 			# read evaluation json file
 			eval_df = read_evaluation_files()
 
@@ -69,16 +170,78 @@ if __name__ == '__main__':
 			logger.info(f"After evaluating the predictor we achieved a {accuracy} accuracy")
 
 		elif action == 'predict_test_games':
+			from src.elo_predictor import EloPredictor
 			# create predictor
 			logger.info(f"Creating the Elo predictor for version {version}")
 			elo_predictor = EloPredictor(version)
 
 			# generate results for test games
-			elo_predictor.predict_games("./data/test/", "./data/test/")
+			elo_predictor.predict_games("./data/test/", "./data/test/", workers=args.workers or 1)
+
+		elif action == 'serve':
+			from src.prediction_server import DEFAULT_PORT, run_server
+			logger.info(f"Starting the prediction server for version {version}")
+			run_server(version, port=args.port if args.port is not None else DEFAULT_PORT)
+
+		elif action == 'online_ratings':
+			from src.io_utils import get_classic_ratings
+			from src.online_ratings import start_online_ratings
+			logger.info(f"Updating the ratings of version {version} with the games of {args.log_file}")
+			# TODO add a yaml parameter for the ini_ratings file
+			online = start_online_ratings(version, args.log_file, get_classic_ratings("rating_2014.txt"),
+										  publish=args.publish, history=args.history)
+			online.follow()
 
 		elif action == 'find_optimal_seed':
+			from src.find_opt_seed import find_opt_seed
 			find_opt_seed()
+
+		elif action == 'param_search':
+			from src.param_search import SEARCH_SPACE, get_grid_candidates, get_random_candidates, search_parameters
+			search_space = SEARCH_SPACE
+			if args.search_space:
+				with open(args.search_space) as f:
+					search_space = {**SEARCH_SPACE, **json.load(f)}
+					f.close()
+				# the draw thresholds are pairs of values
+				for name in ['classic_draw', 'rapid_draw']:
+					search_space[name] = [tuple(values) for values in search_space[name]]
+			if args.candidates:
+				candidates = get_random_candidates(search_space, args.candidates)
+			else:
+				candidates = get_grid_candidates(search_space)
+			results = search_parameters(candidates, version, args.workers, args.early_stop)
+			print(results)
+			results.to_csv("./data/predictions/param_search_" + version + ".csv", index=False)
+		elif action == 'benchmark':
+			from src.benchmarks import run_benchmarks
+			versions = ['v1', 'v2', 'v3', 'v4'] if version in ['all', 'v0'] else [version]
+			logger.info(f"Running the benchmarks of versions {versions} with synthetic data")
+			report = run_benchmarks(args.scales.split(','), versions, [args.engine], args.output)
+			for scale, scale_report in report['scales'].items():
+				for result in scale_report['results']:
+					labels = ' '.join(str(result[key]) for key in ['version', 'engine', 'cache'] if key in result)
+					print(f"{scale:<7} {result['stage']:<19} {labels:<12} {result['seconds']:>9.4f}s "
+						  f"{result['per_second'] or 0:>12.1f} {result['unit']}/s {result['peak_memory_mb']} MB")
+
+		elif action == 'check_startup':
+			results = measure_startup()
+			for result in results:
+				print(f"{result['action']:<20} {result['seconds']:.3f}s (budget {result['budget']:.3f}s, "
+					  f"{result['seconds'] / result['baseline']:.2f} times the baseline) "
+					  f"{'ok' if result['ok'] else 'OVER BUDGET'}")
+			if not all(result['ok'] for result in results):
+				logger.error("Some actions exceed their startup budget")
+				sys.exit(1)
 		else:
 			logger.error("Action not recognized. Please enter a valid action")
 	except Exception as e:
 		logger.error(f"Error at the main script.Reason={e}")
+	finally:
+		if diagnostics.enabled:
+			summary = diagnostics.format_summary()
+			logging.getLogger('project_logger').info(f"Diagnostics summary:\n{summary}")
+			print(summary)
+		if instrumentation.enabled:
+			print(instrumentation.format_report())
+			instrumentation.save_report(action)
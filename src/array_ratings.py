@@ -0,0 +1,457 @@
+import logging
+import math
+import numpy as np
+import pandas as pd
+from src.elo_ratings import DEFAULT_PARAMETERS, EloRatings, check_version, compute_estimate, compute_k_factor, \
+	get_scores
+from src.diagnostics import diagnostics
+
+logger = logging.getLogger(__name__)
+
+CLASSIC = 0
+RAPID = 1
+
+def get_game_codes(names, elo_ratings):
+	'''
+	Function to translate a column of player names into the integer ids of the registry
+	:param names: the pandas series with the names, categorical or not
+	:param elo_ratings: the ratings class with the registry of players
+	:return: the array with the player ids (-1 for players not registered yet)
+	'''
+	if isinstance(names.dtype, pd.CategoricalDtype):
+		codes = names.cat.codes.to_numpy()
+		categories = names.cat.categories
+	else:
+		codes, categories = pd.factorize(names)
+	registry = elo_ratings.registry
+	code_ids = [registry.get_id(name) for name in categories]
+	code_ids = np.array([-1 if i is None else i for i in code_ids] + [-1], dtype=np.int64)
+	# code -1 (missing name) maps to the last position
+	return code_ids[codes], np.asarray(categories, dtype=object), codes
+
+def get_independent_rounds(w_ids, b_ids, nr_players):
+	'''
+	Function to split a sequence of games into rounds of independent games. A game goes to the round after
+	the last round of any of its players, so every player appears at most once per round and the games of a
+	player keep their order. Processing the rounds one after the other gives the same result as processing
+	the games one by one, as the games of a tournament round do.
+	:param w_ids: array with the ids of the white players
+	:param b_ids: array with the ids of the black players
+	:param nr_players: total number of players
+	:return: the array with the round of every game, starting at 0
+	'''
+	last_round = [-1] * nr_players
+	rounds = [0] * len(w_ids)
+	for i, (w, b) in enumerate(zip(w_ids.tolist(), b_ids.tolist())):
+		w_round = last_round[w]
+		b_round = last_round[b]
+		game_round = (w_round if w_round > b_round else b_round) + 1
+		last_round[w] = game_round
+		last_round[b] = game_round
+		rounds[i] = game_round
+	return np.array(rounds, dtype=np.int64)
+
+'''
+Class to encapsulate the logic of the Elo rating system using one numpy array per player metric
+(struct of arrays) indexed by the integer id of the player in the registry.
+The Player objects are only updated when they are requested, for instance at export time.
+The history of opponent ratings is not kept by this engine, only the running sums.
+https://en.wikipedia.org/wiki/Elo_rating_system
+@author: A. Rosa Castillo
+'''
+class ArrayEloRatings(EloRatings):
+	def __init__(self, players_list, first_date, last_date, params=DEFAULT_PARAMETERS):
+		super().__init__(players_list, first_date, last_date, params)
+		# position 0 is for classic games, position 1 for rapid games
+		self.ratings = np.zeros((2, 0), dtype=np.int64)
+		self.prov_ratings = np.zeros((2, 0), dtype=bool)
+		self.nr_games = np.zeros((2, 0), dtype=np.int64)
+		self.wins = np.zeros((2, 0), dtype=np.int64)
+		self.losses = np.zeros((2, 0), dtype=np.int64)
+		self.opponents_sum = np.zeros((2, 0), dtype=np.int64)
+		# table with the values 10^(rating/400) used by compute_estimate, indexed by rating - q_offset
+		self.q_table = np.zeros(0)
+		self.q_offset = 0
+		if self.registry.keep_history:
+			logger.warning("The array engine does not keep the history of opponent ratings")
+		self.load_players()
+
+	def load_players(self):
+		'''
+		It appends to the arrays the players registered since the last call
+		'''
+		start = self.ratings.shape[1]
+		new_players = [self.registry.get_by_id(i) for i in range(start, len(self.registry))]
+		if not new_players:
+			return
+		ratings = [[p.rating for p in new_players], [p.r_rating for p in new_players]]
+		prov_ratings = [[p.c_prov_rating for p in new_players], [p.r_prov_rating for p in new_players]]
+		nr_games = [[p.nr_c_games for p in new_players], [p.nr_r_games for p in new_players]]
+		wins = [[p.c_wins for p in new_players], [p.r_wins for p in new_players]]
+		losses = [[p.c_losses for p in new_players], [p.r_losses for p in new_players]]
+		opponents_sum = [[p.c_opponents_sum for p in new_players], [p.r_opponents_sum for p in new_players]]
+		self.ratings = np.hstack([self.ratings, np.array(ratings, dtype=np.int64)])
+		self.prov_ratings = np.hstack([self.prov_ratings, np.array(prov_ratings, dtype=bool)])
+		self.nr_games = np.hstack([self.nr_games, np.array(nr_games, dtype=np.int64)])
+		self.wins = np.hstack([self.wins, np.array(wins, dtype=np.int64)])
+		self.losses = np.hstack([self.losses, np.array(losses, dtype=np.int64)])
+		self.opponents_sum = np.hstack([self.opponents_sum, np.array(opponents_sum, dtype=np.int64)])
+
+	def get_player_ids(self, white, black):
+		'''
+		It returns the integer ids of both players of every game, adding the unknown players to the registry
+		in the same order as the game by game processing would find them
+		:param white: series with the white players names
+		:param black: series with the black players names
+		:return: two arrays with the ids of white and black players
+		'''
+		w_ids, w_names, w_codes = get_game_codes(white, self)
+		b_ids, b_names, b_codes = get_game_codes(black, self)
+		if (w_ids < 0).any() or (b_ids < 0).any():
+			# interleave white and black to keep the order of appearance of the new players
+			missing = np.column_stack([w_ids, b_ids]).ravel()
+			for position in np.flatnonzero(missing < 0):
+				game, is_black = divmod(position, 2)
+				name = b_names[b_codes[game]] if is_black else w_names[w_codes[game]]
+				self.get_player(name)
+			self.load_players()
+			w_ids, _, _ = get_game_codes(white, self)
+			b_ids, _, _ = get_game_codes(black, self)
+		return w_ids, b_ids
+
+	def process_games(self, w_ids, b_ids, results, rapid_games, ratings_version, games_positions=None):
+		'''
+		It updates the ratings for a sequence of games following the same rules as process_game
+		:param w_ids: array with the ids of the white players
+		:param b_ids: array with the ids of the black players
+		:param results: array with the results of the games
+		:param rapid_games: boolean array, True for rapid games
+		:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+		:param games_positions: position of every game in the games of the year for the history recorder,
+		0 to n-1 by default
+		'''
+		separate_ratings, balanced = check_version(ratings_version)
+		params = self.params
+		prov_games = params.prov_games
+		# python lists are much faster than numpy arrays for scalar access inside the loop
+		ratings = self.ratings.tolist()
+		prov_ratings = self.prov_ratings.tolist()
+		nr_games = self.nr_games.tolist()
+		wins = self.wins.tolist()
+		losses = self.losses.tolist()
+		opponents_sum = self.opponents_sum.tolist()
+		c_ratings = ratings[CLASSIC]
+		r_ratings = ratings[RAPID]
+		history = self.history
+		if history is not None and games_positions is None:
+			games_positions = range(len(w_ids))
+		elif games_positions is not None:
+			games_positions = list(games_positions)
+		for i, (w, b, result, rapid_game) in enumerate(zip(w_ids.tolist(), b_ids.tolist(), results.tolist(),
+														   rapid_games.tolist())):
+			game_type = 'rapid' if rapid_game else 'classic'
+			slot = RAPID if (rapid_game and separate_ratings) else CLASSIC
+			rating = ratings[slot]
+			prov = prov_ratings[slot]
+			games = nr_games[slot]
+			s_wins = wins[slot]
+			s_losses = losses[slot]
+			opp_sum = opponents_sum[slot]
+
+			# provisional ratings?
+			if prov[w] and games[w] >= prov_games:
+				prov[w] = False
+			if prov[b] and games[b] >= prov_games:
+				prov[b] = False
+
+			# the opponent rating is always the classic one, as in Player.add_opponent_rating
+			opp_sum[b] += c_ratings[w]
+			opp_sum[w] += c_ratings[b]
+			games[w] += 1
+			games[b] += 1
+
+			w_rating = rating[w]
+			b_rating = rating[b]
+			e_w, e_b = compute_estimate(w_rating, b_rating)
+			k_w, k_b = compute_k_factor(w_rating, b_rating, game_type, games[w], games[b], params)
+
+			score_w, score_b = get_scores(result)
+			if score_w == 1.0:
+				s_wins[w] += 1
+				s_losses[b] += 1
+			if score_b == 1.0:
+				s_wins[b] += 1
+				s_losses[w] += 1
+
+			# same rules as check_new_ratings
+			w_prov_rating = prov[w]
+			b_prov_rating = prov[b]
+			if w_prov_rating:
+				rating[w] = round((opp_sum[w] + 400 * (s_wins[w] - s_losses[w])) / games[w])
+			if b_prov_rating:
+				rating[b] = round((opp_sum[b] + 400 * (s_wins[b] - s_losses[b])) / games[b])
+
+			if not w_prov_rating and not b_prov_rating:
+				new_rating_w = rating[w] + k_w * (score_w - e_w)
+				if balanced:
+					new_rating_w = max(new_rating_w, round(opp_sum[w] / games[w]))
+				if new_rating_w > 0:
+					rating[w] = round(new_rating_w)
+
+				new_rating_b = rating[b] + k_b * (score_b - e_b)
+				if balanced:
+					new_rating_b = max(new_rating_b, round(opp_sum[b] / games[b]))
+				if new_rating_b > 0:
+					rating[b] = round(new_rating_b)
+
+				if new_rating_w < 0 or new_rating_b < 0:
+					diagnostics.event('negative_rating', logger, logging.WARNING, "Negative rating reached. No change",
+									  players=(self.registry.get_by_id(w).name, self.registry.get_by_id(b).name))
+
+			if history is not None:
+				for player in (w, b):
+					history.add(games_positions[i], player, c_ratings[player], r_ratings[player],
+								wins[CLASSIC][player], nr_games[CLASSIC][player], wins[RAPID][player],
+								nr_games[RAPID][player])
+
+		self.ratings = np.array(ratings, dtype=np.int64)
+		self.prov_ratings = np.array(prov_ratings, dtype=bool)
+		self.nr_games = np.array(nr_games, dtype=np.int64)
+		self.wins = np.array(wins, dtype=np.int64)
+		self.losses = np.array(losses, dtype=np.int64)
+		self.opponents_sum = np.array(opponents_sum, dtype=np.int64)
+
+	def get_q_values(self, ratings):
+		'''
+		It returns 10^(rating/400) for integer ratings. The values are computed once with math.pow, as
+		compute_estimate does, so the results are exactly the same as the ones of the game by game engine.
+		:param ratings: array of integer ratings
+		:return: the array with the q values
+		'''
+		low = int(ratings.min())
+		high = int(ratings.max())
+		if low < self.q_offset or high >= self.q_offset + len(self.q_table):
+			low = min(low, self.q_offset) if len(self.q_table) else low
+			high = max(high, self.q_offset + len(self.q_table) - 1)
+			# some margin to avoid rebuilding the table for every small change
+			low = low - 200
+			high = high + 200
+			self.q_table = np.array([math.pow(10, r / 400) for r in range(low, high + 1)])
+			self.q_offset = low
+		return self.q_table[ratings - self.q_offset]
+
+	def process_round(self, w_ids, b_ids, results, rapid_games, separate_ratings, balanced, games_positions=None):
+		'''
+		It updates the ratings for a round of games where every player appears at most once,
+		computing all games at the same time with numpy vector operations
+		:param w_ids: array with the ids of the white players
+		:param b_ids: array with the ids of the black players
+		:param results: array with the results of the games
+		:param rapid_games: boolean array, True for rapid games
+		:param separate_ratings: True if rapid games use their own rating
+		:param balanced: if True the hill-climbing approach is used to weight the new rating
+		:param games_positions: position of every game in the games of the year for the history recorder
+		'''
+		self.update_round(w_ids, b_ids, results, rapid_games, separate_ratings, balanced)
+		if self.history is not None:
+			player_ids = np.concatenate([w_ids, b_ids])
+			self.history.add_arrays(np.concatenate([games_positions, games_positions]), player_ids,
+									[self.ratings[CLASSIC, player_ids], self.ratings[RAPID, player_ids],
+									 self.wins[CLASSIC, player_ids], self.nr_games[CLASSIC, player_ids],
+									 self.wins[RAPID, player_ids], self.nr_games[RAPID, player_ids]])
+
+	def update_round(self, w_ids, b_ids, results, rapid_games, separate_ratings, balanced):
+		'''
+		It updates the arrays for a round of games, see process_round
+		'''
+		params = self.params
+		slots = (rapid_games & separate_ratings).astype(np.int64)
+		w = (slots, w_ids)
+		b = (slots, b_ids)
+
+		# provisional ratings?
+		self.prov_ratings[w] &= self.nr_games[w] < params.prov_games
+		self.prov_ratings[b] &= self.nr_games[b] < params.prov_games
+
+		# the opponent rating is always the classic one, as in Player.add_opponent_rating
+		c_rating_w = self.ratings[CLASSIC, w_ids]
+		c_rating_b = self.ratings[CLASSIC, b_ids]
+		self.opponents_sum[b] += c_rating_w
+		self.opponents_sum[w] += c_rating_b
+		self.nr_games[w] += 1
+		self.nr_games[b] += 1
+
+		# same values as compute_estimate
+		w_rating = self.ratings[w]
+		b_rating = self.ratings[b]
+		q_w = self.get_q_values(w_rating)
+		q_b = self.get_q_values(b_rating)
+		e_w = q_w / (q_w + q_b)
+		e_b = q_b / (q_w + q_b)
+
+		# same values as compute_k_factor
+		games_w = self.nr_games[w]
+		games_b = self.nr_games[b]
+		k_w = np.where(w_rating >= params.top_rating, params.k_top,
+					   np.where(games_w < params.new_player_games, params.k_new, params.k_default))
+		k_b = np.where(b_rating >= params.top_rating, params.k_top,
+					   np.where(games_b < params.new_player_games, params.k_new, params.k_default))
+		k_w[rapid_games] = params.k_rapid
+		k_b[rapid_games] = params.k_rapid
+
+		# same values as get_scores
+		score_w = np.where(results == 0.5, 0.5, np.where(results == 1.0, 1.0, 0.0))
+		score_b = np.where(results == 0.5, 0.5, np.where(results == 1.0, 0.0, 1.0))
+		w_wins = score_w == 1.0
+		b_wins = score_b == 1.0
+		self.wins[w] += w_wins
+		self.losses[b] += w_wins
+		self.wins[b] += b_wins
+		self.losses[w] += b_wins
+
+		# same rules as check_new_ratings
+		w_prov_rating = self.prov_ratings[w]
+		b_prov_rating = self.prov_ratings[b]
+		for prov_rating, player in [(w_prov_rating, w), (b_prov_rating, b)]:
+			if prov_rating.any():
+				prov = (player[0][prov_rating], player[1][prov_rating])
+				prov_ratings = (self.opponents_sum[prov] + 400 * (self.wins[prov] - self.losses[prov])) / self.nr_games[prov]
+				self.ratings[prov] = np.rint(prov_ratings).astype(np.int64)
+
+		rated = ~w_prov_rating & ~b_prov_rating
+		if not rated.any():
+			return
+		new_ratings = list()
+		for player, k, score, estimate in [(w, k_w, score_w, e_w), (b, k_b, score_b, e_b)]:
+			player = (player[0][rated], player[1][rated])
+			new_rating = self.ratings[player] + k[rated] * (score[rated] - estimate[rated])
+			if balanced:
+				avg_opp_rating = np.rint(self.opponents_sum[player] / self.nr_games[player])
+				new_rating = np.maximum(new_rating, avg_opp_rating)
+			positive = new_rating > 0
+			self.ratings[(player[0][positive], player[1][positive])] = np.rint(new_rating[positive]).astype(np.int64)
+			new_ratings.append(new_rating)
+		rated_w_ids = w_ids[rated]
+		rated_b_ids = b_ids[rated]
+		for game in np.flatnonzero((new_ratings[0] < 0) | (new_ratings[1] < 0)).tolist():
+			diagnostics.event('negative_rating', logger, logging.WARNING, "Negative rating reached. No change",
+							  players=(self.registry.get_by_id(int(rated_w_ids[game])).name,
+									   self.registry.get_by_id(int(rated_b_ids[game])).name))
+
+	def process_games_by_rounds(self, w_ids, b_ids, results, rapid_games, ratings_version, min_round_size=16):
+		'''
+		It updates the ratings for a sequence of games grouping them into rounds of independent games.
+		The result is the same as the one of process_games.
+		:param w_ids: array with the ids of the white players
+		:param b_ids: array with the ids of the black players
+		:param results: array with the results of the games
+		:param rapid_games: boolean array, True for rapid games
+		:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+		:param min_round_size: average number of games per round below which the games are processed one by one
+		'''
+		separate_ratings, balanced = check_version(ratings_version)
+		rounds = get_independent_rounds(w_ids, b_ids, self.ratings.shape[1])
+		nr_rounds = int(rounds.max()) + 1 if len(rounds) else 0
+		if nr_rounds == 0 or len(rounds) / nr_rounds < min_round_size:
+			logger.debug("Rounds too small for the vector operations, processing games one by one")
+			self.process_games(w_ids, b_ids, results, rapid_games, ratings_version)
+			return
+		logger.debug(f"Processing {len(rounds)} games in {nr_rounds} rounds")
+		order = np.argsort(rounds, kind='stable')
+		bounds = np.flatnonzero(np.diff(rounds[order])) + 1
+		self_games = w_ids == b_ids
+		for games in np.split(order, bounds):
+			if self_games[games].any():
+				# a player against himself cannot be vectorized, the game is processed alone
+				for game in games[self_games[games]]:
+					self.process_games(w_ids[[game]], b_ids[[game]], results[[game]], rapid_games[[game]],
+									   ratings_version, [game])
+				games = games[~self_games[games]]
+			self.process_round(w_ids[games], b_ids[games], results[games], rapid_games[games],
+							   separate_ratings, balanced, games)
+
+	def process_game(self, white_p, black_p, result, game_type, ratings_version):
+		w_id = self.registry.get_id(self.get_player(white_p).name)
+		b_id = self.registry.get_id(self.get_player(black_p).name)
+		self.load_players()
+		self.process_games(np.array([w_id]), np.array([b_id]), np.array([result]),
+						   np.array([game_type == 'rapid']), ratings_version)
+
+	def get_avg_opponents_ratings(self, slot):
+		games = self.nr_games[slot].tolist()
+		opp_sum = self.opponents_sum[slot].tolist()
+		return [round(s / g) if g > 0 else 0 for s, g in zip(opp_sum, games)]
+
+	def sync_players(self):
+		'''
+		It copies the ratings, flags, counters and opponent sums from the arrays into the Player objects
+		'''
+		for player_id, player in enumerate(self.registry):
+			player.rating = int(self.ratings[CLASSIC, player_id])
+			player.r_rating = int(self.ratings[RAPID, player_id])
+			player.c_prov_rating = bool(self.prov_ratings[CLASSIC, player_id])
+			player.r_prov_rating = bool(self.prov_ratings[RAPID, player_id])
+			player.nr_c_games = int(self.nr_games[CLASSIC, player_id])
+			player.nr_r_games = int(self.nr_games[RAPID, player_id])
+			player.c_wins = int(self.wins[CLASSIC, player_id])
+			player.r_wins = int(self.wins[RAPID, player_id])
+			player.c_losses = int(self.losses[CLASSIC, player_id])
+			player.r_losses = int(self.losses[RAPID, player_id])
+			player.c_opponents_sum = int(self.opponents_sum[CLASSIC, player_id])
+			player.r_opponents_sum = int(self.opponents_sum[RAPID, player_id])
+
+	def get_players(self, separate_ratings, as_dicts=False):
+		if not as_dicts:
+			self.sync_players()
+			return self.registry.to_list()
+		# same dictionaries as Player.to_dict built straight from the arrays
+		names = [player.name for player in self.registry]
+		ratings = self.ratings.tolist()
+		nr_games = self.nr_games.tolist()
+		wins = self.wins.tolist()
+		losses = self.losses.tolist()
+		avg_c_opp = self.get_avg_opponents_ratings(CLASSIC)
+		players_dict_list = list()
+		if separate_ratings:
+			avg_r_opp = self.get_avg_opponents_ratings(RAPID)
+			for i, name in enumerate(names):
+				players_dict_list.append({'name': name, 'rating': ratings[CLASSIC][i],
+										  'rapid_rating': ratings[RAPID][i],
+										  'classic_games': nr_games[CLASSIC][i], 'rapid_games': nr_games[RAPID][i],
+										  'rapid_wins': wins[RAPID][i], 'rapid_losses': losses[RAPID][i],
+										  'classic_wins': wins[CLASSIC][i], 'classic_losses': losses[CLASSIC][i],
+										  'avg_c_opp_rating': avg_c_opp[i], 'avg_r_opp_rating': avg_r_opp[i]})
+		else:
+			for i, name in enumerate(names):
+				players_dict_list.append({'name': name, 'rating': ratings[CLASSIC][i],
+										  'nr_games': nr_games[CLASSIC][i], 'wins': wins[CLASSIC][i],
+										  'losses': losses[CLASSIC][i], 'avg_opp_rating': avg_c_opp[i]})
+		return players_dict_list
+
+def update_array_ratings(elo_ratings, year_data, ratings_version, by_rounds=False):
+	'''
+	Based on all games from the year, update the ratings kept at the arrays of the rating engine
+	:param elo_ratings: the array ratings class, it keeps the state from previous years
+	:param year_data: the games data of a year
+	:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+	:param by_rounds: True to update the ratings with vector operations over rounds of independent games
+	:return: the elo ratings class
+	'''
+	try:
+		logger.info("Updating elo ratings with the array engine")
+		if len(year_data) == 0:
+			raise ValueError("no games to process")
+		elo_ratings.last_date = year_data.game_date.max()
+		total_games = len(year_data)
+		logger.debug(f"Processing {total_games} total games")
+		w_ids, b_ids = elo_ratings.get_player_ids(year_data['white'], year_data['black'])
+		rapid_games = (year_data['time_control'] == 'rapid').to_numpy()
+		results = year_data['result'].to_numpy(dtype=float)
+		if by_rounds:
+			elo_ratings.process_games_by_rounds(w_ids, b_ids, results, rapid_games, ratings_version)
+		else:
+			elo_ratings.process_games(w_ids, b_ids, results, rapid_games, ratings_version)
+		return elo_ratings
+	except Exception as e:
+		logger.error(f"Error while updating ratings. Reason: {e}")
+		return None
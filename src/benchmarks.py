@@ -0,0 +1,184 @@
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from src.elo_predictor import EloPredictor, get_year_ratings
+from src.elo_ratings import check_version, generate_ratings, update_ratings
+from src.io_utils import name_cache, parse_files, prepare_ini_players, read_evaluation_files, standard_clean
+from src.synthetic_data import generate_dataset
+
+logger = logging.getLogger(__name__)
+
+'''
+Benchmarks of the parsing, the ratings and the predictor with synthetic data, see synthetic_data. Every scale
+generates its own data folder in a temporary folder and runs every stage twice: once to measure the time and
+once under tracemalloc to measure the peak memory, because tracing the allocations slows the code down.
+The results are saved as a json file to compare the releases.
+@author: A. Rosa Castillo
+'''
+# to change if the stages or the data change, the results of different versions are not comparable
+BENCHMARK_VERSION = 1
+
+SCALES = {'small': {'nr_players': 300, 'nr_tournaments': 60, 'rounds': 9},
+		  'medium': {'nr_players': 3000, 'nr_tournaments': 600, 'rounds': 9},
+		  'large': {'nr_players': 12000, 'nr_tournaments': 3000, 'rounds': 11}}
+
+def run_stage(results, stage, func, count, unit='games', setup=None, memory=True, **labels):
+	'''
+	Function to measure one stage and to add its result to the list of results
+	:param results: the list of results of the scale
+	:param stage: the name of the stage
+	:param func: the function to measure, it gets the value returned by setup if there is a setup
+	:param count: number of items processed by the stage
+	:param unit: the items processed by the stage, games or players
+	:param setup: optional function called before every run of the stage, its time is not measured
+	:param memory: True to run the stage again to measure the peak memory
+	:param labels: other values to add to the result, like the version of the ratings
+	:return: the value returned by the first run of the function, a RuntimeError is raised if it failed
+	'''
+	args = [setup()] if setup is not None else []
+	start = time.perf_counter()
+	start_cpu = time.process_time()
+	value = func(*args)
+	seconds = time.perf_counter() - start
+	cpu_seconds = time.process_time() - start_cpu
+	# the functions of the project return None or False when they fail, the time of a failure is not valid
+	if value is None or value is False:
+		raise RuntimeError(f"The stage {stage} {labels} failed, see the log")
+	peak_memory = None
+	if memory:
+		args = [setup()] if setup is not None else []
+		tracemalloc.start()
+		try:
+			func(*args)
+			_, peak_memory = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+	result = {'stage': stage, **labels,
+			  'unit': unit,
+			  'count': count,
+			  'seconds': round(seconds, 6),
+			  'cpu_seconds': round(cpu_seconds, 6),
+			  'per_second': round(count / seconds, 1) if seconds > 0 else None,
+			  'peak_memory_mb': round(peak_memory / 2 ** 20, 3) if peak_memory is not None else None}
+	logger.info(f"Benchmark {result}")
+	results.append(result)
+	return value
+
+def run_scale(scale, config, versions, engines, memory=True, seed=0):
+	'''
+	Function to run all the stages with the data of a scale, in the current folder
+	:return: the list of results of the stages
+	'''
+	games = generate_dataset('.', seed=seed, **config)
+	logger.info(f"Benchmark data of scale {scale} generated: {games}")
+	results = list()
+
+	def cold_parse():
+		# every name is built again, as the first time the files are parsed
+		name_cache.clear()
+	run_stage(results, 'parse_files', lambda _: parse_files('./data/train/'), games['train'], setup=cold_parse,
+			  memory=memory, cache='cold')
+	raw_df = run_stage(results, 'parse_files', lambda: parse_files('./data/train/'), games['train'], memory=memory,
+					   cache='warm')
+	train_df = standard_clean(raw_df)
+	eval_df = read_evaluation_files()
+	first_date = train_df.game_date.min()
+	last_year = int(train_df.game_year.max())
+	year_data = train_df.loc[train_df['game_year'] == last_year]
+
+	def get_players():
+		return prepare_ini_players('rating_2014.txt', train_df)
+
+	for ratings_version in versions:
+		rapid_ratings, _ = check_version(ratings_version)
+		os.makedirs('./data/ratings/' + ratings_version, exist_ok=True)
+		run_stage(results, 'update_ratings', lambda players: update_ratings(players, first_date, year_data,
+																			ratings_version),
+				  len(year_data), setup=get_players, memory=memory, version=ratings_version)
+		for engine in engines:
+			run_stage(results, 'generate_ratings', lambda players: generate_ratings(players, train_df, ratings_version,
+																					engine=engine),
+					  len(train_df), setup=get_players, memory=memory, version=ratings_version, engine=engine)
+		year_ratings = get_year_ratings(last_year, rapid_ratings, ratings_version, stats=True)
+		run_stage(results, 'get_year_ratings', lambda: get_year_ratings(last_year, rapid_ratings, ratings_version,
+																		stats=True),
+				  len(year_ratings[0]), unit='players', memory=memory, version=ratings_version)
+		run_stage(results, 'elo_predictor', lambda: EloPredictor(ratings_version), len(year_ratings[0]),
+				  unit='players', memory=memory, version=ratings_version)
+
+		def evaluate(predictor):
+			# evaluate_predictor prints the first games
+			with contextlib.redirect_stdout(io.StringIO()):
+				return predictor.evaluate_predictor(eval_df)
+		run_stage(results, 'evaluate_predictor', evaluate, len(eval_df),
+				  setup=lambda: EloPredictor(ratings_version), memory=memory, version=ratings_version)
+
+		def predict(predictor):
+			# True if all the files were predicted
+			return not predictor.predict_games('./data/test/', './data/predictions/test/')
+		os.makedirs('./data/predictions/test/', exist_ok=True)
+		run_stage(results, 'predict_games', predict, games['test'], setup=lambda: EloPredictor(ratings_version),
+				  memory=memory, version=ratings_version)
+	return results
+
+def get_output_file():
+	# TODO yaml config file with data path
+	return './data/benchmarks/benchmark_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.json'
+
+def run_benchmarks(scales=('small',), versions=('v1', 'v2', 'v3', 'v4'), engines=('players',), output_file=None,
+				   memory=True, seed=0):
+	'''
+	Function to run the benchmarks of some scales and to save the results. The data of every scale is generated
+	in a temporary folder that is removed at the end, the data folder of the project is not used.
+	:param scales: the names of the scales, see SCALES
+	:param versions: the versions of the ratings
+	:param engines: the rating engines used by generate_ratings
+	:param output_file: the json file of the results, see get_output_file
+	:param memory: True to measure also the peak memory of every stage
+	:param seed: the seed of the synthetic data
+	:return: the dictionary with the results
+	'''
+	output_file = os.path.abspath(output_file if output_file is not None else get_output_file())
+	report = {'benchmark_version': BENCHMARK_VERSION,
+			  'date': datetime.now().isoformat(timespec='seconds'),
+			  'python': platform.python_version(),
+			  'numpy': np.__version__,
+			  'pandas': pd.__version__,
+			  'machine': platform.platform(),
+			  'cpus': os.cpu_count(),
+			  'seed': seed,
+			  'scales': dict()}
+	cwd = os.getcwd()
+	for scale in scales:
+		config = SCALES[scale]
+		work_folder = tempfile.mkdtemp(prefix='benchmark_' + scale + '_')
+		# the project code reads and writes the data folder of the current folder
+		os.chdir(work_folder)
+		try:
+			logger.info(f"Running the benchmarks of scale {scale}")
+			results = run_scale(scale, config, list(versions), list(engines), memory, seed)
+		finally:
+			os.chdir(cwd)
+			shutil.rmtree(work_folder, ignore_errors=True)
+		report['scales'][scale] = {'config': config,
+								   'results': results,
+								   # of the whole process until this scale
+								   'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+	os.makedirs(os.path.dirname(output_file), exist_ok=True)
+	with open(output_file, 'w') as fp:
+		json.dump(report, fp, indent=1)
+		fp.close()
+	logger.info(f"Benchmark results saved at {output_file}")
+	return report
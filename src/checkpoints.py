@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import os
+import pickle
+import pandas as pd
+from src.player import Player
+from src.player_registry import PlayerRegistry
+
+logger = logging.getLogger(__name__)
+
+GAME_COLUMNS = ['game_date', 'white', 'black', 'result', 'time_control']
+
+def get_checkpoint_file(ratings_version, year):
+	# TODO yaml config file with data path
+	return './data/ratings/' + ratings_version + '/checkpoints/state_' + str(year) + '.pickle'
+
+def get_player_state(player):
+	'''
+	:param player: the Player object
+	:return: tuple with all the metrics of the player, except the optional opponents history
+	'''
+	return tuple(getattr(player, attr) for attr in Player.__slots__
+				 if attr not in ('c_opponent_ratings', 'r_opponent_ratings'))
+
+def get_games_digest(year_data):
+	'''
+	Function to compute a digest of the games of a year. The order of the games is part of the digest
+	because the ratings depend on it.
+	:param year_data: the games data of a year
+	:return: the hexadecimal digest
+	'''
+	hashes = pd.util.hash_pandas_object(year_data[GAME_COLUMNS], index=False)
+	return hashlib.sha1(hashes.to_numpy().tobytes()).hexdigest()
+
+def get_players_digest(names, initial_states):
+	'''
+	Function to compute a digest of the initial state of the given players
+	:param names: the set of names of the players that played until the checkpoint year
+	:param initial_states: dictionary with the initial state of every player
+	:return: the hexadecimal digest
+	'''
+	states = sorted((name, initial_states.get(name)) for name in names)
+	return hashlib.sha1(pickle.dumps(states)).hexdigest()
+
+def get_checkpoint_keys(registry, games_data, years):
+	'''
+	Function to compute for every year the digests that a checkpoint of that year needs to match:
+	the digests of the games of every year until that one and the digest of the initial state of the players
+	who played until that year.
+	:param registry: the initial registry of players
+	:param games_data: data with the registered games
+	:param years: the list of years to process
+	:return: dictionary with the games digest per year, dictionary with the players digest per year and
+	dictionary with the set of names that played until every year
+	'''
+	initial_states = {player.name: get_player_state(player) for player in registry}
+	games_digests = dict()
+	players_digests = dict()
+	seen_names = dict()
+	names = set()
+	for year in years:
+		year_data = games_data.loc[games_data['game_year'] == year]
+		games_digests[year] = get_games_digest(year_data)
+		names = names | set(year_data['white'].unique()) | set(year_data['black'].unique())
+		players_digests[year] = get_players_digest(names, initial_states)
+		seen_names[year] = names
+	return games_digests, players_digests, seen_names
+
+def save_checkpoint(ratings_version, year, first_date, games_digests, players_digest, players_list):
+	'''
+	Function to save the full state of the players after processing the games of a year
+	:param ratings_version: version of the ratings
+	:param year: the year processed
+	:param first_date: first date of historical data
+	:param games_digests: dictionary with the digests of the games of every year until this one
+	:param players_digest: digest of the initial state of the players who played until this year
+	:param players_list: the list of Player objects
+	'''
+	checkpoint_file = get_checkpoint_file(ratings_version, year)
+	os.makedirs(os.path.dirname(checkpoint_file), exist_ok=True)
+	state = {'ratings_version': ratings_version,
+			 'year': year,
+			 'first_date': first_date,
+			 'games_digests': games_digests,
+			 'players_digest': players_digest,
+			 'players': players_list}
+	# write to a temporary file first so an interrupted run never leaves a broken checkpoint
+	with open(checkpoint_file + '.tmp', 'wb') as file:
+		pickle.dump(state, file)
+		file.close()
+	os.replace(checkpoint_file + '.tmp', checkpoint_file)
+	logger.debug(f"Checkpoint saved for year {year}")
+
+def load_checkpoint(ratings_version, year, first_date, games_digests, players_digest):
+	'''
+	Function to read the checkpoint of a year if it is still valid for the current games data
+	:param ratings_version: version of the ratings
+	:param year: the year of the checkpoint
+	:param first_date: first date of historical data
+	:param games_digests: dictionary with the current digests of the games of every year
+	:param players_digest: current digest of the initial state of the players who played until this year
+	:return: the list of Player objects or None if there is no valid checkpoint
+	'''
+	checkpoint_file = get_checkpoint_file(ratings_version, year)
+	if not os.path.exists(checkpoint_file):
+		return None
+	try:
+		with open(checkpoint_file, 'rb') as file:
+			state = pickle.load(file)
+			file.close()
+	except Exception as e:
+		logger.warning(f"Ignoring the checkpoint of year {year}. Reason: {e}")
+		return None
+	valid_games = {y: d for y, d in games_digests.items() if y <= year}
+	if state['ratings_version'] != ratings_version or state['first_date'] != first_date \
+			or state['games_digests'] != valid_games or state['players_digest'] != players_digest:
+		logger.info(f"The checkpoint of year {year} does not match the games data")
+		return None
+	return state['players']
+
+def resume_from_checkpoint(registry, ratings_version, years, first_date, checkpoint_keys):
+	'''
+	Function to find the latest valid checkpoint and to rebuild the registry of players from it
+	:param registry: the initial registry of players
+	:param ratings_version: version of the ratings
+	:param years: the list of years to process
+	:param first_date: first date of historical data
+	:param checkpoint_keys: the digests computed by get_checkpoint_keys for the current games data
+	:return: the year of the checkpoint (None if there is no valid one) and the registry to continue with
+	'''
+	games_digests, players_digests, seen_names = checkpoint_keys
+	for year in reversed(years):
+		players_list = load_checkpoint(ratings_version, year, first_date, games_digests, players_digests[year])
+		if players_list is None:
+			continue
+		logger.info(f"Resuming the ratings from the checkpoint of year {year}")
+		# the players who did not play yet take the current initial state, in the same order as a new run
+		names = seen_names[year]
+		saved_players = {player.name: player for player in players_list}
+		resumed = PlayerRegistry(keep_history=registry.keep_history)
+		for player in registry:
+			resumed.add(saved_players.get(player.name, player) if player.name in names else player)
+		for player in players_list:
+			if player.name not in resumed:
+				resumed.add(player)
+		return year, resumed
+	return None, registry
+
+def load_latest_checkpoint(ratings_version):
+	'''
+	Function to read the latest checkpoint of a version without checking it against any games data,
+	used to continue the ratings with new games
+	:param ratings_version: version of the ratings
+	:return: the year of the checkpoint, the first date of historical data and the list of Player objects,
+	(None, None, None) if there is no checkpoint
+	'''
+	folder = os.path.dirname(get_checkpoint_file(ratings_version, 0))
+	if not os.path.isdir(folder):
+		return None, None, None
+	years = sorted([int(file[len('state_'):-len('.pickle')]) for file in os.listdir(folder)
+					if file.startswith('state_') and file.endswith('.pickle')])
+	for year in reversed(years):
+		try:
+			with open(get_checkpoint_file(ratings_version, year), 'rb') as file:
+				state = pickle.load(file)
+				file.close()
+		except Exception as e:
+			logger.warning(f"Ignoring the checkpoint of year {year}. Reason: {e}")
+			continue
+		return year, state['first_date'], state['players']
+	return None, None, None
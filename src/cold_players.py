@@ -0,0 +1,242 @@
+import logging
+import os
+import pickle
+import shutil
+import sqlite3
+from src.player_registry import PlayerRegistry
+
+logger = logging.getLogger(__name__)
+
+'''
+Memory bounded registry of players for very large rosters. At the end of every year the players that did not play
+for some years (the horizon) are moved from memory to an sqlite file, and they are loaded back with the same id
+when they play again. The order of the players and their ratings are the same as with the registry in memory, so
+the year ratings files are identical. Only the players engine without checkpoints uses it, the other engines and
+the checkpoints need the whole list of players in memory.
+@author: A. Rosa Castillo
+'''
+# number of players written to the store at once
+BATCH_SIZE = 10000
+
+def get_cold_store_file(ratings_version):
+	# TODO yaml config file with data path
+	return './data/ratings/' + ratings_version + '/cold_players.sqlite'
+
+class ColdPlayerStore:
+	'''
+	Sqlite file with the pickled players out of memory, indexed by id and by name. It is a temporary file of one
+	run, a previous file is removed unless it is opened again with remove=False.
+	'''
+	def __init__(self, file, remove=True):
+		self.file = file
+		os.makedirs(os.path.dirname(file), exist_ok=True)
+		create = remove or not os.path.exists(file)
+		if remove and os.path.exists(file):
+			os.remove(file)
+		self.connection = sqlite3.connect(file)
+		# nothing to recover if the run fails, the file is built again
+		self.connection.execute('PRAGMA journal_mode=OFF')
+		self.connection.execute('PRAGMA synchronous=OFF')
+		if create:
+			# the name is null for the repeated names of the initial list, only found by id as in the registry
+			self.connection.execute('CREATE TABLE players (player_id INTEGER PRIMARY KEY, name TEXT, state BLOB)')
+			self.connection.execute('CREATE INDEX players_name ON players (name)')
+
+	def put(self, players):
+		'''
+		:param players: iterable of tuples with the id, the name (or None) and the Player object
+		:return: the number of players written
+		'''
+		rows = ((player_id, name, pickle.dumps(player, pickle.HIGHEST_PROTOCOL))
+				for player_id, name, player in players)
+		with self.connection:
+			cursor = self.connection.executemany('INSERT INTO players VALUES (?, ?, ?)', rows)
+		return cursor.rowcount
+
+	def pop(self, name=None, player_id=None):
+		'''
+		It removes a player from the store, found by name or by id
+		:return: a tuple with the id and the Player object, None if the player is not in the store
+		'''
+		if player_id is None:
+			row = self.connection.execute('SELECT player_id, state FROM players WHERE name = ?', (name,)).fetchone()
+		else:
+			row = self.connection.execute('SELECT player_id, state FROM players WHERE player_id = ?',
+										  (player_id,)).fetchone()
+		if row is None:
+			return None
+		with self.connection:
+			self.connection.execute('DELETE FROM players WHERE player_id = ?', (row[0],))
+		return row[0], pickle.loads(row[1])
+
+	def contains(self, name):
+		return self.connection.execute('SELECT 1 FROM players WHERE name = ?', (name,)).fetchone() is not None
+
+	def iter_players(self):
+		'''
+		:return: generator of the tuples of id and Player object of all the players, sorted by id
+		'''
+		for player_id, state in self.connection.execute('SELECT player_id, state FROM players ORDER BY player_id'):
+			yield player_id, pickle.loads(state)
+
+	def __len__(self):
+		return self.connection.execute('SELECT COUNT(*) FROM players').fetchone()[0]
+
+	def close(self, remove=True):
+		self.connection.close()
+		if remove and os.path.exists(self.file):
+			os.remove(self.file)
+
+class ColdPlayerRegistry(PlayerRegistry):
+	'''
+	Registry keeping in memory only the players active in the last years. The slot of a player out of memory is
+	None in the list of players and its name is not in the dictionary of ids until it is loaded again.
+	'''
+	in_memory = False
+
+	def __init__(self, store_file, horizon, players_list=None, keep_history=False, ini_ratings=None,
+				 default_rating=1000):
+		'''
+		:param store_file: the sqlite file of the players out of memory
+		:param horizon: number of years without games before a player leaves the memory at the end of a year, 0 to
+		move all the players to the store every year
+		:param players_list: the initial players, written to the store and not kept in memory until they play. It
+		can be a generator, see iter_ini_players, so the whole roster is never in memory.
+		'''
+		super().__init__(None, keep_history, ini_ratings, default_rating)
+		self.horizon = horizon
+		self.store = ColdPlayerStore(store_file)
+		# ids of the players found since the last eviction and last year with games of the players in memory
+		self.active = set()
+		self.last_years = dict()
+		if players_list is not None:
+			self.put_players(self.get_initial_rows(players_list))
+
+	def get_initial_rows(self, players_list):
+		'''
+		:return: generator of the rows of the store of the initial players, with a slot for every one of them
+		'''
+		# as in the registry in memory, only the first player of a repeated name is found by name
+		names = set()
+		for player_id, player in enumerate(players_list, len(self.players)):
+			self.players.append(None)
+			name = player.name if player.name not in names else None
+			names.add(player.name)
+			yield player_id, name, player
+
+	def copy(self, store_file):
+		'''
+		:param store_file: the sqlite file of the copy
+		:return: a new registry with the same players, the players out of memory are copied with the file
+		'''
+		registry = ColdPlayerRegistry(store_file, self.horizon, None, self.keep_history, self.ini_ratings,
+									  self.default_rating)
+		registry.store.close()
+		shutil.copyfile(self.store.file, store_file)
+		registry.store = ColdPlayerStore(store_file, remove=False)
+		registry.players = list(self.players)
+		registry.ids = dict(self.ids)
+		registry.last_years = dict(self.last_years)
+		registry.active = set(self.active)
+		# the players in memory are copied, the copy of the store has the other ones
+		for player_id, player in enumerate(self.players):
+			if player is not None:
+				registry.players[player_id] = pickle.loads(pickle.dumps(player, pickle.HIGHEST_PROTOCOL))
+		return registry
+
+	def add_initial_players(self, names):
+		# written straight to the store, as the initial players given to the constructor
+		self.put_players(self.get_initial_rows(self.create_player(name) for name in names))
+
+	def put_players(self, players):
+		# in batches, so the rows of the store are not all built at once
+		batch = list()
+		for row in players:
+			batch.append(row)
+			if len(batch) == BATCH_SIZE:
+				self.store.put(batch)
+				batch = list()
+		if batch:
+			self.store.put(batch)
+
+	def load(self, name=None, player_id=None):
+		'''
+		It loads a player from the store into memory, with its id. The player is active in the current year.
+		:return: the Player object or None if the player is not in the store
+		'''
+		row = self.store.pop(name, player_id)
+		if row is None:
+			return None
+		player_id, player = row
+		self.players[player_id] = player
+		self.active.add(player_id)
+		if name is not None or self.ids.get(player.name) is None and not self.store.contains(player.name):
+			self.ids[player.name] = player_id
+		return player
+
+	def add(self, player):
+		player_id = super().add(player)
+		self.active.add(player_id)
+		return player_id
+
+	def get(self, name):
+		player_id = self.ids.get(name)
+		if player_id is None:
+			return self.load(name=name)
+		self.active.add(player_id)
+		return self.players[player_id]
+
+	def get_id(self, name):
+		player_id = self.ids.get(name)
+		if player_id is None and self.get(name) is not None:
+			return self.ids[name]
+		return player_id
+
+	def get_by_id(self, player_id):
+		player = self.players[player_id]
+		if player is None:
+			player = self.load(player_id=player_id)
+		return player
+
+	def evict(self, year):
+		'''
+		It moves to the store the players without games in the horizon years until the given year, included
+		:param year: the year just finished
+		:return: the number of players moved to the store
+		'''
+		for player_id in self.active:
+			self.last_years[player_id] = year
+		self.active = set()
+		cold_ids = [player_id for player_id, last_year in self.last_years.items() if year - last_year >= self.horizon]
+		rows = list()
+		for player_id in cold_ids:
+			player = self.players[player_id]
+			name = player.name if self.ids.get(player.name) == player_id else None
+			if name is not None:
+				del self.ids[name]
+			rows.append((player_id, name, player))
+			self.players[player_id] = None
+			del self.last_years[player_id]
+		self.put_players(rows)
+		logger.debug(f"{len(cold_ids)} players out of memory at the end of {year}, {len(self.last_years)} in memory")
+		return len(cold_ids)
+
+	def close(self):
+		self.store.close()
+
+	def to_list(self):
+		'''
+		:return: the list of all players, loading a copy of the players out of memory
+		'''
+		return list(self)
+
+	def __contains__(self, name):
+		return name in self.ids or self.store.contains(name)
+
+	def __iter__(self):
+		# the players out of memory are read one by one in the order of the ids, they stay in the store
+		cold_players = self.store.iter_players()
+		for player in self.players:
+			if player is None:
+				_, player = next(cold_players)
+			yield player
@@ -0,0 +1,161 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+'''
+Diagnostics of the events repeated for many games or players, like the unknown players of the ratings or the
+players without ratings of the predictor. Every event is sent with its category and the message is only formatted
+if the logger writes it. By default every event is logged as before. In diagnostics mode (the --diagnostics option
+of main.py or the CHESS_DIAGNOSTICS environment variable) the events are counted by category and by player, only
+some samples of every category are logged (the first ones and then the 10th, 100th, 1000th... of the sample limit)
+and a summary is given at the end of the run. The events of worker processes are not counted.
+@author: A. Rosa Castillo
+'''
+DIAGNOSTICS_VARIABLE = 'CHESS_DIAGNOSTICS'
+
+DEFAULT_SAMPLES = 10
+
+# number of names written in the message of a batch of events
+BATCH_NAMES = 5
+
+def get_names_sample(names, size=BATCH_NAMES):
+	'''
+	:return: the text with the number of different names and the first ones, for example
+	"12 players (a, b and 10 more)"
+	'''
+	names = list(dict.fromkeys(names))
+	sample = ', '.join(str(name) for name in names[:size])
+	if len(names) > size:
+		sample += f" and {len(names) - size} more"
+	return f"{len(names)} players ({sample})"
+
+class Diagnostics:
+	def __init__(self):
+		self.enabled = False
+		self.sample_limit = DEFAULT_SAMPLES
+		self.counts = dict()
+		# category -> player -> number of events
+		self.players = dict()
+		# number of logged samples and next sample after the sample limit of every category
+		self.logged = dict()
+		self.next_sample = dict()
+
+	def enable(self, sample_limit=DEFAULT_SAMPLES):
+		'''
+		:param sample_limit: number of events of every category logged before logging only some samples
+		'''
+		self.enabled = True
+		self.sample_limit = sample_limit
+
+	def enable_from_environment(self):
+		'''
+		It enables the diagnostics if the environment variable asks for it, the value can be the sample limit
+		:return: True if it is enabled
+		'''
+		value = os.environ.get(DIAGNOSTICS_VARIABLE, '')
+		if value not in ('', '0'):
+			self.enable(int(value) if value.isdigit() and value != '1' else DEFAULT_SAMPLES)
+		return self.enabled
+
+	def event(self, category, event_logger, level, message, *args, players=None):
+		'''
+		It logs or counts an event
+		:param category: the category of the event
+		:param event_logger: the logger of the module of the event
+		:param level: the logging level of the message
+		:param message: the message with %s placeholders, formatted only if it is written
+		:param args: the values of the placeholders
+		:param players: optional list of the players of the event
+		'''
+		if not self.enabled:
+			if event_logger.isEnabledFor(level):
+				event_logger.log(level, message, *args, stacklevel=2)
+			return
+		count = self.counts.get(category, 0) + 1
+		self.counts[category] = count
+		if players is not None:
+			self.add_players(category, players)
+		if count > self.sample_limit:
+			next_sample = self.next_sample.get(category, self.sample_limit * 10)
+			if count != next_sample:
+				return
+			self.next_sample[category] = next_sample * 10
+		if event_logger.isEnabledFor(level):
+			self.logged[category] = self.logged.get(category, 0) + 1
+			event_logger.log(level, message + ' [%s event %d]', *args, category, count, stacklevel=2)
+
+	def batch_event(self, category, event_logger, level, message, players):
+		'''
+		It logs or counts one event for every player of a batch, with a single message that gives the number of
+		different players and only the first names, see get_names_sample
+		:param category: the category of the events
+		:param event_logger: the logger of the module of the events
+		:param level: the logging level of the message
+		:param message: the message with one %s placeholder for the players
+		:param players: the list of players, one event per player and game, as with event for every game
+		'''
+		if not self.enabled:
+			if event_logger.isEnabledFor(level):
+				event_logger.log(level, message, get_names_sample(players), stacklevel=2)
+			return
+		first = self.counts.get(category, 0) + 1
+		count = first - 1 + len(players)
+		self.counts[category] = count
+		self.add_players(category, players)
+		# logged if some event of the batch is a sample
+		if count > self.sample_limit:
+			next_sample = self.next_sample.get(category, self.sample_limit * 10)
+			if first > self.sample_limit and count < next_sample:
+				return
+			while next_sample <= count:
+				next_sample *= 10
+			self.next_sample[category] = next_sample
+		if event_logger.isEnabledFor(level):
+			self.logged[category] = self.logged.get(category, 0) + 1
+			event_logger.log(level, message + ' [%s events %d-%d]', get_names_sample(players), category, first, count,
+							 stacklevel=2)
+
+	def add_players(self, category, players):
+		category_players = self.players.get(category)
+		if category_players is None:
+			category_players = dict()
+			self.players[category] = category_players
+		for player in players:
+			category_players[player] = category_players.get(player, 0) + 1
+
+	def get_summary(self, top=10):
+		'''
+		:param top: number of players with more events given for every category
+		:return: dictionary with the number of events, of logged events and of players of every category and the
+		players with more events
+		'''
+		summary = dict()
+		for category, count in sorted(self.counts.items()):
+			category_players = self.players.get(category, dict())
+			top_players = sorted(category_players.items(), key=lambda item: (-item[1], item[0]))[:top]
+			summary[category] = {'events': count,
+								 'logged': self.logged.get(category, 0),
+								 'players': len(category_players),
+								 'top_players': top_players}
+		return summary
+
+	def format_summary(self, top=10):
+		'''
+		:return: the summary as text, see get_summary
+		'''
+		lines = list()
+		for category, values in self.get_summary(top).items():
+			lines.append(f"{category}: {values['events']} events, {values['logged']} logged, "
+						 f"{values['players']} players")
+			for player, count in values['top_players']:
+				lines.append(f"    {player}: {count}")
+		return '\n'.join(lines) if lines else "No diagnostics events"
+
+	def reset(self):
+		self.counts = dict()
+		self.players = dict()
+		self.logged = dict()
+		self.next_sample = dict()
+
+diagnostics = Diagnostics()
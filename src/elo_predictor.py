@@ -1,7 +1,14 @@
 from src.io_utils import *
-from src.predictor import Predictor
-from src.elo_ratings import check_version
+from src.predictor import Predictor, get_batch_games
+from src.elo_ratings import DEFAULT_PARAMETERS, check_version
+from src.snapshots import get_snapshot_ratings, get_snapshot_years
+from src.rating_history import RatingHistory, get_days, get_history_years
+from src.predictor_artifact import PredictorArtifact, get_artifact_file
+from src.instrumentation import instrumentation
+from src.diagnostics import diagnostics
+from collections import OrderedDict
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import logging
 import math
@@ -27,7 +34,8 @@ def check_player_rating(player_name, players_pool, year_ratings, game_type, two_
 			return ratings[0]
 		return ratings # only one rating
 
-	logger.info(f"No rating information for {player_name}, giving average rating of 1000")
+	diagnostics.event('no_rating', logger, logging.INFO, "No rating information for %s, giving average rating of 1000",
+					  player_name, players=(player_name,))
 	return 1000
 
 def check_player_win_prob(player_name, players_pool, c_stats, r_stats, game_type, two_ratings):
@@ -62,7 +70,8 @@ def check_player_win_prob(player_name, players_pool, c_stats, r_stats, game_type
 		games = stats[1]
 		return wins/games
 
-	logger.warning(f"No information from player {player_name}")
+	diagnostics.event('no_statistics', logger, logging.WARNING, "No information from player %s", player_name,
+					  players=(player_name,))
 	return 0.5 # no info
 
 def get_year_ratings(year, rapid_ratings, ratings_version, stats=False):
@@ -72,10 +81,8 @@ def get_year_ratings(year, rapid_ratings, ratings_version, stats=False):
 		folder = "./data/ratings/" + ratings_version +"/"
 		# TODO yaml config file with data path
 		players_list = pd.read_pickle(folder + ratings_file)
-		players = pd.DataFrame()
-		for player in players_list:
-			player_df = pd.DataFrame([player])
-			players = pd.concat([players, player_df], ignore_index=True)
+		# one dataframe from all the dictionaries at once, the columns are the keys of the dictionaries
+		players = pd.DataFrame(players_list)
 
 		logger.debug("Ratings information loaded successfully")
 		r_stats_dict = None
@@ -95,23 +102,24 @@ def get_year_ratings(year, rapid_ratings, ratings_version, stats=False):
 		logger.error(f"Reason {e}")
 		return None
 
-def compute_probability(elo_p, game_type):
+def compute_probability(elo_p, game_type, params=DEFAULT_PARAMETERS):
 	'''
 	It returns the predicted result based on the winning probability of white player
 	:param elo_p: winning probability of white player based on the elo ratings difference
 	:param game_type: type of game classic or rapic
+	:param params: the parameters with the draw thresholds, the values found with the evaluation data by default
 	:return: 0.5 for draw, 1.0 for white and 0.0 for black
 	'''
 	draw = 0.5
 	if game_type == 'classic':
 		# 44% of cases are draw so the range needs to be wider
-		w_threshold = 0.65
-		high_draw_prob = (elo_p >= 0.40 and elo_p <= w_threshold)
+		d_threshold, w_threshold = params.classic_draw
+		high_draw_prob = (elo_p >= d_threshold and elo_p <= w_threshold)
 
 	else:
 		# 36% are the white player the winner
-		w_threshold = 0.55
-		high_draw_prob = (elo_p >= 0.45 and elo_p < w_threshold)
+		d_threshold, w_threshold = params.rapid_draw
+		high_draw_prob = (elo_p >= d_threshold and elo_p < w_threshold)
 
 	if high_draw_prob:
 		return draw
@@ -120,6 +128,42 @@ def compute_probability(elo_p, game_type):
 		return 1.0
 	return 0.0
 
+def compute_elo_probabilities(elo_rating_diffs):
+	'''
+	It computes the winning probabilities of white players for many ratings differences at once. math.pow is used
+	for every different value so the probabilities are exactly the same ones as for a single game.
+	:param elo_rating_diffs: numpy array with the differences between the white and the black ratings
+	:return: numpy array with the winning probabilities of the white players
+	'''
+	unique_diffs, inverse = np.unique(elo_rating_diffs, return_inverse=True)
+	d = np.array([math.pow(10, -diff / 400) for diff in unique_diffs.tolist()], dtype=float)
+	return 1 / (d[inverse] + 1)
+
+def compute_probabilities(elo_p, classic_games, params=DEFAULT_PARAMETERS):
+	'''
+	Vectorised version of compute_probability for many games at once
+	:param elo_p: numpy array with the winning probabilities of the white players
+	:param classic_games: boolean numpy array, True for the classic games and False for the rapid ones
+	:param params: the parameters with the draw thresholds
+	:return: numpy array with the predicted results, 0.5 for draw, 1.0 for white and 0.0 for black
+	'''
+	c_draw, c_white = params.classic_draw
+	r_draw, r_white = params.rapid_draw
+	# the upper limit of the draw range is included only for classic games
+	high_draw_prob = np.where(classic_games, (elo_p >= c_draw) & (elo_p <= c_white),
+							  (elo_p >= r_draw) & (elo_p < r_white))
+	w_threshold = np.where(classic_games, c_white, r_white)
+	return np.where(high_draw_prob, 0.5, np.where(elo_p >= w_threshold, 1.0, 0.0))
+
+def get_win_probabilities(wins, games):
+	'''
+	:return: numpy array with the winning probabilities of the players, 0.5 for the players without games
+	'''
+	win_prob = np.full(len(wins), 0.5)
+	with_games = games > 0
+	win_prob[with_games] = wins[with_games] / games[with_games]
+	return win_prob
+
 def get_factor(r):
 	if r >= 2000 and r <= 2350:
 		return 100
@@ -133,29 +177,76 @@ def correction_factor(white_rating, black_rating):
 	return white_rating + get_factor(white_rating), black_rating + get_factor(black_rating)
 
 class EloPredictor(Predictor):
-	def __init__(self, ratings_version):
+	def __init__(self, ratings_version, cache_size=4):
 		super().__init__("Elo Predictor")
 		self.rapid_ratings, _ = check_version(ratings_version)
 		self.ratings_version = ratings_version
-		# getting all available years from the available info
-		self.avlb_years = get_available_rating_years_info(ratings_version)
+		# compiled ratings of all the years read at once, see compile_predictor
+		self.artifact = None
+		if os.path.exists(get_artifact_file(ratings_version)):
+			logger.info(f"Loading the compiled ratings of version {ratings_version}")
+			with instrumentation.stage('predictor_load') as stage:
+				self.artifact = PredictorArtifact(ratings_version)
+				stage.add(len(self.artifact.names))
+		if self.artifact is not None:
+			self.avlb_years = [str(year) for year in self.artifact.years.tolist()]
+			self.snapshot_years = list()
+			self.history_years = self.artifact.history_years
+		else:
+			# getting all available years from the available info
+			self.avlb_years = get_available_rating_years_info(ratings_version)
+			# years with a columnar snapshot, they are memory-mapped instead of unpickled
+			self.snapshot_years = get_snapshot_years(ratings_version)
+			# years with a rating history, the games of those years use the ratings as of the date of the game
+			self.history_years = get_history_years(ratings_version)
 		logger.debug(f"Available years {self.avlb_years}")
+		# years added directly, they are never removed
 		self.found_ratings = dict()
 		self.found_c_stats = dict()
 		self.found_r_stats = dict()
-		self.initialize_all_ratings()
+		# years loaded from disk when they are first needed, the least recently used one is removed when full
+		self.cache_size = cache_size
+		self.year_cache = OrderedDict()
+		self.histories = dict()
 
-	def initialize_all_ratings(self):
-		logger.info("Initializing Elo predictor")
-		for game_year in self.avlb_years:
-			# get the ratings
-			year_ratings, c_stats, r_stats = get_year_ratings(game_year, self.rapid_ratings,
-															  self.ratings_version, stats=True)
+	def load_year(self, game_year):
+		'''
+		:param game_year: the year of the ratings as a string
+		:return: the ratings, the classic statistics and the rapid statistics of the year
+		'''
+		logger.info(f"Loading the ratings of year {game_year}")
+		with instrumentation.stage('predictor_load') as stage:
+			year_data = None
+			if self.artifact is not None:
+				year_data = self.artifact.get_year_data(game_year)
+			elif game_year in self.snapshot_years:
+				year_data = get_snapshot_ratings(game_year, self.rapid_ratings, self.ratings_version, stats=True)
+			if year_data is None:
+				year_data = get_year_ratings(game_year, self.rapid_ratings, self.ratings_version, stats=True)
+			if year_data is not None:
+				stage.add(len(year_data[0]))
+		return year_data
 
-			logger.info("Adding year information to the list of available ratings")
-			self.found_ratings[game_year] = year_ratings
-			self.found_c_stats[game_year] = c_stats
-			self.found_r_stats[game_year] = r_stats
+	def get_year_data(self, game_year):
+		'''
+		It returns the ratings of a year, loading them from disk if they are not in the cache
+		:param game_year: the year of the ratings as a string
+		:return: the ratings, the classic statistics and the rapid statistics of the year
+		'''
+		if game_year in self.found_ratings:
+			return self.found_ratings[game_year], self.found_c_stats[game_year], self.found_r_stats[game_year]
+		year_data = self.year_cache.get(game_year)
+		if year_data is not None:
+			self.year_cache.move_to_end(game_year)
+			return year_data
+		year_data = self.load_year(game_year)
+		if year_data is None:
+			return None
+		self.year_cache[game_year] = year_data
+		if len(self.year_cache) > self.cache_size:
+			old_year, _ = self.year_cache.popitem(last=False)
+			logger.debug(f"Removing the ratings of year {old_year} from the cache")
+		return year_data
 
 	def evaluate_predictor(self, evaluation_df):
 		'''
@@ -168,25 +259,15 @@ class EloPredictor(Predictor):
 		logger.info(f"Evaluating the predictor for {total_games} games")
 		evaluation_df = evaluation_df.sort_values(by='game_date')
 
-		predictions = pd.DataFrame()
-		# for each game, predict the result
-		for row in evaluation_df.itertuples():
-			dict_row = row._asdict()
-			game_year = dict_row['game_year']
-			game_type = dict_row['time_control']
-			pred, elo_p, white_prob, black_prob = self.compute_prediction_data(game_year,
-																			   dict_row['white'],
-																			   dict_row['black'],
-																			   game_type)
-
-			tmp = {'game_date': row.game_date,
-				   'probability': elo_p,
-				   'white_prob': white_prob,
-				   'black_prob': black_prob,
-				   'predicted': pred,
-				   'actual': dict_row['result'],
-				   'time_control': game_type}
-			predictions = predictions.append(tmp, ignore_index=True)
+		# predict the result of all games at once
+		pred, elo_p, white_prob, black_prob = self.predict_batch(evaluation_df)
+		predictions = pd.DataFrame({'game_date': evaluation_df['game_date'].to_numpy(),
+									'probability': elo_p,
+									'white_prob': white_prob,
+									'black_prob': black_prob,
+									'predicted': pred,
+									'actual': evaluation_df['result'].to_numpy(dtype=float),
+									'time_control': evaluation_df['time_control'].to_numpy(dtype=object)})
 
 		predictions['correct'] = predictions.predicted == predictions.actual
 		correct_predictions = predictions.correct.sum()
@@ -196,20 +277,254 @@ class EloPredictor(Predictor):
 		predictions.to_pickle("./data/predictions/predictor_"+self.ratings_version)
 		return accuracy, correct_predictions
 
-	def compute_prediction_data(self, game_year, white_name, black_name, game_type):
-		while str(game_year) not in self.avlb_years:
-			logger.debug("Searching for a previous year information")
-			game_year = game_year - 1
-		if str(game_year) in self.avlb_years:
-			year_ratings = self.found_ratings[str(game_year)]
-			c_stats = self.found_c_stats[str(game_year)]
-			r_stats = self.found_r_stats[str(game_year)]
+	def predict_batch(self, white_players, black_players=None, game_dates=None, game_types=None):
+		'''
+		It predicts the results of many games at once, see Predictor.predict_batch
+		:param white_players: the names of the white players or the dataframe with the games
+		:param black_players: the names of the black players
+		:param game_dates: the dates of the games, as strings with format %Y-%m-%d or as timestamps
+		:param game_types: the types of the games
+		:return: numpy arrays with the predicted results, the winning probabilities of white based on the ratings
+		and the winning probabilities of white and black players based on statistics
+		'''
+		if isinstance(white_players, pd.DataFrame) and 'game_year' in white_players.columns:
+			game_years = white_players['game_year'].to_numpy()
 		else:
+			game_years = None
+		white_players, black_players, game_dates, game_types = get_batch_games(white_players, black_players,
+																			   game_dates, game_types)
+		if game_years is None:
+			# numpy parses the %Y-%m-%d strings much faster than pandas for the small batches of a tournament
+			game_years = np.asarray(game_dates).astype('datetime64[Y]').astype(int) + 1970
+		return self.compute_batch_data(game_years, white_players, black_players, game_types, game_dates)
+
+	def get_ratings_year(self, game_year):
+		'''
+		:param game_year: the year of the game
+		:return: the latest year with ratings information until the year of the game, None if there is no one
+		'''
+		years = [int(year) for year in self.avlb_years if int(year) <= int(game_year)]
+		if not years:
+			return None
+		return str(max(years))
+
+	def get_history(self, game_year):
+		'''
+		:param game_year: the year of the games
+		:return: the rating history of the year, None if there is no one
+		'''
+		game_year = str(game_year)
+		if game_year not in self.history_years:
+			return None
+		if game_year not in self.histories:
+			logger.info(f"Loading the rating history of year {game_year}")
+			self.histories[game_year] = RatingHistory(self.ratings_version, game_year)
+		return self.histories[game_year]
+
+	def get_players_data(self, names, game_types, year_data, history=None, days=None):
+		'''
+		It searches the rating and the winning probability of the players of many games in the ratings of a year
+		:param names: numpy array with the names of the players
+		:param game_types: numpy array with the type of every game
+		:param year_data: the ratings, the classic statistics and the rapid statistics of the year
+		:param history: optional rating history of the year of the games, the players with games in the year
+		before the date of the game take the values of the history instead of the ones of year_data
+		:param days: numpy array with the date of every game as days since 1970-01-01, used with the history
+		:return: numpy arrays with the ratings and with the winning probabilities of the players
+		'''
+		year_ratings, c_stats, r_stats = year_data
+		rapid = (game_types == 'rapid') & self.rapid_ratings
+		# every different player is searched only once
+		unique_names, inverse = np.unique(names.astype(str), return_inverse=True)
+		found = np.array([name in year_ratings for name in unique_names], dtype=bool)
+		# one flag per game, a name can be in the history for a game and not for an earlier one
+		missing = ~found[inverse]
+		if history is not None:
+			in_history, values = history.as_of(names.astype(str), days)
+			missing &= ~in_history
+		if missing.any():
+			# one event per game, as check_player_rating
+			missing_names = unique_names[inverse[missing]].tolist()
+			diagnostics.batch_event('no_rating', logger, logging.INFO, "No rating information for %s, giving average "
+									"rating of 1000", missing_names)
+		ratings = np.full((len(unique_names), 2), 1000.0)
+		wins = np.zeros((len(unique_names), 2))
+		games = np.zeros((len(unique_names), 2))
+		for i in np.flatnonzero(found):
+			name = unique_names[i]
+			ratings[i] = year_ratings[name]
+			if c_stats and r_stats:
+				wins[i, 0], games[i, 0] = c_stats[name]
+				if self.rapid_ratings:
+					wins[i, 1], games[i, 1] = r_stats[name]
+		# position 0 is classic, position 1 is rapid
+		slots = rapid.astype(np.int64)
+		player_ratings = ratings[inverse, slots]
+		player_wins = wins[inverse, slots]
+		player_games = games[inverse, slots]
+		if history is not None:
+			self.set_values(in_history, values, slots, player_ratings, player_wins, player_games, self.rapid_ratings)
+		return player_ratings, get_win_probabilities(player_wins, player_games)
+
+	def set_values(self, rows, values, slots, player_ratings, player_wins, player_games, stats):
+		'''
+		It copies the rating and the statistics of some players from an array of values
+		:param rows: boolean array with the players to set
+		:param values: array with the columns rating, rapid_rating, classic_wins, classic_games, rapid_wins and
+		rapid_games of every player
+		:param slots: array with 0 for the classic games and 1 for the rapid games with a separate rating
+		:param stats: False if the statistics should not be used, as for the versions with one rating
+		'''
+		player_ratings[rows] = values[rows, slots[rows]]
+		if stats:
+			player_wins[rows] = values[rows, 2 + 2 * slots[rows]]
+			player_games[rows] = values[rows, 3 + 2 * slots[rows]]
+
+	def get_compiled_players_data(self, names, slots, year_indices, history_rows, histories, days):
+		'''
+		Same as get_players_data with the compiled ratings for the games of many years at once
+		:param names: numpy array with the names of the players
+		:param slots: array with 0 for the classic games and 1 for the rapid games with a separate rating
+		:param year_indices: array with the index of the compiled year of every game, see get_year_indices
+		:param history_rows: dictionary with the rows of the games of every year with a rating history
+		:param histories: dictionary with the rating history of every year with one
+		:param days: numpy array with the date of every game as days since 1970-01-01
+		:return: numpy arrays with the ratings and with the winning probabilities of the players
+		'''
+		artifact = self.artifact
+		player_ids = artifact.get_player_ids(names)
+		found, values = artifact.lookup(player_ids, year_indices)
+		player_ratings = np.full(len(names), 1000.0)
+		player_wins = np.zeros(len(names))
+		player_games = np.zeros(len(names))
+		# the statistics of every game depend on its year, as with the dictionaries of every year
+		with_stats = found & artifact.has_stats[np.maximum(year_indices, 0)] if len(artifact.years) else found
+		player_ratings[found] = values[found, slots[found]]
+		player_wins[with_stats] = values[with_stats, 2 + 2 * slots[with_stats]]
+		player_games[with_stats] = values[with_stats, 3 + 2 * slots[with_stats]]
+		for game_year, rows in history_rows.items():
+			in_history, history_values = histories[game_year].as_of(names[rows], days[rows])
+			# the rows are copied by the indexing, they are set back after updating them
+			rows_ratings, rows_wins, rows_games = player_ratings[rows], player_wins[rows], player_games[rows]
+			self.set_values(in_history, history_values, slots[rows], rows_ratings, rows_wins, rows_games,
+							self.rapid_ratings)
+			player_ratings[rows], player_wins[rows], player_games[rows] = rows_ratings, rows_wins, rows_games
+			found[rows[in_history]] = True
+		if not found.all():
+			missing = np.asarray(names)[~found].astype(str).tolist()
+			diagnostics.batch_event('no_rating', logger, logging.INFO, "No rating information for %s, giving average "
+									"rating of 1000", missing)
+		return player_ratings, get_win_probabilities(player_wins, player_games)
+
+	def compute_compiled_batch_data(self, game_years, white_names, black_names, game_types, game_dates=None):
+		'''
+		Same as compute_batch_data with the compiled ratings, all the games are searched at once
+		'''
+		game_years = np.asarray(game_years).astype(np.int64)
+		game_types = np.asarray(game_types, dtype=object)
+		white_names = np.asarray(white_names, dtype=object)
+		black_names = np.asarray(black_names, dtype=object)
+		artifact = self.artifact
+		year_indices = artifact.get_year_indices(game_years)
+		no_data = year_indices < 0
+		for game_year in np.unique(game_years[no_data]).tolist():
+			logger.error(f"No ratings information available for {game_year}")
+		if instrumentation.enabled:
+			# games predicted with the ratings of a previous year
+			instrumentation.count('year_fallbacks', int((artifact.years[year_indices[~no_data]] !=
+														 game_years[~no_data]).sum()))
+		# the games of the years with a rating history start from the ratings of the previous year
+		history_rows = dict()
+		histories = dict()
+		if game_dates is not None:
+			for year_index in np.unique(year_indices[~no_data]).tolist():
+				game_year = int(artifact.years[year_index])
+				rows = np.flatnonzero((game_years == game_year) & (year_indices == year_index))
+				history = self.get_history(game_year) if len(rows) else None
+				if history is None:
+					continue
+				history_rows[game_year] = rows
+				histories[game_year] = history
+				year_indices[rows] = artifact.get_year_indices([game_year - 1])[0]
+		days = get_days(game_dates) if history_rows else None
+		slots = ((game_types == 'rapid') & self.rapid_ratings).astype(np.int64)
+		white_ratings, white_prob = self.get_compiled_players_data(white_names, slots, year_indices, history_rows,
+																   histories, days)
+		black_ratings, black_prob = self.get_compiled_players_data(black_names, slots, year_indices, history_rows,
+																   histories, days)
+		elo_p = compute_elo_probabilities(white_ratings - black_ratings)
+		pred = compute_probabilities(elo_p, game_types == 'classic')
+		# games without ratings information
+		for values in (pred, elo_p, white_prob, black_prob):
+			values[no_data] = np.nan
+		return pred, elo_p, white_prob, black_prob
+
+	def compute_batch_data(self, game_years, white_names, black_names, game_types, game_dates=None):
+		'''
+		Same as compute_prediction_data for many games at once. If the year of the games has a rating history,
+		the players take their ratings as of the date of the game: the ones of the end of the previous year
+		updated with their games of the year before that date.
+		:param game_years: numpy array with the year of every game
+		:param white_names: numpy array with the names of the white players
+		:param black_names: numpy array with the names of the black players
+		:param game_types: numpy array with the type of every game
+		:param game_dates: numpy array with the date of every game, needed to use the rating histories
+		:return: numpy arrays with the predicted results, the winning probabilities based on the ratings and
+		the winning probabilities of white and black players based on statistics
+		'''
+		if self.artifact is not None:
+			return self.compute_compiled_batch_data(game_years, white_names, black_names, game_types, game_dates)
+		total_games = len(game_years)
+		white_ratings = np.full(total_games, np.nan)
+		black_ratings = np.full(total_games, np.nan)
+		white_prob = np.full(total_games, np.nan)
+		black_prob = np.full(total_games, np.nan)
+		game_years = np.asarray(game_years).astype(int)
+		game_types = np.asarray(game_types, dtype=object)
+		for game_year in np.unique(game_years):
+			ratings_year = self.get_ratings_year(game_year)
+			history = self.get_history(game_year) if game_dates is not None and ratings_year == str(game_year) \
+				else None
+			if history is not None:
+				# the ratings of the end of the year would include the games after the date
+				base_year = self.get_ratings_year(game_year - 1)
+				year_data = self.get_year_data(base_year) if base_year is not None else None
+				if year_data is None:
+					year_data = (dict(), None, None)
+			else:
+				year_data = self.get_year_data(ratings_year) if ratings_year is not None else None
+			if year_data is None:
+				logger.error(f"No ratings information available for {game_year}")
+				continue
+			rows = np.flatnonzero(game_years == game_year)
+			if ratings_year != str(game_year):
+				instrumentation.count('year_fallbacks', len(rows))
+			days = get_days(np.asarray(game_dates)[rows]) if history is not None else None
+			white_ratings[rows], white_prob[rows] = self.get_players_data(np.asarray(white_names)[rows],
+																		  game_types[rows], year_data, history, days)
+			black_ratings[rows], black_prob[rows] = self.get_players_data(np.asarray(black_names)[rows],
+																		  game_types[rows], year_data, history, days)
+		elo_p = compute_elo_probabilities(white_ratings - black_ratings)
+		pred = compute_probabilities(elo_p, game_types == 'classic')
+		# games without ratings information
+		pred[np.isnan(elo_p)] = np.nan
+		return pred, elo_p, white_prob, black_prob
+
+	def compute_prediction_data(self, game_year, white_name, black_name, game_type):
+		ratings_year = self.get_ratings_year(game_year)
+		if ratings_year is not None and ratings_year != str(game_year):
+			# once per game, as in compute_batch_data
+			diagnostics.event('year_fallback', logger, logging.DEBUG, "Using the ratings of %s for a game of %s",
+							  ratings_year, game_year)
+			instrumentation.count('year_fallbacks')
+		year_data = self.get_year_data(ratings_year) if ratings_year is not None else None
+		if year_data is None:
 			logger.error(f"No ratings information available for {game_year}")
 			return 0
+		year_ratings, c_stats, r_stats = year_data
 
-		players_pool = list(year_ratings.keys())
-		logger.debug(f"Total number of players = {len(players_pool)}")
+		# the dictionary keys are the pool of players, searching there is much faster than in a list
+		players_pool = year_ratings
 		white_rating = check_player_rating(white_name, players_pool,
 										   year_ratings, game_type, self.rapid_ratings)
 		black_rating = check_player_rating(black_name, players_pool,
@@ -217,7 +532,8 @@ class EloPredictor(Predictor):
 
 		#white_rating, black_rating = correction_factor(white_rating, black_rating)
 		elo_rating_diff = white_rating - black_rating
-		logger.debug(f"Elo ratings difference = {elo_rating_diff}")
+		diagnostics.event('prediction_data', logger, logging.DEBUG, "Total number of players = %d, elo ratings "
+						  "difference = %s", len(players_pool), elo_rating_diff)
 		d = math.pow(10, -elo_rating_diff / 400)
 		elo_p = 1 / (d + 1)
 
@@ -229,12 +545,13 @@ class EloPredictor(Predictor):
 		return pred, elo_p, white_prob, black_prob
 
 	def get_prediction(self, white_player, black_player, game_date, game_type):
-		if isinstance(game_date, str):
-			game_date = datetime.strptime(game_date, '%Y-%m-%d')
-			game_year = game_date.year
-		else:
-			# game date should be of timestamp class
-			game_year = game_date.dt.year
-		pred, elo_p, white_prob, black_prob = self.compute_prediction_data(game_year, white_player,
-																		   black_player, game_type)
-		return pred
+		'''
+		It predicts one game with predict_batch, so the ratings are the same ones as for a batch of games, as of the
+		date of the game for the years with a rating history
+		:param game_date: the date of the game, as a string with format %Y-%m-%d or as a timestamp
+		:return: the predicted result, nan if there is no ratings information for the year of the game
+		'''
+		if not isinstance(game_date, str):
+			game_date = pd.Timestamp(game_date).strftime('%Y-%m-%d')
+		pred, _, _, _ = self.predict_batch([white_player], [black_player], [game_date], [game_type])
+		return float(pred[0])
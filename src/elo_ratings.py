@@ -1,8 +1,16 @@
+import copy
 import math
 import logging
 import pickle
 import json
 from src.player import Player
+from src.player_registry import PlayerRegistry
+from src.checkpoints import get_checkpoint_keys, resume_from_checkpoint, save_checkpoint
+from src.snapshots import RatingsSnapshot, SnapshotWriter, save_snapshot
+from src.rating_history import HistoryRecorder, save_history
+from src.predictor_artifact import remove_artifact
+from src.instrumentation import instrumentation
+from src.diagnostics import diagnostics
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +31,38 @@ def check_version(ratings_version):
 	if (ratings_version == 'v4') or (ratings_version == 'v4_val'):
 		return False, True
 
+'''
+Class to keep the parameters of the Elo rating system and of the predictor.
+The default values are the ones given by FIDE and the ones found with the evaluation data.
+@author: A. Rosa Castillo
+'''
+class EloParameters:
+	def __init__(self, seed=1000, k_rapid=20, k_top=10, k_new=40, k_default=20, new_player_games=30,
+				 prov_games=20, top_rating=2400, classic_draw=(0.40, 0.65), rapid_draw=(0.45, 0.55)):
+		# initial rating of the players without any rating information
+		self.seed = seed
+		self.k_rapid = k_rapid
+		self.k_top = k_top
+		self.k_new = k_new
+		self.k_default = k_default
+		# number of games until a player is not considered new for the k factor
+		self.new_player_games = new_player_games
+		# number of games until a provisional rating becomes a normal one
+		self.prov_games = prov_games
+		# rating from which a player is considered a top player
+		self.top_rating = top_rating
+		# range of the winning probability of white predicted as a draw
+		self.classic_draw = classic_draw
+		self.rapid_draw = rapid_draw
+
+	def to_dict(self):
+		return {'seed': self.seed, 'k_rapid': self.k_rapid, 'k_top': self.k_top, 'k_new': self.k_new,
+				'k_default': self.k_default, 'new_player_games': self.new_player_games,
+				'prov_games': self.prov_games, 'top_rating': self.top_rating,
+				'classic_draw': self.classic_draw, 'rapid_draw': self.rapid_draw}
+
+DEFAULT_PARAMETERS = EloParameters()
+
 def compute_estimate(rating_w, rating_b):
 	'''
 	Function to compute the probability for player a and for player b to win
@@ -37,7 +77,7 @@ def compute_estimate(rating_w, rating_b):
 	e_b = q_b / (q_w + q_b)
 	return e_w, e_b
 
-def compute_k_factor(rating_w, rating_b, game_type, games_w, games_b):
+def compute_k_factor(rating_w, rating_b, game_type, games_w, games_b, params=DEFAULT_PARAMETERS):
 	'''
 	K = 20 for RAPID and BLITZ ratings all players.
 	K = 10 for a top player with rating >= 2400
@@ -49,24 +89,25 @@ def compute_k_factor(rating_w, rating_b, game_type, games_w, games_b):
 	:param game_type: the type of game they played
 	:param games_w: the number of games player w played
 	:param games_b: the number of games player b played
+	:param params: the parameters of the rating system, FIDE values by default
 	:return:
 	'''
 	if game_type == 'rapid':
-		return 20, 20
+		return params.k_rapid, params.k_rapid
 	k_w = -1
 	k_b = -1
-	if rating_w >= 2400:
-		k_w = 10
-	if rating_b >= 2400:
-		k_b = 10
-	if k_w == -1 and games_w < 30:
-		k_w = 40
-	if k_b == -1 and games_b < 30:
-		k_b = 40
+	if rating_w >= params.top_rating:
+		k_w = params.k_top
+	if rating_b >= params.top_rating:
+		k_b = params.k_top
+	if k_w == -1 and games_w < params.new_player_games:
+		k_w = params.k_new
+	if k_b == -1 and games_b < params.new_player_games:
+		k_b = params.k_new
 	if k_w == -1:
-		k_w = 20 # rating has to be under 2400
+		k_w = params.k_default # rating has to be under 2400
 	if k_b == -1:
-		k_b = 20
+		k_b = params.k_default
 	return k_w, k_b
 
 def get_scores(result):
@@ -129,7 +170,8 @@ def check_new_ratings(w_player, b_player, e_w, e_b, k_w, k_b, score_w, score_b,
 			b_player.set_rating(round(new_rating_b), rapid_game)
 
 		if new_rating_w < 0 or new_rating_b < 0:
-			logger.warning("Negative rating reached. No change")
+			diagnostics.event('negative_rating', logger, logging.WARNING, "Negative rating reached. No change",
+							  players=(w_player.name, b_player.name))
 			# just keep the previous value. Alternative: mean tournament rating
 
 
@@ -139,19 +181,29 @@ https://en.wikipedia.org/wiki/Elo_rating_system
 @author: A. Rosa Castillo
 '''
 class EloRatings:
-	def __init__(self, players_list, first_date, last_date):
-		self.players = players_list
+	def __init__(self, players_list, first_date, last_date, params=DEFAULT_PARAMETERS):
+		# the registry can be shared across years, a plain list of players is also accepted
+		if isinstance(players_list, PlayerRegistry):
+			self.registry = players_list
+		else:
+			self.registry = PlayerRegistry(players_list)
 		self.first_date = first_date
 		self.last_date = last_date
+		self.params = params
+		# optional HistoryRecorder of the values of the players after every game
+		self.history = None
 
 	def get_player(self, name):
-		for player in self.players:
-			# player is of Player class
-			if player == name:
-				return player
-		logger.warning(f"Player not found in the list of players. Adding to the list with default ratings")
-		new_player = Player(name, 1000, 1000, True, True) # provisional rating
-		self.players.append(new_player)
+		player = self.registry.get(name)
+		if player is not None:
+			return player
+		if self.registry.ini_ratings is None:
+			diagnostics.event('unknown_player', logger, logging.WARNING, "Player %s not found in the list of players. "
+							  "Adding to the list with default ratings", name, players=(name,))
+		instrumentation.count('unknown_players')
+		# with initial ratings the players are expected to be added when they are found
+		new_player = self.registry.create_player(name) # provisional rating if not in the initial ratings
+		self.registry.add(new_player)
 		return new_player
 
 	def process_game(self, white_p, black_p, result, game_type, ratings_version):
@@ -161,8 +213,8 @@ class EloRatings:
 
 		# provisional ratings?
 		rapid_ratings = (game_type == 'rapid') and separate_ratings
-		w_player.check_prov_rating(rapid_ratings)
-		b_player.check_prov_rating(rapid_ratings)
+		w_player.check_prov_rating(rapid_ratings, self.params.prov_games)
+		b_player.check_prov_rating(rapid_ratings, self.params.prov_games)
 
 		# get ratings of both players
 		b_player.add_opponent_rating(w_player.rating, rapid_ratings)
@@ -180,7 +232,7 @@ class EloRatings:
 		# get k factors for each player
 		games_w = w_player.get_nr_games(rapid_ratings)
 		games_b = b_player.get_nr_games(rapid_ratings)
-		k_w, k_b = compute_k_factor(w_rating, b_rating, game_type, games_w, games_b)
+		k_w, k_b = compute_k_factor(w_rating, b_rating, game_type, games_w, games_b, self.params)
 
 		# get scores for each player
 		score_w, score_b = get_scores(result)
@@ -197,10 +249,10 @@ class EloRatings:
 	def get_players(self, separate_ratings, as_dicts=False):
 		if as_dicts:
 			players_dict_list = list()
-			for player in self.players:
+			for player in self.registry:
 				players_dict_list.append(player.to_dict(separate_ratings))
 			return players_dict_list
-		return self.players
+		return self.registry.to_list()
 
 	def export_ratings(self, ratings_version, file='json'):
 		logger.info(f"Exporting ratings in {file} format")
@@ -223,7 +275,7 @@ class EloRatings:
 def update_ratings(players_list, first_date, year_data, ratings_version):
 	'''
 	Based on all games from the year, update the ratings of players depending on results
-	:param players_list: the initial list of players rated and provisionally rated
+	:param players_list: the initial registry (or list) of players rated and provisionally rated
 	:param first_date: first date of historical data
 	:param year_data: the games data of a year
 	:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
@@ -231,60 +283,356 @@ def update_ratings(players_list, first_date, year_data, ratings_version):
 	'''
 	try:
 		logger.info("Updating elo ratings")
-		last_date = max(year_data.game_date)
+		if len(year_data) == 0:
+			raise ValueError("no games to process")
+		last_date = year_data.game_date.max()
 		# initialize the class with the data we have
 		elo_ratings = EloRatings(players_list, first_date, last_date)
 		total_games = len(year_data)
 		logger.debug(f"Processing {total_games} total games")
-		for	row in year_data.itertuples():
-			dict_row = row._asdict()
-			white_p = dict_row['white']
-			black_p = dict_row['black']
-			result = dict_row['result']
-			game_type = dict_row['time_control']
-			elo_ratings.process_game(white_p, black_p, result, game_type, ratings_version)
+		with instrumentation.stage('update_year') as stage:
+			for	row in year_data.itertuples():
+				dict_row = row._asdict()
+				white_p = dict_row['white']
+				black_p = dict_row['black']
+				result = dict_row['result']
+				game_type = dict_row['time_control']
+				elo_ratings.process_game(white_p, black_p, result, game_type, ratings_version)
+			stage.add(total_games)
+		instrumentation.count('games_processed', total_games)
 		return elo_ratings
 	except Exception as e:
 		logger.error(f"Error while updating ratings. Reason: {e}")
 		return None
 
-def generate_ratings(players_list, games_data, ratings_version, export=False):
+# number of players converted to dictionaries at once when the players are not all in memory
+EXPORT_CHUNK_SIZE = 1000
+
+class PlayersList:
+	'''
+	Players of a year ratings file given by a generator, they are pickled one by one and read back as a list
+	'''
+	def __init__(self, players):
+		self.players = players
+
+	def __reduce__(self):
+		return list, (), None, self.players
+
+def save_year_ratings(elo_ratings, ratings_version, year, export=False):
+	'''
+	Function to save the ratings of the players at the end of a year into the data/ratings folder
+	:param elo_ratings: the elo ratings class
+	:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+	:param year: the year of the ratings
+	:param export: True if we want to generate json ratings data files
+	'''
+	with instrumentation.stage('export') as stage:
+		separate_ratings, _ = check_version(ratings_version)
+		folder = './data/ratings/'+ratings_version+"/"
+		if not elo_ratings.registry.in_memory:
+			stage.add(save_year_ratings_by_chunks(elo_ratings, ratings_version, year, separate_ratings))
+		else:
+			players_dict_list = elo_ratings.get_players(separate_ratings, as_dicts=True)
+			stage.add(len(players_dict_list))
+
+			# save player as dictionary to pickle file
+			with instrumentation.stage('pickle_write') as pickle_stage:
+				with open(folder+"ratings_"+ str(year)+".pickle", "wb") as file:
+					pickle.dump(players_dict_list, file)
+					file.close()
+				pickle_stage.add(len(players_dict_list))
+
+			# columnar snapshot for the predictor, the json export is generated from it
+			save_snapshot(ratings_version, year, players_dict_list, elo_ratings.first_date, elo_ratings.last_date)
+		# the compiled ratings of the predictor do not include the new ones
+		remove_artifact(ratings_version)
+		if export:
+			RatingsSnapshot(ratings_version, year).export()
+
+def save_year_ratings_by_chunks(elo_ratings, ratings_version, year, separate_ratings):
+	'''
+	Same as save_year_ratings for a registry with players out of memory, the dictionaries of the players are
+	built by chunks while the pickle file and the snapshot are written, and never all at once. The pickle file
+	has the same list of dictionaries, written without the memo of the repeated keys, so it is larger.
+	:return: the number of players saved
+	'''
+	writer = SnapshotWriter(ratings_version, year)
+
+	def get_players_dicts():
+		chunk = list()
+		for player in elo_ratings.registry:
+			chunk.append(player.to_dict(separate_ratings))
+			if len(chunk) == EXPORT_CHUNK_SIZE:
+				writer.add(chunk)
+				yield from chunk
+				chunk = list()
+		writer.add(chunk)
+		yield from chunk
+
+	folder = './data/ratings/'+ratings_version+"/"
+	with instrumentation.stage('pickle_write') as pickle_stage:
+		with open(folder+"ratings_"+ str(year)+".pickle", "wb") as file:
+			pickler = pickle.Pickler(file)
+			# the memo of the pickler would keep all the dictionaries in memory
+			pickler.fast = True
+			pickler.dump(PlayersList(get_players_dicts()))
+			file.close()
+		pickle_stage.add(writer.nr_players)
+	writer.save(elo_ratings.first_date, elo_ratings.last_date)
+	return writer.nr_players
+
+def update_versions_ratings(versions_ratings, year_data):
+	'''
+	Based on all games from the year, update the ratings of several versions going through the games only once
+	:param versions_ratings: dictionary with the elo ratings class of every version [v1, v2 ,v3, v4]
+	:param year_data: the games data of a year
+	:return: True if the update was successful
+	'''
+	try:
+		logger.info(f"Updating elo ratings for versions {list(versions_ratings.keys())}")
+		if len(year_data) == 0:
+			raise ValueError("no games to process")
+		last_date = year_data.game_date.max()
+		for elo_ratings in versions_ratings.values():
+			elo_ratings.last_date = last_date
+		total_games = len(year_data)
+		logger.debug(f"Processing {total_games} total games")
+		games = zip(year_data['white'].tolist(), year_data['black'].tolist(), year_data['result'].tolist(),
+					year_data['time_control'].tolist())
+		versions = list(versions_ratings.items())
+		if not any(elo_ratings.history is not None for elo_ratings in versions_ratings.values()):
+			for white_p, black_p, result, game_type in games:
+				for ratings_version, elo_ratings in versions:
+					elo_ratings.process_game(white_p, black_p, result, game_type, ratings_version)
+			return True
+		for game, (white_p, black_p, result, game_type) in enumerate(games):
+			for ratings_version, elo_ratings in versions:
+				elo_ratings.process_game(white_p, black_p, result, game_type, ratings_version)
+				if elo_ratings.history is not None:
+					registry = elo_ratings.registry
+					for name in (white_p, black_p):
+						elo_ratings.history.add_player(game, registry.get_id(name), registry.get(name))
+		return True
+	except Exception as e:
+		logger.error(f"Error while updating ratings. Reason: {e}")
+		return False
+
+def generate_ratings(players_list, games_data, ratings_version, export=False, engine='players', checkpoints=False,
+					 history=False, cold_after=None):
 	'''
 	Function to generate the year ratings dictionaries for all years covered with the games dataset.
 	The year dictionaries with the ratings will be saved into the data/ratings folder
-	:param players_list: the initial list of players rated and provisionally rated
+	:param players_list: the initial registry (or list) of players rated and provisionally rated
 	:param games_data: data with the registered games and results to generate new ratings
 	:param ratings_version: version of the ratings to use [v1, v2 ,v4, v4]
 	:param export: True if we want to generate json ratings data files
+	:param engine: 'players' to update the Player objects game by game, 'arrays' to use the numpy arrays engine
+	and 'batched' to use the numpy arrays engine updating rounds of independent games with vector operations
+	:param checkpoints: True to save the full state of the players every year and to resume from the latest
+	checkpoint that still matches the games data, replaying only the following years
+	:param history: True to save also the rating history of every year, to know the ratings as of any date
+	:param cold_after: number of years without games before a player is moved out of memory to an sqlite file,
+	None to keep all the players in memory. Only for the players engine without checkpoints, see cold_players.
+	:return: True if the generation process was successful
+	'''
+	return generate_versions_ratings(players_list, games_data, [ratings_version], export, engine, checkpoints,
+									 history, cold_after)
+
+def generate_versions_ratings(players_list, games_data, ratings_versions, export=False, engine='players',
+							  checkpoints=False, history=False, cold_after=None):
+	'''
+	Function to generate the year ratings dictionaries of several versions going through the games only once.
+	Every version starts from its own copy of the initial players.
+	The year dictionaries with the ratings will be saved into the data/ratings folder of every version
+	:param players_list: the initial registry (or list) of players rated and provisionally rated, with cold_after
+	also a generator of players, see iter_ini_players
+	:param games_data: data with the registered games and results to generate new ratings
+	:param ratings_versions: list of versions of the ratings to generate [v1, v2 ,v3, v4]
+	:param export: True if we want to generate json ratings data files
+	:param engine: 'players', 'arrays' or 'batched', see generate_ratings
+	:param checkpoints: True to save and resume from yearly checkpoints, see generate_ratings
+	:param history: True to save also the rating history of every year, see generate_ratings
+	:param cold_after: years without games before a player is moved out of memory, see generate_ratings
 	:return: True if the generation process was successful
 	'''
+	versions_ratings = dict()
 	try:
-		logger.info(f"Generating ratings from the games data, predictor version={ratings_version}")
+		logger.info(f"Generating ratings from the games data, predictor versions={ratings_versions}")
 		# data should be sorted by game_date but we will use the year field to collect yearly data
 		min_year = min(games_data['game_year'])
 		max_year = max(games_data['game_year'])
-		prev_list = players_list
-		first_date = min(games_data.game_date)
-		separate_ratings, balanced = check_version(ratings_version)
-		logger.debug(f"separate_ratings = {separate_ratings} and balanced {balanced}")
-		for year in range(min_year, max_year+1):
+		# the same registry is shared by all years
+		if isinstance(players_list, PlayerRegistry) or cold_after is not None:
+			# the players out of memory are written to the store from the given registry, list or generator
+			registry = players_list
+		else:
+			registry = PlayerRegistry(players_list)
+		first_date = games_data.game_date.min()
+		years = list(range(min_year, max_year+1))
+		if checkpoints:
+			checkpoint_keys = get_checkpoint_keys(registry, games_data, years)
+			games_digests, players_digests, _ = checkpoint_keys
+		array_engine = engine in ['arrays', 'batched']
+		if array_engine:
+			# imported here because the array engine extends the classes of this module
+			from src.array_ratings import ArrayEloRatings, update_array_ratings
+		if cold_after is not None:
+			if array_engine or checkpoints:
+				raise ValueError("the players out of memory are only supported by the players engine "
+								 "without checkpoints")
+			from src.cold_players import ColdPlayerRegistry, get_cold_store_file
+			settings = (registry.keep_history, registry.ini_ratings, registry.default_rating) \
+				if isinstance(registry, PlayerRegistry) else ()
+			cold_registry = None
+
+		resumed_years = dict()
+		for ratings_version in ratings_versions:
+			separate_ratings, balanced = check_version(ratings_version)
+			logger.debug(f"{ratings_version}: separate_ratings = {separate_ratings} and balanced {balanced}")
+			# every version updates its own players
+			if cold_after is not None:
+				# the initial players go straight to the store of the first version, the others copy its file
+				if cold_registry is None:
+					cold_registry = ColdPlayerRegistry(get_cold_store_file(ratings_version), cold_after, registry,
+													   *settings)
+					# the players are not kept in memory here
+					registry = players_list = None
+					version_registry = cold_registry
+				else:
+					version_registry = cold_registry.copy(get_cold_store_file(ratings_version))
+			elif len(ratings_versions) == 1:
+				version_registry = registry
+			else:
+				version_registry = copy.deepcopy(registry)
+			resumed_years[ratings_version] = None
+			if checkpoints:
+				resumed_year, version_registry = resume_from_checkpoint(version_registry, ratings_version, years,
+																		first_date, checkpoint_keys)
+				resumed_years[ratings_version] = resumed_year
+			# the state of the players is kept from one year to the next one
+			if array_engine:
+				versions_ratings[ratings_version] = ArrayEloRatings(version_registry, first_date, first_date)
+			else:
+				versions_ratings[ratings_version] = EloRatings(version_registry, first_date, first_date)
+			if history:
+				versions_ratings[ratings_version].history = HistoryRecorder()
+
+		for year in years:
+			# versions resumed from a checkpoint skip the years already processed
+			year_ratings = {v: r for v, r in versions_ratings.items()
+							if resumed_years[v] is None or year > resumed_years[v]}
+			if not year_ratings:
+				continue
 			logger.debug(f"Processing data from year {year}")
 			year_data = games_data.loc[games_data['game_year'] == year]
-			elo_ratings = update_ratings(prev_list, first_date, year_data, ratings_version)
-			if elo_ratings is None:
+			with instrumentation.stage('update_year') as stage:
+				if array_engine:
+					updated = all([update_array_ratings(elo_ratings, year_data, ratings_version,
+														by_rounds=(engine == 'batched')) is not None
+								   for ratings_version, elo_ratings in year_ratings.items()])
+				else:
+					updated = update_versions_ratings(year_ratings, year_data)
+				# every version processes all the games of the year
+				stage.add(len(year_data) * len(year_ratings))
+			if updated:
+				instrumentation.count('games_processed', len(year_data) * len(year_ratings))
+			if not updated:
 				logger.error(f"Error while processing games from {year}. Skipping")
+				for elo_ratings in year_ratings.values():
+					if elo_ratings.history is not None:
+						elo_ratings.history.clear()
 				continue
 
-			if export:
-				elo_ratings.export_ratings(ratings_version)
+			for ratings_version, elo_ratings in year_ratings.items():
+				save_year_ratings(elo_ratings, ratings_version, year, export)
+				if history:
+					save_history(ratings_version, year, elo_ratings.history, year_data['game_date'],
+								 elo_ratings.registry)
+					elo_ratings.history.clear()
 
-			# save player as dictionary to pickle file
-			folder = './data/ratings/'+ratings_version+"/"
-			with open(folder+"ratings_"+ str(year)+".pickle", "wb") as file:
-				pickle.dump(elo_ratings.get_players(separate_ratings, as_dicts=True), file)
-				file.close()
-			prev_list = elo_ratings.get_players(separate_ratings)
+				if checkpoints:
+					separate_ratings, _ = check_version(ratings_version)
+					valid_digests = {y: d for y, d in games_digests.items() if y <= year}
+					save_checkpoint(ratings_version, year, first_date, valid_digests, players_digests[year],
+									elo_ratings.get_players(separate_ratings))
+				if cold_after is not None:
+					elo_ratings.registry.evict(year)
+		return True
+	except Exception as e:
+		logger.error(f"Error while generating the ratings. Reason:{e}")
+		return False
+	finally:
+		if cold_after is not None:
+			for elo_ratings in versions_ratings.values():
+				elo_ratings.registry.close()
+
+def generate_streaming_ratings(games, ini_ratings, ratings_version, export=False, history=False, cold_after=None,
+							   players=None):
+	'''
+	Function to generate the year ratings from a stream of games in chronological order, without building
+	any dataframe. The players are created with their initial classic rating if they have one, before the first
+	game if they are given in players (as prepare_ini_players does, so the year files are the same as with
+	generate_ratings) and when they play their first game otherwise. The year ratings are saved into the
+	data/ratings folder when the year of the games changes.
+	:param games: iterable with the games as dictionaries with date, white, black, result and time_control
+	:param ini_ratings: dictionary with the initial classic ratings of some players
+	:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+	:param export: True if we want to generate json ratings data files
+	:param history: True to save also the rating history of every year, see generate_ratings
+	:param cold_after: years without games before a player is moved out of memory, see generate_ratings
+	:param players: optional names of all the players of the games, see get_stream_players
+	:return: True if the generation process was successful
+	'''
+	registry = None
+	try:
+		logger.info(f"Generating ratings from the stream of games, predictor version={ratings_version}")
+		if cold_after is not None:
+			from src.cold_players import ColdPlayerRegistry, get_cold_store_file
+			registry = ColdPlayerRegistry(get_cold_store_file(ratings_version), cold_after, ini_ratings=ini_ratings)
+		else:
+			registry = PlayerRegistry(ini_ratings=ini_ratings)
+		if players is not None:
+			registry.add_initial_players(players)
+		elo_ratings = None
+		year = None
+		total_games = 0
+		recorder = HistoryRecorder() if history else None
+		# dates of the games of the current year, in the order of the events of the recorder
+		year_dates = list()
+		for game in games:
+			game_date = game['date']
+			if elo_ratings is None:
+				elo_ratings = EloRatings(registry, game_date, game_date)
+			elif game_date.year != year:
+				logger.debug(f"Processed {total_games} games until the end of {year}")
+				save_year_ratings(elo_ratings, ratings_version, year, export)
+				if history:
+					save_history(ratings_version, year, recorder, year_dates, registry)
+					recorder.clear()
+					year_dates = list()
+				if cold_after is not None:
+					registry.evict(year)
+			year = game_date.year
+			elo_ratings.last_date = game_date
+			elo_ratings.process_game(game['white'], game['black'], game['result'], game['time_control'],
+									 ratings_version)
+			if history:
+				for name in (game['white'], game['black']):
+					recorder.add_player(len(year_dates), registry.get_id(name), registry.get(name))
+				year_dates.append(game_date)
+			total_games += 1
+		if elo_ratings is None:
+			logger.error("No games found to generate the ratings")
+			return False
+		logger.debug(f"Processed {total_games} games until the end of {year}")
+		save_year_ratings(elo_ratings, ratings_version, year, export)
+		if history:
+			save_history(ratings_version, year, recorder, year_dates, registry)
+		instrumentation.count('games_processed', total_games)
 		return True
 	except Exception as e:
 		logger.error(f"Error while generating the ratings. Reason:{e}")
 		return False
+	finally:
+		if cold_after is not None and registry is not None:
+			registry.close()
@@ -6,27 +6,26 @@ logger = logging.getLogger(__name__)
 
 def prepare_ini_players_with_seed(filename, games_data, seed):
 	'''
-	It returns the total list of initial players before parsing any game results
+	It returns the registry with all initial players before parsing any game results
 	:param filename: the file with some initial classic ratings for players.
 	:param games_data: the games information with the players and games.
 	:param seed: the default initial rating
-	:return:
+	:return: the players registry
 	'''
 	logger.info("Preparing initial ratings")
 	ratings_dict = get_classic_ratings(filename)
 	players_pool = list(games_data['white'].unique())
 	players_pool.extend(list(games_data['black'].unique()))
 	players_pool = list(set(players_pool))
-	rated_players = list(ratings_dict.keys())
-	total_players = list()
+	total_players = PlayerRegistry()
 	for player in players_pool:
-		if player in rated_players:
+		if player in ratings_dict:
 			# default rapid rating is smaller for a top classic player
 			classic_rating = ratings_dict[player]
 			new_player = Player(player, classic_rating, classic_rating-200, False, True)
 		else:
 			new_player = Player(player, seed, seed, True, True)
-		total_players.append(new_player)
+		total_players.add(new_player)
 	logger.debug(f"Total number of players = {len(total_players)}")
 	return total_players
 
@@ -36,7 +35,11 @@ def generate_last_ratings(players_list, games_data, return_year):
 		# data should be sorted by game_date but we will use the year field to collect yearly data
 		min_year = min(games_data['game_year'])
 		max_year = max(games_data['game_year'])
-		prev_list = players_list
+		# the same registry is shared by all years
+		if isinstance(players_list, PlayerRegistry):
+			registry = players_list
+		else:
+			registry = PlayerRegistry(players_list)
 		first_date = min(games_data.game_date)
 		separate_ratings = False
 		balanced = True
@@ -45,7 +48,7 @@ def generate_last_ratings(players_list, games_data, return_year):
 		for year in range(min_year, max_year + 1):
 			logger.debug(f"Processing data from year {year}")
 			year_data = games_data.loc[games_data['game_year'] == year]
-			elo_ratings = update_ratings(prev_list, first_date, year_data, ratings_version)
+			elo_ratings = update_ratings(registry, first_date, year_data, ratings_version)
 			if elo_ratings is None:
 				logger.error(f"Error while processing games from {year}. Skipping")
 				continue
@@ -58,7 +61,6 @@ def generate_last_ratings(players_list, games_data, return_year):
 					player_df = pd.DataFrame([player])
 					players = pd.concat([players, player_df], ignore_index=True)
 				return dict(zip(players.name, players.rating)), dict(), dict()
-			prev_list = elo_ratings.get_players(separate_ratings)
 		return None
 	except Exception as e:
 		logger.error(f"Error while generating the ratings. Reason:{e}")
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import logging
+import os
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# to change if the parsing of the files or build_name change, the chunks of older versions are parsed again
+INGEST_VERSION = 1
+
+MANIFEST_FILE = 'manifest.json'
+
+def get_chunk_file(chunks_folder, file):
+	return chunks_folder + file + '.pickle'
+
+def get_file_digest(full_path):
+	'''
+	:param full_path: the path of the file
+	:return: the hexadecimal sha1 digest of the content of the file
+	'''
+	digest = hashlib.sha1()
+	with open(full_path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			digest.update(block)
+		f.close()
+	return digest.hexdigest()
+
+def get_manifest_entry(full_path, digest=None):
+	'''
+	:param full_path: the path of the json file
+	:param digest: the digest of the file if it is already known
+	:return: the dictionary with the size, the modification time and the content digest of the file
+	'''
+	stat = os.stat(full_path)
+	return {'size': stat.st_size,
+			'mtime': stat.st_mtime_ns,
+			'sha1': digest if digest is not None else get_file_digest(full_path)}
+
+def read_manifest(chunks_folder):
+	'''
+	Function to read the manifest of the parsed files
+	:param chunks_folder: folder with the parsed chunks and the manifest
+	:return: dictionary with the manifest entry of every parsed file, empty if there is no valid manifest
+	'''
+	manifest_file = chunks_folder + MANIFEST_FILE
+	if not os.path.exists(manifest_file):
+		return dict()
+	try:
+		with open(manifest_file) as f:
+			manifest = json.load(f)
+			f.close()
+	except Exception as e:
+		logger.warning(f"Ignoring the manifest of the parsed files. Reason: {e}")
+		return dict()
+	if manifest.get('version') != INGEST_VERSION:
+		logger.info(f"Ignoring the manifest of version {manifest.get('version')}, all the files are parsed again")
+		return dict()
+	return manifest['files']
+
+def write_manifest(chunks_folder, entries):
+	'''
+	Function to save the manifest of the parsed files, written to a temporary file first so an interrupted
+	run never leaves a broken manifest
+	:param chunks_folder: folder with the parsed chunks and the manifest
+	:param entries: dictionary with the manifest entry of every parsed file
+	'''
+	os.makedirs(chunks_folder, exist_ok=True)
+	manifest_file = chunks_folder + MANIFEST_FILE
+	with open(manifest_file + '.tmp', 'w') as f:
+		json.dump({'version': INGEST_VERSION, 'files': dict(sorted(entries.items()))}, f, indent=1)
+		f.close()
+	os.replace(manifest_file + '.tmp', manifest_file)
+
+def find_changed_files(folder, files, manifest, chunks_folder):
+	'''
+	Function to find the files that need to be parsed. The content digest is only computed for the files with
+	a different size or modification time than in the manifest, so a file touched but not changed is not parsed.
+	:param folder: folder containing the json files
+	:param files: the names of the json files of the folder
+	:param manifest: dictionary with the manifest entry of every parsed file
+	:param chunks_folder: folder with the parsed chunks
+	:return: the list of files to parse and the dictionary with the manifest entries of the files already parsed
+	'''
+	valid_entries = dict()
+	changed = list()
+	for file in files:
+		full_path = folder + file
+		entry = manifest.get(file)
+		if entry is None or not os.path.exists(get_chunk_file(chunks_folder, file)):
+			changed.append(file)
+			continue
+		stat = os.stat(full_path)
+		if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime']:
+			valid_entries[file] = entry
+			continue
+		digest = get_file_digest(full_path)
+		if stat.st_size == entry['size'] and digest == entry['sha1']:
+			logger.debug(f"File {file} touched but not changed")
+			valid_entries[file] = get_manifest_entry(full_path, digest)
+			continue
+		changed.append(file)
+	return changed, valid_entries
+
+def save_chunk(chunks_folder, file, file_df):
+	'''
+	Function to save the parsed games of a file
+	:param chunks_folder: folder with the parsed chunks
+	:param file: the name of the json file
+	:param file_df: the dataframe with the games of the file
+	'''
+	os.makedirs(chunks_folder, exist_ok=True)
+	file_df.to_pickle(get_chunk_file(chunks_folder, file))
+
+def load_chunk(chunks_folder, file):
+	return pd.read_pickle(get_chunk_file(chunks_folder, file))
+
+def remove_chunks(chunks_folder, files):
+	'''
+	Function to remove the chunks of the files that are not in the folder anymore
+	'''
+	for file in files:
+		chunk_file = get_chunk_file(chunks_folder, file)
+		if os.path.exists(chunk_file):
+			os.remove(chunk_file)
+		logger.debug(f"Removed the parsed games of file {file}")
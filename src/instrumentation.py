@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+'''
+Instrumentation of the stages of the project: the wall time, the cpu time and the number of items of every stage
+(parse, clean, update_year, export, pickle_write, predictor_load, predict_file) and some counters (games
+processed, unknown players added by get_player, year fallbacks of the predictor). It is disabled by default, then
+a stage or a counter only checks one attribute. It is enabled with the --profile option of main.py or the
+CHESS_PROFILE environment variable, and the stages given with --cprofile or CHESS_CPROFILE also run under cProfile.
+The stages run by worker processes are only measured as a whole by the stage of the main process.
+@author: A. Rosa Castillo
+'''
+PROFILE_VARIABLE = 'CHESS_PROFILE'
+CPROFILE_VARIABLE = 'CHESS_CPROFILE'
+
+class Stage:
+	def __init__(self, instrumentation, name):
+		self.instrumentation = instrumentation
+		self.name = name
+		self.items = 0
+		self.profile = None
+		self.start = None
+		self.start_cpu = None
+
+	def add(self, items):
+		self.items += items
+
+	def __enter__(self):
+		self.profile = self.instrumentation.start_profile(self.name)
+		self.start = time.perf_counter()
+		self.start_cpu = time.process_time()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		wall_seconds = time.perf_counter() - self.start
+		cpu_seconds = time.process_time() - self.start_cpu
+		if self.profile is not None:
+			self.instrumentation.stop_profile(self.profile)
+		self.instrumentation.add_stage(self.name, wall_seconds, cpu_seconds, self.items)
+		return False
+
+class DisabledStage:
+	'''
+	Stage of the disabled instrumentation, it measures nothing
+	'''
+	def add(self, items):
+		pass
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		return False
+
+DISABLED_STAGE = DisabledStage()
+
+class Instrumentation:
+	def __init__(self):
+		self.enabled = False
+		self.profile_stages = set()
+		self.stages = dict()
+		self.counters = dict()
+		# one cProfile profile per profiled stage, the calls of the stage are accumulated
+		self.profiles = dict()
+		self.active_profile = None
+		self.start = None
+
+	def enable(self, profile_stages=()):
+		'''
+		:param profile_stages: the names of the stages to run under cProfile
+		'''
+		self.enabled = True
+		self.profile_stages = set(profile_stages)
+		self.start = time.perf_counter()
+
+	def enable_from_environment(self):
+		'''
+		It enables the instrumentation if the environment variables ask for it
+		:return: True if it is enabled
+		'''
+		profile_stages = [stage for stage in os.environ.get(CPROFILE_VARIABLE, '').split(',') if stage]
+		if os.environ.get(PROFILE_VARIABLE, '') not in ('', '0') or profile_stages:
+			self.enable(profile_stages)
+		return self.enabled
+
+	def stage(self, name):
+		'''
+		:param name: the name of the stage
+		:return: the context manager measuring the stage, use add to count its items
+		'''
+		if not self.enabled:
+			return DISABLED_STAGE
+		return Stage(self, name)
+
+	def count(self, name, value=1):
+		if self.enabled:
+			self.counters[name] = self.counters.get(name, 0) + value
+
+	def start_profile(self, name):
+		'''
+		:return: the profile of the stage if it is profiled, None otherwise. The stages inside a profiled stage
+		are part of its profile and they are not profiled again.
+		'''
+		if name not in self.profile_stages or self.active_profile is not None:
+			return None
+		if name not in self.profiles:
+			import cProfile
+			self.profiles[name] = cProfile.Profile()
+		self.active_profile = self.profiles[name]
+		self.active_profile.enable()
+		return self.active_profile
+
+	def stop_profile(self, profile):
+		profile.disable()
+		self.active_profile = None
+
+	def add_stage(self, name, wall_seconds, cpu_seconds, items):
+		stats = self.stages.get(name)
+		if stats is None:
+			stats = {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'items': 0}
+			self.stages[name] = stats
+		stats['calls'] += 1
+		stats['wall_seconds'] += wall_seconds
+		stats['cpu_seconds'] += cpu_seconds
+		stats['items'] += items
+
+	def get_report(self):
+		'''
+		:return: dictionary with the totals of every stage, the counters and the wall time since it was enabled
+		'''
+		stages = dict()
+		for name, stats in self.stages.items():
+			stages[name] = {**stats,
+							'items_per_second': stats['items'] / stats['wall_seconds']
+							if stats['wall_seconds'] > 0 else None}
+		return {'total_wall_seconds': time.perf_counter() - self.start if self.start is not None else 0.0,
+				'stages': stages,
+				'counters': dict(self.counters)}
+
+	def format_report(self, top=20):
+		'''
+		:param top: number of functions shown for every profiled stage
+		:return: the report as text
+		'''
+		report = self.get_report()
+		lines = [f"Total wall time {report['total_wall_seconds']:.3f}s",
+				 f"{'stage':<16} {'calls':>7} {'wall (s)':>10} {'cpu (s)':>10} {'items':>10} {'items/s':>12}"]
+		for name, stats in report['stages'].items():
+			lines.append(f"{name:<16} {stats['calls']:>7} {stats['wall_seconds']:>10.3f} {stats['cpu_seconds']:>10.3f} "
+						 f"{stats['items']:>10} {stats['items_per_second'] or 0:>12.1f}")
+		for name, value in report['counters'].items():
+			lines.append(f"{name:<16} {value:>7}")
+		if self.profiles:
+			import io
+			import pstats
+			for name, profile in self.profiles.items():
+				stream = io.StringIO()
+				pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(top)
+				lines.append(f"cProfile of stage {name}")
+				lines.append(stream.getvalue())
+		return '\n'.join(lines)
+
+	def save_report(self, name, folder='./data/profiles/'):
+		'''
+		It saves the report as a json file and the cProfile data of every profiled stage as a .prof file,
+		readable with pstats or snakeviz
+		:param name: the name of the run, usually the action
+		:param folder: the folder of the reports
+		:return: the json file of the report
+		'''
+		os.makedirs(folder, exist_ok=True)
+		file = folder + name + '_' + datetime.now().strftime('%Y%m%d_%H%M%S')
+		with open(file + '.json', 'w') as fp:
+			json.dump(self.get_report(), fp, indent=1)
+			fp.close()
+		for stage, profile in self.profiles.items():
+			profile.dump_stats(file + '_' + stage + '.prof')
+		logger.info(f"Instrumentation report saved at {file}.json")
+		return file + '.json'
+
+	def reset(self):
+		self.stages = dict()
+		self.counters = dict()
+		self.profiles = dict()
+		self.active_profile = None
+		self.start = time.perf_counter() if self.enabled else None
+
+instrumentation = Instrumentation()
@@ -1,10 +1,16 @@
 import json
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-from unidecode import unidecode
-import magic
+from datetime import datetime
 import os
 import logging
 from src.player import Player
+from src.player_registry import PlayerRegistry
+from src.instrumentation import instrumentation
+from src.ingest import read_manifest, write_manifest, find_changed_files, get_manifest_entry, save_chunk, \
+	load_chunk, remove_chunks
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +20,8 @@ def check_chinese_characters(name):
 	:param name: the name to translate
 	:return: the translated name
 	'''
+	# imported here, only the names missing from the names cache need it
+	from unidecode import unidecode
 	characters = []
 	for a in name:
 		characters.append(a)
@@ -36,9 +44,113 @@ def fix_encoding_error(name):
 		return name.replace('v', 'u')
 	return name
 
+'''
+Cache of the player's names already built, shared by the parsing of the training data and by the predictions.
+It is saved as a json lines file with one line per name: the raw name, the utf-8 flag and the built name, so
+it is also the list of all the translations made.
+@author: A. Rosa Castillo
+'''
+class NameCache:
+	# to change if build_name changes, the names saved by older versions are ignored
+	VERSION = 1
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.names = dict()
+		# names built since the last time the cache was saved
+		self.new_names = dict()
+		self.loaded = False
+
+	def load(self):
+		'''
+		It reads the names saved by previous executions, only the first time it is called
+		'''
+		if self.loaded:
+			return
+		self.loaded = True
+		if not os.path.exists(self.filename):
+			return
+		try:
+			with open(self.filename, encoding='utf-8') as f:
+				header = json.loads(f.readline())
+				if header.get('version') != self.VERSION:
+					logger.info(f"Ignoring the names cache of version {header.get('version')}")
+					f.close()
+					return
+				for line in f:
+					raw_name, utf_8, name = json.loads(line)
+					self.names[(raw_name, utf_8)] = name
+				f.close()
+			logger.debug(f"{len(self.names)} names read from the names cache")
+		except Exception as e:
+			logger.warning(f"Ignoring the names cache. Reason: {e}")
+			self.names.clear()
+
+	def get(self, raw_name, utf_8):
+		if not self.loaded:
+			self.load()
+		key = (raw_name, utf_8)
+		name = self.names.get(key)
+		if name is None:
+			name = compute_name(raw_name, utf_8)
+			self.names[key] = name
+			self.new_names[key] = name
+		return name
+
+	def pop_new_names(self):
+		'''
+		:return: the names built since the last call, used to send the names built by worker processes
+		'''
+		new_names = self.new_names
+		self.new_names = dict()
+		return new_names
+
+	def clear(self):
+		'''
+		It forgets all the names, also the saved ones, so every name is built again
+		'''
+		self.names = dict()
+		self.new_names = dict()
+		self.loaded = True
+
+	def update(self, names):
+		for key, name in names.items():
+			if key not in self.names:
+				self.names[key] = name
+				self.new_names[key] = name
+
+	def save(self):
+		'''
+		It saves the cache if there are new names, sorted by raw name so the changes are easy to review
+		'''
+		if not self.new_names:
+			return
+		os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+		with open(self.filename + '.tmp', 'w', encoding='utf-8') as f:
+			f.write(json.dumps({'version': self.VERSION}) + '\n')
+			for (raw_name, utf_8), name in sorted(self.names.items()):
+				f.write(json.dumps([raw_name, utf_8, name], ensure_ascii=False) + '\n')
+			f.close()
+		os.replace(self.filename + '.tmp', self.filename)
+		logger.debug(f"Names cache saved with {len(self.new_names)} new names")
+		self.new_names = dict()
+
+# TODO add a yaml parameter for the data path
+name_cache = NameCache('./data/io/names_cache.jsonl')
+
 def build_name(x, utf_8=False):
 	'''
-	Auxiliary function to build the player's name removing commas and under the same ascii encoding
+	Auxiliary function to build the player's name removing commas and under the same ascii encoding.
+	Every name is built only once, see NameCache.
+	:param x: the name of the player as a string
+	:param utf_8: True if Utf-8 encodings are used
+	:return: the clean player's name in Ascii
+	'''
+	return name_cache.get(x, utf_8)
+
+def compute_name(x, utf_8=False):
+	'''
+	It builds the player's name, see build_name
 	:param x: the name of the player as a string
 	:param utf_8: True if Utf-8 encodings are used
 	:return: the clean player's name in Ascii
@@ -63,6 +175,13 @@ def build_name(x, utf_8=False):
 	new_name = surname + ' ' + words[1]
 	return fix_encoding_error(new_name)
 
+def get_tour_numbers(nr_tour):
+	'''
+	:param nr_tour: the number of tours of the tournament
+	:return: the numbers of the tours used for the training games, all the tours from 1 to nr_tour
+	'''
+	return range(1, nr_tour + 1)
+
 def build_dataframe(tour_data, utf_8=False):
 	'''
 	Function to build a dataframe from the parsed json data
@@ -73,7 +192,7 @@ def build_dataframe(tour_data, utf_8=False):
 	final_df = pd.DataFrame()
 	nr_tour = tour_data['tours'].values[0]
 	prefix = 'games.tour_'
-	for i in range(1, nr_tour):
+	for i in get_tour_numbers(nr_tour):
 		column_name = prefix + str(i)
 		logger.debug("Extracting games from "+column_name)
 		temp = tour_data.explode(column_name)
@@ -85,41 +204,253 @@ def build_dataframe(tour_data, utf_8=False):
 		final_df = pd.concat([final_df, final])
 	return final_df
 
-def parse_files(folder):
+# encoding detector of the process, created once because loading the magic database is slow
+process_magic = dict()
+
+def get_magic():
+	'''
+	:return: the encoding detector of the current process, every worker process creates its own one
+	'''
+	pid = os.getpid()
+	if pid not in process_magic:
+		import magic
+		process_magic.clear()
+		process_magic[pid] = magic.Magic(mime_encoding=True)
+	return process_magic[pid]
+
+def read_tournament_file(full_path):
 	'''
-	Function to return the final dataframe after parsing the games data from the given folder
+	Function to read a tournament json file only once, detecting the encoding from the same bytes
+	:param full_path: the path of the json file
+	:return: the parsed json data and True if the encoding is Utf-8
+	'''
+	with open(full_path, "rb") as read_it:
+		blob = read_it.read()
+		read_it.close()
+	encoding = get_magic().from_buffer(blob)
+	return json.loads(blob), encoding == 'utf-8'
+
+def get_file_records(raw, utf_8=False):
+	'''
+	Function to flatten the games of a tournament into one record per game, in the order of the tours.
+	Every record has the columns of the dataframe built by build_dataframe.
+	:param raw: the json parsed data of the tournament
+	:param utf_8: True if the used encoding is Utf-8
+	:return: the list of records as dictionaries
+	'''
+	records = list()
+	tournament = {'start_date': raw['start_date'], 'end_date': raw['end_date'], 'time_control': raw['time_control']}
+	for i in get_tour_numbers(raw['tours']):
+		for game in raw['games']['tour_' + str(i)]:
+			record = {**tournament, **game}
+			record['white'] = build_name(game['white'], utf_8)
+			record['black'] = build_name(game['black'], utf_8)
+			records.append(record)
+	return records
+
+def parse_folder_files(folder, files):
+	'''
+	Function to read some json files of a folder, every file is read only once
+	:return: the list of records of the games of every file, in the order of the files
+	'''
+	files_records = list()
+	for file in files:
+		full_path = folder + file
+		logger.info(f"Reading file {full_path}")
+		raw, utf_8 = read_tournament_file(full_path)
+		files_records.append(get_file_records(raw, utf_8))
+	return files_records
+
+def parse_worker_files(folder, files):
+	'''
+	Function to read some json files of a folder in a worker process
+	:return: the list of records of the games of every file and the names built by the worker
+	'''
+	return parse_folder_files(folder, files), name_cache.pop_new_names()
+
+def parse_file_list(folder, files, workers=1, chunk_size=64):
+	'''
+	Function to parse the given json files of a folder
 	:param folder: folder containing the json files
+	:param files: the names of the files to parse
+	:param workers: number of processes, with more than one (or None for all cpus) the files are shared
+	between worker processes
+	:param chunk_size: number of files given to a worker process at once
+	:return: the list of records of the games of every file, in the order of the files
+	'''
+	# the workers get the names already built
+	name_cache.load()
+	if files and (workers is None or workers > 1):
+		logger.info(f"Parsing {len(files)} files with a pool of processes")
+		methods = multiprocessing.get_all_start_methods()
+		context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+		files_records = list()
+		with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+			chunks = [files[i:i+chunk_size] for i in range(0, len(files), chunk_size)]
+			# map keeps the order of the chunks, so the games are in the same order as with one process
+			for chunk_records, new_names in executor.map(parse_worker_files, [folder] * len(chunks), chunks):
+				files_records.extend(chunk_records)
+				name_cache.update(new_names)
+	else:
+		files_records = parse_folder_files(folder, files)
+	name_cache.save()
+	return files_records
+
+def get_json_files(folder):
+	'''
+	:param folder: folder containing the json files
+	:return: the sorted names of the json files of the folder, to always build the games in the same order
+	'''
+	files = list()
+	for file in sorted(os.listdir(folder)):
+		if not file.endswith('.json'):
+			logger.info(f"Ignoring file {file}")
+			continue
+		files.append(file)
+	return files
+
+def parse_files(folder, workers=1, chunk_size=64):
+	'''
+	Function to return the final dataframe after parsing the games data from the given folder.
+	The games are kept as flat records and the dataframe is built only once at the end.
+	:param folder: folder containing the json files
+	:param workers: number of processes, see parse_file_list
+	:param chunk_size: number of files given to a worker process at once
 	:return: the parsed data as a dataframe
 	'''
-	files = os.listdir(folder)
-	final_dataset = pd.DataFrame()
-	for file in files:
+	with instrumentation.stage('parse') as stage:
+		files_records = parse_file_list(folder, get_json_files(folder), workers, chunk_size)
+		data = pd.DataFrame([record for records in files_records for record in records])
+		stage.add(len(data))
+	return data
+
+def parse_files_incrementally(folder, chunks_folder, workers=1):
+	'''
+	Function to return the final dataframe of the games of the given folder parsing only the files added or
+	changed since the last call. The games of every file are kept as a chunk at the chunks folder and the
+	manifest of the folder tells which chunks are still valid, see ingest.
+	:param folder: folder containing the json files
+	:param chunks_folder: folder with the parsed chunks and the manifest
+	:param workers: number of processes to parse the changed files, see parse_file_list
+	:return: the parsed data as a dataframe
+	'''
+	with instrumentation.stage('parse') as stage:
+		files = get_json_files(folder)
+		manifest = read_manifest(chunks_folder)
+		changed, valid_entries = find_changed_files(folder, files, manifest, chunks_folder)
+		removed = [file for file in manifest if file not in files]
+		logger.info(f"{len(changed)} new or changed files, {len(removed)} removed files and "
+					f"{len(files) - len(changed)} files already parsed")
+		remove_chunks(chunks_folder, removed)
+
+		for file, records in zip(changed, parse_file_list(folder, changed, workers)):
+			save_chunk(chunks_folder, file, pd.DataFrame(records))
+			valid_entries[file] = get_manifest_entry(folder + file)
+		write_manifest(chunks_folder, valid_entries)
+
+		chunks = [load_chunk(chunks_folder, file) for file in files]
+		data = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+		stage.add(len(data))
+	return data
+
+def get_file_games(raw, utf_8=False):
+	'''
+	Function to extract the normalised games of a tournament in chronological order
+	:param raw: the json parsed data of the tournament
+	:param utf_8: True if the used encoding is Utf-8
+	:return: the list of games as dictionaries with date, white, black, result and time_control
+	'''
+	games = list()
+	time_control = raw['time_control']
+	for i in get_tour_numbers(raw['tours']):
+		for game in raw['games']['tour_' + str(i)]:
+			games.append({'date': game['date'],
+						  'white': build_name(game['white'], utf_8),
+						  'black': build_name(game['black'], utf_8),
+						  'result': game['result'],
+						  'time_control': time_control})
+	# stable sort, the games of the same day keep the order of the tours
+	games.sort(key=lambda g: g['date'])
+	return games
+
+def get_stream_players(folder, end_date=None):
+	'''
+	Function to find the players of the games given by stream_games, reading the files one by one
+	:param folder: folder containing the json files
+	:param end_date: if given, only the games before this date (format %Y-%m-%d) are considered
+	:return: the sorted list of the names of the players
+	'''
+	names = set()
+	for file in sorted(os.listdir(folder)):
+		if not file.endswith('.json'):
+			continue
+		raw, utf_8 = read_tournament_file(folder + file)
+		for game in get_file_games(raw, utf_8):
+			if end_date is None or game['date'] < end_date:
+				names.add(game['white'])
+				names.add(game['black'])
+	return sorted(names)
+
+def stream_games(folder, end_date=None):
+	'''
+	Generator of the normalised games of all the json files of a folder in chronological order. The games of
+	the same day keep the order of the files and the tours, as in the dataframe built by parse_files.
+	Only the files with games before the next game to yield are kept in memory.
+	:param folder: folder containing the json files
+	:param end_date: if given, only the games before this date (format %Y-%m-%d) are returned
+	:return: the generator of games, the date is given as a datetime
+	'''
+	# first pass to find the first game date of every file
+	files_index = list()
+	for file_order, file in enumerate(sorted(os.listdir(folder))):
 		if not file.endswith('.json'):
 			logger.info(f"Ignoring file {file}")
 			continue
-		full_path = folder + file
-		logger.info(f"Reading file {full_path}")
-		m = magic.Magic(mime_encoding=True)
-		with open(full_path, "rb") as read_it:
-			blob = open(full_path, 'rb').read()
-			encoding = m.from_buffer(blob)
-			raw = json.load(read_it)
-			data = pd.json_normalize(raw)
-			file_df = build_dataframe(data, encoding == 'utf-8')
-			final_dataset = pd.concat([final_dataset, file_df])
-	return final_dataset
-
-def get_training_dataset(full=False):
+		raw, _ = read_tournament_file(folder + file)
+		dates = [game['date'] for i in get_tour_numbers(raw['tours']) for game in raw['games']['tour_' + str(i)]]
+		if dates:
+			files_index.append((min(dates), file_order, file))
+	files_index.sort()
+
+	pending = list()
+	next_file = 0
+	try:
+		while next_file < len(files_index) or pending:
+			# open every file that can have games before the next pending game
+			while next_file < len(files_index) and (not pending or files_index[next_file][0] <= pending[0][0]):
+				_, file_order, file = files_index[next_file]
+				next_file += 1
+				logger.info(f"Reading file {folder + file}")
+				raw, utf_8 = read_tournament_file(folder + file)
+				games = iter(get_file_games(raw, utf_8))
+				game = next(games)
+				heapq.heappush(pending, (game['date'], file_order, 0, game, games))
+			date, file_order, position, game, games = heapq.heappop(pending)
+			if end_date is not None and date >= end_date:
+				# the remaining games are even later
+				return
+			game['date'] = datetime.strptime(date, '%Y-%m-%d')
+			yield game
+			game = next(games, None)
+			if game is not None:
+				heapq.heappush(pending, (game['date'], file_order, position + 1, game, games))
+	finally:
+		# the names built while reading the files are kept for the next executions
+		name_cache.save()
+
+def get_training_dataset(full=False, workers=1):
 	'''
 	Function to generate the training dataset from parsing the training json files
 	:param full: if True we take the full training dataset, if False we skip some training data
+	:param workers: number of processes to parse the files, see parse_files
 	:return: the training dataset
 	'''
 
 	try:
 		# TODO Add the data path as a yaml configuration parameter
 		train_folder = "./data/train/"
-		final_dataset = parse_files(train_folder)
+		# only the files added or changed since the last call are parsed
+		final_dataset = parse_files_incrementally(train_folder, "./data/io/train_chunks/", workers)
 
 		logger.info("Finished processing all training files")
 		logger.debug(final_dataset.info())
@@ -152,14 +483,17 @@ def standard_clean(data, no_drop=False):
 	:param no_drop: if we do not want to drop any columns
 	:return: the clean dataframe
 	'''
-	if not no_drop:
-		data.drop(['start_date', 'end_date'], inplace=True, axis=1)
-	data['date'] = pd.to_datetime(data['date'], format='%Y-%m-%d')
-	data.rename(columns={'date': 'game_date'}, inplace=True)
-	data['game_year'] = data['game_date'].dt.year
-	data = data.sort_values(by='game_date')
-	data['white'] = data['white'].astype("category")
-	data['black'] = data['black'].astype("category")
+	with instrumentation.stage('clean') as stage:
+		if not no_drop:
+			data.drop(['start_date', 'end_date'], inplace=True, axis=1)
+		data['date'] = pd.to_datetime(data['date'], format='%Y-%m-%d')
+		data.rename(columns={'date': 'game_date'}, inplace=True)
+		data['game_year'] = data['game_date'].dt.year
+		# stable sort, so the games of the same day keep their order and older years do not change with new files
+		data = data.sort_values(by='game_date', kind='stable')
+		data['white'] = data['white'].astype("category")
+		data['black'] = data['black'].astype("category")
+		stage.add(len(data))
 	return data
 
 def read_train_dataset(full=False):
@@ -204,31 +538,38 @@ def get_classic_ratings(filename):
 		f.close()
 	return ratings
 
-def prepare_ini_players(filename, games_data):
+def prepare_ini_players(filename, games_data, keep_history=False):
 	'''
-	It returns the total list of initial players before parsing any game results
+	It returns the registry with all initial players before parsing any game results
 	:param filename: the file with some initial classic ratings for players.
 	:param games_data: the games information with the players and games.
-	:return:
+	:param keep_history: True if the players should keep the full list of opponent ratings for analysis
+	:return: the players registry
+	'''
+	total_players = PlayerRegistry(keep_history=keep_history)
+	for new_player in iter_ini_players(filename, games_data, keep_history):
+		total_players.add(new_player)
+	logger.debug(f"Total number of players = {len(total_players)}")
+	return total_players
+
+def iter_ini_players(filename, games_data, keep_history=False):
+	'''
+	Same as prepare_ini_players without keeping the players, they are created one by one when they are needed
+	:return: generator of the initial players, in the order of prepare_ini_players
 	'''
 	logger.info("Preparing initial ratings")
 	ratings_dict = get_classic_ratings(filename)
 	players_pool = list(games_data['white'].unique())
 	players_pool.extend(list(games_data['black'].unique()))
 	players_pool = list(set(players_pool))
-	rated_players = list(ratings_dict.keys())
-	total_players = list()
 	for player in players_pool:
-		if player in rated_players:
+		if player in ratings_dict:
 			# default rapid rating is smaller for a top classic player
 			classic_rating = ratings_dict[player]
-			new_player = Player(player, classic_rating, classic_rating-200, False, True)
+			yield Player(player, classic_rating, classic_rating-200, False, True, keep_history)
 		else: # no info, default 1000
 			# TODO Add a yaml parameter for the default Elo rating
-			new_player = Player(player, 1000, 1000, True, True)
-		total_players.append(new_player)
-	logger.debug(f"Total number of players = {len(total_players)}")
-	return total_players
+			yield Player(player, 1000, 1000, True, True, keep_history)
 
 def read_evaluation_files(io=False):
 	'''
@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import pickle
+import time
+from datetime import datetime
+from src.checkpoints import load_latest_checkpoint
+from src.elo_ratings import EloRatings, save_year_ratings
+from src.player_registry import PlayerRegistry
+from src.rating_history import HistoryRecorder, save_history
+
+logger = logging.getLogger(__name__)
+
+'''
+Online updates of the ratings from an append-only log of finished games. The log is a json lines file with one
+game per line: {"date": "%Y-%m-%d", "white": name, "black": name, "result": 1.0, "time_control": "classic"},
+the names as built by build_name. The games are processed as soon as they are read and the state of the players
+is saved every some games or seconds together with the position of the log, so a restart only replays the games
+written after the last saved state.
+@author: A. Rosa Castillo
+'''
+def get_online_state_file(ratings_version):
+	# TODO yaml config file with data path
+	return './data/ratings/' + ratings_version + '/online/state.pickle'
+
+def append_game(log_file, date, white, black, result, time_control):
+	'''
+	Function to add a finished game at the end of the log, a full line is written at once
+	'''
+	line = json.dumps({'date': date, 'white': white, 'black': black, 'result': result,
+					   'time_control': time_control}, ensure_ascii=False)
+	with open(log_file, 'a', encoding='utf-8') as f:
+		f.write(line + '\n')
+		f.close()
+
+class OnlineRatings:
+	def __init__(self, ratings_version, log_file, registry=None, first_date=None, state_file=None,
+				 snapshot_games=50000, snapshot_seconds=60, publish=False, history=False):
+		'''
+		:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+		:param log_file: the json lines file with the finished games
+		:param registry: the registry of players to start with if there is no saved state
+		:param first_date: first date of historical data of the registry
+		:param state_file: the file of the saved state, see get_online_state_file
+		:param snapshot_games: the state is saved after this number of games
+		:param snapshot_seconds: the state is saved after this number of seconds with new games
+		:param publish: True to save also the ratings of the current year for the predictor with every state
+		:param history: True to record the rating history of the current year, published with the ratings
+		'''
+		self.ratings_version = ratings_version
+		self.log_file = log_file
+		self.state_file = state_file if state_file is not None else get_online_state_file(ratings_version)
+		self.snapshot_games = snapshot_games
+		self.snapshot_seconds = snapshot_seconds
+		self.publish = publish
+		# position of the log after the last processed game
+		self.offset = 0
+		self.total_games = 0
+		self.wrong_lines = 0
+		# games processed since the last saved state
+		self.pending_games = 0
+		self.last_save = time.monotonic()
+		self.last_date = None
+		# history of the current year and the dates of its games, in the order of the events of the recorder
+		self.history = HistoryRecorder() if history else None
+		self.history_dates = list()
+		if not self.load_state():
+			if registry is None:
+				registry = PlayerRegistry()
+			self.elo_ratings = EloRatings(registry, first_date, first_date)
+
+	def load_state(self):
+		'''
+		It reads the saved state of a previous execution
+		:return: True if there was a valid state
+		'''
+		if not os.path.exists(self.state_file):
+			return False
+		try:
+			with open(self.state_file, 'rb') as file:
+				state = pickle.load(file)
+				file.close()
+		except Exception as e:
+			logger.warning(f"Ignoring the online state. Reason: {e}")
+			return False
+		if state['ratings_version'] != self.ratings_version or state['log_file'] != os.path.abspath(self.log_file):
+			logger.warning("The online state belongs to another version or log file, ignoring it")
+			return False
+		registry = PlayerRegistry(state['players'], ini_ratings=state['ini_ratings'])
+		self.elo_ratings = EloRatings(registry, state['first_date'], state['last_date'])
+		self.offset = state['offset']
+		self.total_games = state['total_games']
+		self.last_date = state['last_date_str']
+		if self.history is not None and state.get('history_dates'):
+			self.history.chunks.append(state['history_events'])
+			self.history_dates = state['history_dates']
+		logger.info(f"Online ratings resumed after {self.total_games} games, at position {self.offset} of the log")
+		return True
+
+	def save_state(self):
+		'''
+		It saves the players and the position of the log, written to a temporary file first so an interrupted
+		run never leaves a broken state
+		'''
+		registry = self.elo_ratings.registry
+		state = {'ratings_version': self.ratings_version,
+				 'log_file': os.path.abspath(self.log_file),
+				 'offset': self.offset,
+				 'total_games': self.total_games,
+				 'first_date': self.elo_ratings.first_date,
+				 'last_date': self.elo_ratings.last_date,
+				 'last_date_str': self.last_date,
+				 'ini_ratings': registry.ini_ratings,
+				 'players': registry.to_list(),
+				 'history_events': self.history.get_events() if self.history is not None else None,
+				 'history_dates': self.history_dates}
+		os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+		with open(self.state_file + '.tmp', 'wb') as file:
+			pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+			file.flush()
+			os.fsync(file.fileno())
+			file.close()
+		os.replace(self.state_file + '.tmp', self.state_file)
+		if self.publish and self.last_date is not None:
+			self.publish_year()
+		self.pending_games = 0
+		self.last_save = time.monotonic()
+		logger.debug(f"Online state saved after {self.total_games} games")
+
+	def publish_year(self):
+		'''
+		It saves the ratings of the year of the last game for the predictor, and its rating history
+		'''
+		save_year_ratings(self.elo_ratings, self.ratings_version, self.last_date[:4])
+		if self.history is not None and self.history_dates:
+			save_history(self.ratings_version, self.last_date[:4], self.history, self.history_dates,
+						 self.elo_ratings.registry)
+
+	def set_last_date(self, date):
+		self.last_date = date
+		self.elo_ratings.last_date = datetime.strptime(date, '%Y-%m-%d')
+		if self.elo_ratings.first_date is None:
+			self.elo_ratings.first_date = self.elo_ratings.last_date
+
+	def process_lines(self, lines):
+		'''
+		It updates the ratings with the games of some lines of the log
+		:param lines: the complete lines as bytes
+		:return: the number of games processed
+		'''
+		elo_ratings = self.elo_ratings
+		ratings_version = self.ratings_version
+		processed = 0
+		for line in lines:
+			try:
+				game = json.loads(line)
+				date = game['date']
+				if date != self.last_date:
+					if self.last_date is not None and date[:4] != self.last_date[:4]:
+						# the ratings of a year are complete when the first game of the next year arrives
+						if self.publish:
+							self.publish_year()
+						if self.history is not None:
+							self.history.clear()
+							self.history_dates = list()
+					self.set_last_date(date)
+				elo_ratings.process_game(game['white'], game['black'], game['result'], game['time_control'],
+										 ratings_version)
+				if self.history is not None:
+					registry = elo_ratings.registry
+					for name in (game['white'], game['black']):
+						self.history.add_player(len(self.history_dates), registry.get_id(name), registry.get(name))
+					self.history_dates.append(date)
+			except Exception as e:
+				self.wrong_lines += 1
+				logger.error(f"Ignoring a wrong line of the games log. Reason: {e}")
+				continue
+			processed += 1
+		return processed
+
+	def consume(self, block_size=1 << 20):
+		'''
+		It processes all the complete lines written to the log after the current position. A line still
+		being written is left for the next call.
+		:param block_size: number of bytes read at once
+		:return: the number of games processed
+		'''
+		if not os.path.exists(self.log_file):
+			return 0
+		processed = 0
+		with open(self.log_file, 'rb') as f:
+			f.seek(self.offset)
+			rest = b''
+			while True:
+				block = f.read(block_size)
+				if not block:
+					break
+				block = rest + block
+				end = block.rfind(b'\n') + 1
+				rest = block[end:]
+				if end == 0:
+					continue
+				games = self.process_lines(block[:end].splitlines())
+				self.offset += end
+				self.total_games += games
+				self.pending_games += games
+				processed += games
+				if self.pending_games >= self.snapshot_games:
+					self.save_state()
+			f.close()
+		if self.pending_games and time.monotonic() - self.last_save >= self.snapshot_seconds:
+			self.save_state()
+		return processed
+
+	def follow(self, poll_interval=1.0, max_polls=None):
+		'''
+		It keeps processing the new games of the log as they are written, until the process is stopped.
+		The state is saved before leaving.
+		:param poll_interval: seconds to wait when there are no new games
+		:param max_polls: optional number of reads of the log before leaving
+		'''
+		polls = 0
+		try:
+			while max_polls is None or polls < max_polls:
+				polls += 1
+				if self.consume() == 0:
+					time.sleep(poll_interval)
+		finally:
+			if self.pending_games:
+				self.save_state()
+
+def start_online_ratings(ratings_version, log_file, ini_ratings=None, **kwargs):
+	'''
+	It creates the online ratings of a version, starting from the saved online state, or from the latest yearly
+	checkpoint of generate_ratings, or from the initial classic ratings
+	:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+	:param log_file: the json lines file with the finished games
+	:param ini_ratings: dictionary with the initial classic ratings of some players
+	:return: the OnlineRatings object
+	'''
+	registry = None
+	first_date = None
+	if not os.path.exists(kwargs.get('state_file') or get_online_state_file(ratings_version)):
+		year, first_date, players_list = load_latest_checkpoint(ratings_version)
+		if players_list is not None:
+			logger.info(f"Starting the online ratings from the checkpoint of year {year}")
+		registry = PlayerRegistry(players_list, ini_ratings=ini_ratings)
+	return OnlineRatings(ratings_version, log_file, registry, first_date, **kwargs)
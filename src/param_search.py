@@ -0,0 +1,240 @@
+import itertools
+import logging
+import math
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from src.array_ratings import ArrayEloRatings, CLASSIC, RAPID, get_game_codes
+from src.checkpoints import GAME_COLUMNS
+from src.elo_predictor import compute_elo_probabilities, compute_probabilities
+from src.elo_ratings import EloParameters, check_version
+from src.find_opt_seed import get_ref_2020_ratings
+from src.io_utils import get_classic_ratings, read_evaluation_files, read_train_dataset
+from src.player_registry import PlayerRegistry
+
+logger = logging.getLogger(__name__)
+
+# values tried by default for every parameter, the first seeds are the ones of find_opt_seed
+SEARCH_SPACE = {'seed': [900, 1000, 1500, 1800],
+				'k_new': [30, 40],
+				'k_default': [15, 20],
+				'k_top': [10],
+				'k_rapid': [20],
+				'prov_games': [20],
+				'top_rating': [2400],
+				'classic_draw': [(0.40, 0.65)],
+				'rapid_draw': [(0.45, 0.55)]}
+
+RESULT_COLUMNS = ['accuracy', 'correct_results', 'correct_ratings', 'stopped', 'stopped_year']
+
+# data shared by the worker processes, it is set once per process by init_worker
+search_data = dict()
+
+def get_grid_candidates(search_space):
+	'''
+	:param search_space: dictionary with the list of values of every parameter
+	:return: the list of EloParameters with all the combinations of values
+	'''
+	names = list(search_space.keys())
+	return [EloParameters(**dict(zip(names, values)))
+			for values in itertools.product(*[search_space[name] for name in names])]
+
+def get_random_candidates(search_space, nr_candidates, random_seed=None):
+	'''
+	:param search_space: dictionary with the list of values of every parameter
+	:param nr_candidates: number of candidates to draw
+	:param random_seed: optional seed of the random generator to repeat the search
+	:return: the list of EloParameters with values picked at random for every parameter, without repetitions
+	'''
+	rnd = random.Random(random_seed)
+	total = math.prod([len(values) for values in search_space.values()])
+	found = dict()
+	while len(found) < min(nr_candidates, total):
+		values = {name: rnd.choice(values) for name, values in search_space.items()}
+		found.setdefault(tuple(values.values()), values)
+	return [EloParameters(**values) for values in found.values()]
+
+def load_search_data(ratings_version, ini_ratings_file="rating_2014.txt"):
+	'''
+	Function to read only once all the data needed to evaluate the candidates
+	:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+	:param ini_ratings_file: the file with some initial classic ratings for players
+	:return: dictionary with the games and the reference data
+	'''
+	train_df = read_train_dataset(False)
+	full_train_df = read_train_dataset(True)
+	eval_df = read_evaluation_files()
+	data = {'ratings_version': ratings_version,
+			'train_df': train_df,
+			# the early stop compares the candidates at the end of every year of the training data
+			'train_years': sorted(train_df['game_year'].unique().tolist()),
+			'eval_df': eval_df,
+			'ini_ratings': get_classic_ratings(ini_ratings_file),
+			'ref_ratings_2020': get_ref_2020_ratings()}
+	# if the evaluation training data is the beginning of the full data, the 2020 ratings continue from the
+	# evaluation state and only the remaining games are processed
+	prefix = len(train_df) <= len(full_train_df) and \
+		full_train_df[GAME_COLUMNS].iloc[:len(train_df)].reset_index(drop=True).equals(
+			train_df[GAME_COLUMNS].reset_index(drop=True))
+	if prefix:
+		data['extra_df'] = full_train_df.iloc[len(train_df):]
+	else:
+		data['full_train_df'] = full_train_df
+	logger.debug(f"Full training data continues the evaluation training data: {prefix}")
+	return data
+
+def init_worker(data, best_accuracies):
+	search_data.update(data)
+	search_data['best_accuracies'] = best_accuracies
+
+def run_games(elo_ratings, games_df):
+	'''
+	It updates the ratings of the array engine with the given games, processing rounds of independent games
+	'''
+	if len(games_df) == 0:
+		return elo_ratings
+	elo_ratings.last_date = games_df.game_date.max()
+	w_ids, b_ids = elo_ratings.get_player_ids(games_df['white'], games_df['black'])
+	rapid_games = (games_df['time_control'] == 'rapid').to_numpy()
+	results = games_df['result'].to_numpy(dtype=float)
+	elo_ratings.process_games_by_rounds(w_ids, b_ids, results, rapid_games, search_data['ratings_version'])
+	return elo_ratings
+
+def new_ratings(params, games_df):
+	'''
+	:param params: the EloParameters of the candidate
+	:param games_df: the games used to create the initial players
+	:return: the array engine with the initial players of the candidate
+	'''
+	# same initial players as prepare_ini_players_with_seed without reading the ratings file again
+	registry = PlayerRegistry(ini_ratings=search_data['ini_ratings'], default_rating=params.seed)
+	for name in pd.unique(pd.concat([games_df['white'], games_df['black']])):
+		registry.add(registry.create_player(name))
+	first_date = games_df.game_date.min()
+	return ArrayEloRatings(registry, first_date, first_date, params)
+
+def get_eval_accuracy(elo_ratings, params):
+	'''
+	Function to predict the evaluation games with the current ratings. Players without ratings get 1000.
+	:return: the accuracy and the number of correct predictions
+	'''
+	eval_df = search_data['eval_df']
+	separate_ratings, _ = check_version(search_data['ratings_version'])
+	slots = np.where((eval_df['time_control'] == 'rapid').to_numpy() & separate_ratings, RAPID, CLASSIC)
+	ratings = list()
+	for column in ['white', 'black']:
+		ids, _, _ = get_game_codes(eval_df[column], elo_ratings)
+		player_ratings = elo_ratings.ratings[slots, np.maximum(ids, 0)].astype(float)
+		player_ratings[ids < 0] = 1000
+		ratings.append(player_ratings)
+	elo_p = compute_elo_probabilities(ratings[0] - ratings[1])
+	predicted = compute_probabilities(elo_p, (eval_df['time_control'] == 'classic').to_numpy(), params)
+	correct_predictions = int((predicted == eval_df['result'].to_numpy(dtype=float)).sum())
+	return (correct_predictions * 100) / len(eval_df), correct_predictions
+
+def get_correct_ratings(elo_ratings):
+	'''
+	:return: number of players with a classic rating at most 15 points away from the reference 2020 rating
+	'''
+	ref_ratings_2020 = search_data['ref_ratings_2020']
+	registry = elo_ratings.registry
+	correct = 0
+	for name, ref_rating in ref_ratings_2020.items():
+		player_id = registry.get_id(name)
+		if player_id is not None and abs(ref_rating - elo_ratings.ratings[CLASSIC, player_id]) <= 15:
+			correct += 1
+	return correct
+
+def update_best_accuracy(year_index, accuracy):
+	'''
+	:param year_index: the position of the year in the training years
+	:param accuracy: the accuracy of a candidate with the ratings at the end of that year
+	:return: the best accuracy of all candidates at the end of that year
+	'''
+	best_accuracies = search_data['best_accuracies']
+	with best_accuracies.get_lock():
+		best_accuracies[year_index] = max(best_accuracies[year_index], accuracy)
+		return best_accuracies[year_index]
+
+def evaluate_candidate(params, early_stop_margin=None):
+	'''
+	Function to compute the metrics of a candidate: the accuracy of the predictions for the evaluation games and
+	the number of right 2020 ratings. With an early stop margin the accuracy is also computed with the ratings of
+	the end of every training year, and the candidate stops before the next years if it is too far from the best
+	accuracy of the candidates at the end of the same year.
+	:param params: the EloParameters of the candidate
+	:param early_stop_margin: accuracy points below the best accuracy to stop the candidate, None to never stop
+	:return: dictionary with the parameters and the metrics
+	'''
+	result = params.to_dict()
+	train_df = search_data['train_df']
+	elo_ratings = new_ratings(params, train_df)
+	if early_stop_margin is None:
+		years_df = [train_df]
+	else:
+		years_df = [train_df.loc[train_df['game_year'] == year] for year in search_data['train_years']]
+	for year_index, year_df in enumerate(years_df):
+		elo_ratings = run_games(elo_ratings, year_df)
+		accuracy, correct_predictions = get_eval_accuracy(elo_ratings, params)
+		if early_stop_margin is None:
+			continue
+		best = update_best_accuracy(year_index, accuracy)
+		if accuracy < best - early_stop_margin:
+			year = search_data['train_years'][year_index]
+			logger.info(f"Stopping candidate {result} at the end of {year}, accuracy {accuracy} far from the "
+						f"best one {best}")
+			result['accuracy'] = accuracy
+			result['correct_results'] = correct_predictions
+			result['correct_ratings'] = None
+			result['stopped'] = True
+			result['stopped_year'] = year
+			return result
+	result['accuracy'] = accuracy
+	result['correct_results'] = correct_predictions
+
+	if 'extra_df' in search_data:
+		elo_ratings = run_games(elo_ratings, search_data['extra_df'])
+	else:
+		full_train_df = search_data['full_train_df']
+		# the initial players are the same ones as for the evaluation ratings
+		elo_ratings = run_games(new_ratings(params, train_df), full_train_df)
+	result['correct_ratings'] = get_correct_ratings(elo_ratings)
+	result['stopped'] = False
+	result['stopped_year'] = None
+	return result
+
+def search_parameters(candidates, ratings_version='v4_val', workers=None, early_stop_margin=None):
+	'''
+	Function to evaluate all the candidates in a pool of processes. The games are read only once and shared
+	with the worker processes.
+	:param candidates: list of EloParameters to evaluate
+	:param ratings_version: version of the ratings to use [v1, v2 ,v3, v4]
+	:param workers: number of processes, by default the number of cpus
+	:param early_stop_margin: accuracy points below the best accuracy to stop a candidate, None to never stop
+	:return: dataframe with the parameters and the metrics of every candidate, the best ones first
+	'''
+	logger.info(f"Searching the best parameters between {len(candidates)} candidates")
+	data = load_search_data(ratings_version)
+	# with fork the workers get the data from the parent process without copying it
+	methods = multiprocessing.get_all_start_methods()
+	context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+	# best accuracy at the end of every training year, shared by the workers
+	best_accuracies = context.Array('d', len(data['train_years']))
+	results = list()
+	with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+							 initargs=(data, best_accuracies)) as executor:
+		futures = [executor.submit(evaluate_candidate, params, early_stop_margin) for params in candidates]
+		for future in as_completed(futures):
+			try:
+				result = future.result()
+				logger.info(f"Candidate evaluated: {result}")
+				results.append(result)
+			except Exception as e:
+				logger.error(f"Error while evaluating a candidate. Reason: {e}")
+	columns = list(EloParameters().to_dict().keys()) + RESULT_COLUMNS
+	results = pd.DataFrame(results, columns=columns)
+	# the accuracy of the stopped candidates is not the final one, they go last
+	return results.sort_values(by=['stopped', 'accuracy', 'correct_ratings'], ascending=[True, False, False],
+							   ignore_index=True)
@@ -4,11 +4,17 @@ logger = logging.getLogger(__name__)
 
 '''
 Player class to keep all games information from a player
-including win, loss, and opponent ratings metrics
+including win, loss, and opponent ratings metrics.
+The opponent ratings are kept as running sums so the memory per player is constant.
+The full list of opponent ratings is only kept if keep_history is True.
 @author: A. Rosa Castillo
 '''
 class Player:
-	def __init__(self, name, rating, rapid_rating, c_prov_rating, r_prov_rating):
+	__slots__ = ('name', 'rating', 'r_rating', 'c_prov_rating', 'r_prov_rating', 'nr_c_games', 'nr_r_games',
+				 'c_wins', 'r_wins', 'c_losses', 'r_losses', 'c_opponents_sum', 'r_opponents_sum',
+				 'c_opponent_ratings', 'r_opponent_ratings')
+
+	def __init__(self, name, rating, rapid_rating, c_prov_rating, r_prov_rating, keep_history=False):
 		self.name = name
 		self.rating = rating
 		self.r_rating = rapid_rating
@@ -20,8 +26,11 @@ class Player:
 		self.r_wins = 0
 		self.c_losses = 0
 		self.r_losses = 0
-		self.c_opponent_ratings = []
-		self.r_opponent_ratings = []
+		self.c_opponents_sum = 0
+		self.r_opponents_sum = 0
+		# optional history of opponent ratings, only for analysis
+		self.c_opponent_ratings = [] if keep_history else None
+		self.r_opponent_ratings = [] if keep_history else None
 
 	def set_rating(self, rating, rapid_game):
 		if rapid_game:
@@ -49,37 +58,50 @@ class Player:
 		nr_games = self.get_nr_games(rapid_game)
 		wins = self.get_wins(rapid_game)
 		losses = self.get_losses(rapid_game)
-		opponent_ratings = self.get_opponent_ratings(rapid_game)
+		opponents_sum = self.get_opponents_sum(rapid_game)
 
 		if nr_games == 0:
 			logger.error(f"Zero games played for player {self.name}")
 			return
 
-		prov_rating = round((sum(opponent_ratings) + 400 * (wins - losses)) / nr_games)
+		prov_rating = round((opponents_sum + 400 * (wins - losses)) / nr_games)
 
 		self.set_rating(prov_rating, rapid_game)
 
-	def check_prov_rating(self, rapid_game):
-		if self.get_flag_prov_rating(rapid_game) and self.get_nr_games(rapid_game) >= 20:
+	def check_prov_rating(self, rapid_game, prov_games=20):
+		if self.get_flag_prov_rating(rapid_game) and self.get_nr_games(rapid_game) >= prov_games:
 			self.set_flag_prov_rating(False, rapid_game)
 
 	def add_opponent_rating(self, o_rating, rapid_game):
 		if rapid_game:
-			self.r_opponent_ratings.append(o_rating)
+			self.r_opponents_sum += o_rating
+			if self.r_opponent_ratings is not None:
+				self.r_opponent_ratings.append(o_rating)
 		else:
-			self.c_opponent_ratings.append(o_rating)
+			self.c_opponents_sum += o_rating
+			if self.c_opponent_ratings is not None:
+				self.c_opponent_ratings.append(o_rating)
 
 	def get_avg_opponents_ratings(self, rapid_game):
 		if rapid_game:
 			if self.nr_r_games > 0:
-				return round(sum(self.r_opponent_ratings) / self.nr_r_games)
+				return round(self.r_opponents_sum / self.nr_r_games)
 
 			return 0
 		if self.nr_c_games > 0:
-			return round(sum(self.c_opponent_ratings) / self.nr_c_games)
+			return round(self.c_opponents_sum / self.nr_c_games)
 		return 0
 
+	def get_opponents_sum(self, rapid_game):
+		if rapid_game:
+			return self.r_opponents_sum
+		return self.c_opponents_sum
+
 	def get_opponent_ratings(self, rapid_game):
+		'''
+		:param rapid_game: True for the rapid games history
+		:return: the list of opponent ratings or None if the player does not keep the history
+		'''
 		if rapid_game:
 			return self.r_opponent_ratings
 		return self.c_opponent_ratings
@@ -0,0 +1,92 @@
+import logging
+from src.player import Player
+
+logger = logging.getLogger(__name__)
+
+'''
+Registry class to keep the pool of players indexed by name and by an integer id.
+The integer id of a player is its position in the list of players, so the insertion order is kept
+and the list can be exported as it is.
+@author: A. Rosa Castillo
+'''
+class PlayerRegistry:
+	# False for the registries with players out of memory, see cold_players
+	in_memory = True
+
+	def __init__(self, players_list=None, keep_history=False, ini_ratings=None, default_rating=1000):
+		# the list is shared and not copied, so any new player added here is visible from the original list
+		self.players = players_list if players_list is not None else list()
+		# True if the new players should keep the full history of opponent ratings
+		self.keep_history = keep_history
+		# optional dictionary with the initial classic ratings, to create the players when they are first found
+		self.ini_ratings = ini_ratings
+		# initial rating of the new players without any rating information
+		self.default_rating = default_rating
+		self.ids = dict()
+		for player_id, player in enumerate(self.players):
+			# if a name is repeated we keep the first one, as the linear search used to do
+			self.ids.setdefault(player.name, player_id)
+
+	def add(self, player):
+		'''
+		It adds a new player at the end of the registry
+		:param player: the Player object to add
+		:return: the integer id of the player
+		'''
+		player_id = self.ids.get(player.name)
+		if player_id is not None:
+			logger.warning(f"Player {player.name} already in the registry. Keeping the registered one")
+			return player_id
+		player_id = len(self.players)
+		self.players.append(player)
+		self.ids[player.name] = player_id
+		return player_id
+
+	def create_player(self, name):
+		'''
+		It creates a new player with the initial ratings, rated if the player has an initial classic rating
+		and provisionally rated with the default rating otherwise. The player is not added to the registry.
+		:param name: the name of the player
+		:return: the new Player object
+		'''
+		if self.ini_ratings is not None and name in self.ini_ratings:
+			# default rapid rating is smaller for a top classic player
+			classic_rating = self.ini_ratings[name]
+			return Player(name, classic_rating, classic_rating-200, False, True, self.keep_history)
+		return Player(name, self.default_rating, self.default_rating, True, True, self.keep_history)
+
+	def add_initial_players(self, names):
+		'''
+		It adds the players before their first game with their initial ratings, see create_player
+		:param names: iterable with the names of the new players
+		'''
+		for name in names:
+			self.add(self.create_player(name))
+
+	def get(self, name):
+		'''
+		:param name: the name of the player
+		:return: the Player object or None if the player is not registered
+		'''
+		player_id = self.ids.get(name)
+		if player_id is None:
+			return None
+		return self.players[player_id]
+
+	def get_id(self, name):
+		return self.ids.get(name)
+
+	def get_by_id(self, player_id):
+		return self.players[player_id]
+
+	def to_list(self):
+		return self.players
+
+	def __contains__(self, name):
+		return name in self.ids
+
+	def __len__(self):
+		return len(self.players)
+
+	def __iter__(self):
+		return iter(self.players)
@@ -0,0 +1,356 @@
+import asyncio
+import http.client
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from src.elo_predictor import EloPredictor
+from src.snapshots import META_FILE, get_snapshot_folder, get_snapshot_years
+
+logger = logging.getLogger(__name__)
+
+'''
+Local prediction service. It keeps an EloPredictor in memory and answers the predictions over HTTP on localhost:
+- POST /predict with one game {"white", "black", "date", "time_control"}
+- POST /predict_batch with {"games": [...]}
+- GET /health with the version and the available years
+The single predictions received at the same time are grouped and predicted with one call to predict_batch.
+When the ratings of the version change on disk a new predictor is loaded and replaces the old one, the batches
+already started finish with the old one.
+@author: A. Rosa Castillo
+'''
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+DEFAULT_PORT = 8765
+
+# time controls of the games known by the predictor
+TIME_CONTROLS = ('classic', 'rapid')
+
+def get_ratings_signature(ratings_version):
+	'''
+	:param ratings_version: the version of the ratings
+	:return: tuple with the name, the size and the modification time of every ratings file of the version,
+	it changes when a year is computed again
+	'''
+	# TODO yaml config file with data path
+	folder = './data/ratings/' + ratings_version + '/'
+	signature = list()
+	for file in sorted(os.listdir(folder)):
+		if file.endswith('.pickle'):
+			stat = os.stat(folder + file)
+			signature.append((file, stat.st_size, stat.st_mtime_ns))
+	for year in get_snapshot_years(ratings_version):
+		stat = os.stat(get_snapshot_folder(ratings_version, year) + META_FILE)
+		signature.append((year, stat.st_size, stat.st_mtime_ns))
+	return tuple(signature)
+
+def load_predictor(ratings_version, cache_size=4):
+	'''
+	It creates the predictor and it loads the latest years, so the first requests do not wait for the disk
+	:return: the predictor
+	'''
+	predictor = EloPredictor(ratings_version, cache_size)
+	for year in sorted(predictor.avlb_years, key=int)[-cache_size:]:
+		predictor.get_year_data(year)
+	return predictor
+
+def get_game(payload):
+	'''
+	:param payload: the dictionary of a game received in a request
+	:return: the game with the keys used by predict_games, a ValueError is raised if some value is missing
+	'''
+	if not isinstance(payload, dict):
+		raise ValueError("Every game should be a json object")
+	missing = [key for key in ('white', 'black', 'date') if key not in payload]
+	if missing:
+		raise ValueError(f"Missing values {missing}")
+	date = str(payload['date'])[:10]
+	try:
+		datetime.strptime(date, '%Y-%m-%d')
+	except ValueError:
+		raise ValueError(f"Wrong date {payload['date']!r}, it should be YYYY-MM-DD")
+	time_control = str(payload.get('time_control', 'classic'))
+	if time_control not in TIME_CONTROLS:
+		raise ValueError(f"Wrong time_control {time_control!r}, it should be one of {list(TIME_CONTROLS)}")
+	return {'white': str(payload['white']),
+			'black': str(payload['black']),
+			'date': date,
+			'time_control': time_control}
+
+def get_json_value(value):
+	# json has no nan, the games without ratings information are returned as null
+	return None if math.isnan(value) else value
+
+async def read_request(reader):
+	'''
+	It reads the request line, the headers and the body of a request
+	:return: the method, the path and the body, a ValueError is raised if the request is malformed
+	'''
+	request_line = await reader.readline()
+	parts = request_line.decode('latin-1').split(' ', 2)
+	if len(parts) != 3:
+		raise ValueError(f"malformed request line {request_line[:100]!r}")
+	method, path, _ = parts
+	headers = dict()
+	while True:
+		line = await reader.readline()
+		if line in (b'\r\n', b'\n', b''):
+			break
+		key, _, value = line.decode('latin-1').partition(':')
+		headers[key.strip().lower()] = value.strip()
+	content_length = headers.get('content-length', '0')
+	if not content_length.isdigit():
+		raise ValueError(f"wrong Content-Length {content_length[:20]!r}")
+	try:
+		body = await reader.readexactly(int(content_length))
+	except asyncio.IncompleteReadError as e:
+		raise ValueError(f"body of {len(e.partial)} bytes shorter than its Content-Length {content_length}")
+	return method, path, body
+
+def predict_games(predictor, games):
+	'''
+	It predicts many games with a single call to predict_batch
+	:param predictor: the predictor
+	:param games: the list of games as given by get_game
+	:return: the list of dictionaries with the result and the probabilities of every game
+	'''
+	if not games:
+		return list()
+	pred, elo_p, white_prob, black_prob = predictor.predict_batch([game['white'] for game in games],
+																  [game['black'] for game in games],
+																  [game['date'] for game in games],
+																  [game['time_control'] for game in games])
+	return [{'result': get_json_value(values[0]),
+			 'probability': get_json_value(values[1]),
+			 'white_prob': get_json_value(values[2]),
+			 'black_prob': get_json_value(values[3])}
+			for values in zip(pred.tolist(), elo_p.tolist(), white_prob.tolist(), black_prob.tolist())]
+
+class PredictionServer:
+	def __init__(self, ratings_version, host='127.0.0.1', port=DEFAULT_PORT, max_batch=256, max_delay=0.002,
+				 reload_interval=5.0, cache_size=4):
+		'''
+		:param ratings_version: the version of the ratings
+		:param host: only local addresses should be used, there is no authentication
+		:param port: the port, 0 to take any free one
+		:param max_batch: maximum number of single predictions grouped in one batch
+		:param max_delay: seconds that a single prediction waits for other ones to group them
+		:param reload_interval: seconds between the checks of the ratings files, None to never reload
+		:param cache_size: number of years of ratings kept in memory by the predictor
+		'''
+		self.ratings_version = ratings_version
+		self.host = host
+		self.port = port
+		self.max_batch = max_batch
+		self.max_delay = max_delay
+		self.reload_interval = reload_interval
+		self.cache_size = cache_size
+		self.predictor = None
+		self.signature = None
+		self.reloads = 0
+		# one thread for the predictions, so the predictor is never used by two batches at the same time
+		self.executor = ThreadPoolExecutor(max_workers=1)
+		self.queue = None
+		self.server = None
+		self.tasks = list()
+
+	async def start(self):
+		loop = asyncio.get_running_loop()
+		self.signature = get_ratings_signature(self.ratings_version)
+		self.predictor = await loop.run_in_executor(None, load_predictor, self.ratings_version, self.cache_size)
+		self.queue = asyncio.Queue()
+		self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+		# the real port if any free one was requested
+		self.port = self.server.sockets[0].getsockname()[1]
+		self.tasks.append(asyncio.create_task(self.batch_loop()))
+		if self.reload_interval:
+			self.tasks.append(asyncio.create_task(self.reload_loop()))
+		logger.info(f"Prediction server of version {self.ratings_version} listening at {self.host}:{self.port}")
+
+	async def serve_forever(self):
+		await self.server.serve_forever()
+
+	async def close(self):
+		self.server.close()
+		await self.server.wait_closed()
+		for task in self.tasks:
+			task.cancel()
+		await asyncio.gather(*self.tasks, return_exceptions=True)
+		self.executor.shutdown(wait=True)
+
+	async def predict(self, game):
+		'''
+		It predicts a single game, grouped with the other single predictions received at the same time
+		:return: the dictionary with the result and the probabilities of the game
+		'''
+		future = asyncio.get_running_loop().create_future()
+		await self.queue.put((game, future))
+		return await future
+
+	async def predict_batch(self, games):
+		predictor = self.predictor
+		return await asyncio.get_running_loop().run_in_executor(self.executor, predict_games, predictor, games)
+
+	async def batch_loop(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			batch = [await self.queue.get()]
+			deadline = loop.time() + self.max_delay
+			while len(batch) < self.max_batch:
+				if not self.queue.empty():
+					batch.append(self.queue.get_nowait())
+					continue
+				timeout = deadline - loop.time()
+				if timeout <= 0:
+					break
+				try:
+					batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+				except asyncio.TimeoutError:
+					break
+			try:
+				results = await self.predict_batch([game for game, _ in batch])
+			except Exception as e:
+				logger.error(f"Error while predicting a batch of {len(batch)} games, predicting them one by one. "
+							 f"Reason: {e}")
+				await self.predict_one_by_one(batch)
+				continue
+			for (_, future), result in zip(batch, results):
+				if not future.done():
+					future.set_result(result)
+
+	async def predict_one_by_one(self, batch):
+		'''
+		It predicts every game of a failed batch on its own, so only the requests that really fail get the error
+		:param batch: list of tuples with the game and the future of its request
+		'''
+		for game, future in batch:
+			try:
+				result = (await self.predict_batch([game]))[0]
+			except Exception as e:
+				if not future.done():
+					future.set_exception(e)
+				continue
+			if not future.done():
+				future.set_result(result)
+
+	async def reload_loop(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			await asyncio.sleep(self.reload_interval)
+			try:
+				await self.reload_if_changed(loop)
+			except Exception as e:
+				logger.error(f"Error while reloading the ratings of version {self.ratings_version}. Reason: {e}")
+
+	async def reload_if_changed(self, loop):
+		'''
+		It loads a new predictor if the ratings files changed. The new predictor is loaded in another thread
+		while the old one keeps answering, and it replaces the old one only when it is ready.
+		:return: True if the predictor was replaced
+		'''
+		signature = get_ratings_signature(self.ratings_version)
+		if signature == self.signature:
+			return False
+		logger.info(f"The ratings of version {self.ratings_version} changed, loading them again")
+		predictor = await loop.run_in_executor(None, load_predictor, self.ratings_version, self.cache_size)
+		self.predictor = predictor
+		self.signature = signature
+		self.reloads += 1
+		return True
+
+	async def dispatch(self, method, path, body):
+		'''
+		:return: the http status and the json response of a request
+		'''
+		if method == 'GET' and path == '/health':
+			return 200, {'ratings_version': self.ratings_version,
+						 'years': sorted(self.predictor.avlb_years, key=int),
+						 'reloads': self.reloads}
+		if method != 'POST' or path not in ('/predict', '/predict_batch'):
+			return 404, {'error': f"Unknown request {method} {path}"}
+		try:
+			payload = json.loads(body)
+			if path == '/predict':
+				game = get_game(payload)
+			else:
+				games = [get_game(game) for game in payload['games']]
+		except Exception as e:
+			return 400, {'error': f"Wrong request. Reason: {e}"}
+		if path == '/predict':
+			return 200, await self.predict(game)
+		return 200, {'predictions': await self.predict_batch(games)}
+
+	async def handle_connection(self, reader, writer):
+		try:
+			method, path, body = await read_request(reader)
+		except ValueError as e:
+			logger.warning(f"Wrong request. Reason: {e}")
+			status, response = 400, {'error': f"Wrong request. Reason: {e}"}
+		else:
+			try:
+				status, response = await self.dispatch(method, path, body)
+			except Exception as e:
+				logger.error(f"Error while answering a request. Reason: {e}")
+				status, response = 500, {'error': str(e)}
+		data = json.dumps(response).encode('utf-8')
+		writer.write(f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+					 f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data)
+		try:
+			await writer.drain()
+		finally:
+			writer.close()
+
+def run_server(ratings_version, port=DEFAULT_PORT, **kwargs):
+	'''
+	It runs the prediction server until the process is stopped
+	'''
+	async def serve():
+		server = PredictionServer(ratings_version, port=port, **kwargs)
+		await server.start()
+		try:
+			await server.serve_forever()
+		finally:
+			await server.close()
+	asyncio.run(serve())
+
+'''
+Client of the local prediction server
+@author: A. Rosa Castillo
+'''
+class PredictionClient:
+	def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, timeout=30):
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+
+	def request(self, method, path, payload=None):
+		'''
+		:return: the json response, a RuntimeError is raised if the server answers with an error
+		'''
+		connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+		try:
+			body = json.dumps(payload) if payload is not None else None
+			connection.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+			response = connection.getresponse()
+			data = json.loads(response.read())
+		finally:
+			connection.close()
+		if response.status != 200:
+			raise RuntimeError(f"Prediction server error {response.status}: {data.get('error')}")
+		return data
+
+	def health(self):
+		return self.request('GET', '/health')
+
+	def predict(self, white, black, date, time_control='classic'):
+		return self.request('POST', '/predict', {'white': white, 'black': black, 'date': date,
+												 'time_control': time_control})
+
+	def predict_batch(self, games):
+		'''
+		:param games: list of dictionaries with white, black, date and time_control
+		:return: the list of predictions in the same order
+		'''
+		return self.request('POST', '/predict_batch', {'games': games})['predictions']
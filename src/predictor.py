@@ -1,7 +1,25 @@
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 from src.io_utils import *
+from src.instrumentation import instrumentation
 
 logger = logging.getLogger(__name__)
 
+def get_batch_games(white_players, black_players=None, game_dates=None, game_types=None):
+	'''
+	:return: the names of the white and the black players, the dates and the types of the games as numpy arrays,
+	taken from the dataframe if the first parameter is a dataframe
+	'''
+	if isinstance(white_players, pd.DataFrame):
+		games_df = white_players
+		date_column = 'game_date' if 'game_date' in games_df.columns else 'date'
+		return games_df['white'].to_numpy(dtype=object), games_df['black'].to_numpy(dtype=object), \
+			games_df[date_column].to_numpy(), games_df['time_control'].to_numpy(dtype=object)
+	return np.asarray(white_players, dtype=object), np.asarray(black_players, dtype=object), \
+		np.asarray(game_dates), np.asarray(game_types, dtype=object)
+
 class Predictor:
 	def __init__(self, name):
 		self.name = name
@@ -10,62 +28,166 @@ class Predictor:
 		logger.info("Parent class. Method to be implemented by each children")
 		pass
 
+	def predict_batch(self, white_players, black_players=None, game_dates=None, game_types=None):
+		'''
+		It predicts the results of many games at once. The games can be given as a dataframe with the columns
+		white, black, game_date (or date) and time_control, or as arrays with the same values.
+		By default it calls get_prediction for every game, children classes should implement a faster version.
+		:param white_players: the names of the white players or the dataframe with the games
+		:param black_players: the names of the black players
+		:param game_dates: the dates of the games
+		:param game_types: the types of the games
+		:return: numpy arrays with the predicted results, the winning probabilities of white based on the ratings
+		and the winning probabilities of white and black players based on statistics (nan if not available)
+		'''
+		white_players, black_players, game_dates, game_types = get_batch_games(white_players, black_players,
+																			   game_dates, game_types)
+		pred = np.array([self.get_prediction(white_player, black_player, game_date, game_type)
+						 for white_player, black_player, game_date, game_type
+						 in zip(white_players, black_players, game_dates, game_types)], dtype=float)
+		no_data = np.full(len(pred), np.nan)
+		return pred, no_data, no_data.copy(), no_data.copy()
+
 	def evaluate_predictor(self, evaluation_df):
 		logger.info("Parent class. Method to be implemented by each children")
 		pass
 
-	def predict_games(self, test_folder, results_folder):
+	def predict_tournament(self, raw, utf_8=False):
+		'''
+		It predicts the results of all the games of a tournament
+		:param raw: the json parsed data of the tournament
+		:param utf_8: True if the used encoding is Utf-8
+		:return: the dictionary with the tournament data and the predicted results
+		'''
+		nr_tour = raw['tours']
+		game_type = raw['time_control']
+		logger.info("Generating predictions for the different tournaments")
+		games = dict()
+		for i in range(1, nr_tour+1):
+			games_dict_list = list()
+			for d in raw['games']['tour_' + str(i)]:
+				d['white'] = build_name(d['white'], utf_8)
+				d['black'] = build_name(d['black'], utf_8)
+				games_dict_list.append(d)
+			games['tour_'+str(i)] = games_dict_list
+
+		# all the games of the tournament are predicted at once
+		all_games = [d for games_dict_list in games.values() for d in games_dict_list]
+		results, _, _, _ = self.predict_batch([d['white'] for d in all_games], [d['black'] for d in all_games],
+											  [d['date'] for d in all_games], [game_type] * len(all_games))
+		no_ratings = 0
+		for d, result in zip(all_games, results.tolist()):
+			# json has no nan, the games without ratings information are written as null
+			if math.isnan(result):
+				result = None
+				no_ratings += 1
+			d['result'] = result
+		if no_ratings > 0:
+			logger.error(f"{no_ratings} games of the tournament {raw['name']} without ratings information, "
+						 f"their result is null")
+
+		json_dict = dict()
+		json_dict['name'] = raw['name']
+		json_dict['start_date'] = raw['start_date']
+		json_dict['end_date'] = raw['end_date']
+		json_dict['games'] = games
+		json_dict['tours'] = str(nr_tour)
+		json_dict['time_control'] = game_type
+		return json_dict
+
+	def predict_file(self, test_folder, file, results_folder):
+		'''
+		It predicts the results of the games of a tournament file and it saves them at the results folder
+		:param test_folder: input folder
+		:param file: the name of the json file
+		:param results_folder: output folder
+		'''
+		full_path = test_folder + file
+		logger.info(f"Reading file {full_path}")
+		# the file is read only once for the encoding and for the json data
+		with instrumentation.stage('predict_file') as stage:
+			raw, utf_8 = read_tournament_file(full_path)
+			json_dict = self.predict_tournament(raw, utf_8)
+			stage.add(sum(len(games) for games in json_dict['games'].values()))
+
+			logging.info(f"Generating results file {results_folder+file}")
+			with open(results_folder+file, "w") as fp:
+				# one write of the whole json, json.dump writes every small piece
+				fp.write(json.dumps(json_dict, ensure_ascii=False, indent=4))
+				fp.close()
+
+	def predict_games(self, test_folder, results_folder, workers=1, chunk_size=64):
 		'''
 		It predicts the results for the games included in the test folder and it saves the results in json format
 		at the results folder.
 		:param test_folder: input folder
 		:param results_folder: output folder
-		:return:
+		:param workers: number of processes, with more than one the files are shared between worker processes
+		:param chunk_size: number of files given to a worker process at once
+		:return: the list of files that could not be predicted
 		'''
-		files = os.listdir(test_folder)
-		for file in files:
+		files = list()
+		for file in sorted(os.listdir(test_folder)):
 			if not file.endswith('.json'):
 				logger.info(f"Ignoring file {file}")
 				continue
-			full_path = test_folder + file
-			logger.info(f"Reading file {full_path}")
-			m = magic.Magic(mime_encoding=True)
-			with open(full_path, "rb") as read_it:
-				blob = open(full_path, 'rb').read()
-				encoding = m.from_buffer(blob)
-				logger.debug(f"Encoding of the file {encoding}")
-				raw = json.load(read_it)
-				data = pd.json_normalize(raw)
-				filename = data['name'].values[0]
-				nr_tour = data['tours'].values[0]
-				game_type = data['time_control'].values[0]
-				prefix = 'games.tour_'
-				logger.info("Generating predictions for the different tournaments")
-				games = dict()
-				for i in range(1, nr_tour+1):
-					column_name = prefix + str(i)
-					games_dict_list = list()
-					for d in data[column_name][0]:
-						white_player = build_name(d['white'], encoding == 'utf-8')
-						d['white'] = white_player
-						black_player = build_name(d['black'], encoding == 'utf-8')
-						d['black'] = black_player
-						game_date = d['date']
-						result = self.get_prediction(white_player, black_player, game_date, game_type)
-						d['result'] = result
-						games_dict_list.append(d)
-					games['tour_'+str(i)] = games_dict_list
-
-				read_it.close()
-			json_dict = dict()
-			json_dict['name'] = filename
-			json_dict['start_date'] = data['start_date'].values[0]
-			json_dict['end_date'] = data['end_date'].values[0]
-			json_dict['games'] = games
-			json_dict['tours'] = str(nr_tour)
-			json_dict['time_control'] = game_type
+			files.append(file)
 
-			logging.info(f"Generating results file {results_folder+file}")
-			with open(results_folder+file, "w") as fp:
-				json.dump(json_dict, fp, ensure_ascii=False, indent=4)
-				fp.close()
+		# the workers get the names already built
+		name_cache.load()
+		if workers is None or workers > 1:
+			failed = predict_files_in_pool(self, test_folder, files, results_folder, workers, chunk_size)
+		else:
+			failed = predict_files(test_folder, files, results_folder, self)
+		name_cache.save()
+		return failed
+
+# predictor of the worker processes, it is set once per process by init_predict_worker
+worker_predictor = dict()
+
+def init_predict_worker(predictor):
+	worker_predictor['predictor'] = predictor
+
+def predict_files(test_folder, files, results_folder, predictor):
+	'''
+	It predicts the results of some tournament files, the errors of a file do not stop the other files
+	:return: the list of files that could not be predicted
+	'''
+	failed = list()
+	for file in files:
+		try:
+			predictor.predict_file(test_folder, file, results_folder)
+		except Exception as e:
+			logger.error(f"Error while predicting the games of file {file}. Reason: {e}")
+			failed.append(file)
+	return failed
+
+def predict_worker_files(test_folder, files, results_folder):
+	'''
+	It predicts the results of some tournament files in a worker process
+	:return: the list of files that could not be predicted and the names built by the worker
+	'''
+	failed = predict_files(test_folder, files, results_folder, worker_predictor['predictor'])
+	return failed, name_cache.pop_new_names()
+
+def predict_files_in_pool(predictor, test_folder, files, results_folder, workers=None, chunk_size=64):
+	'''
+	It predicts the results of the tournament files in a pool of processes. Every worker gets chunks of files,
+	so the cost of sending the tasks is shared by many small files.
+	:return: the list of files that could not be predicted
+	'''
+	logger.info(f"Predicting {len(files)} files with a pool of processes")
+	# with fork the workers get the predictor from the parent process without copying it
+	methods = multiprocessing.get_all_start_methods()
+	context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+	failed = list()
+	with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_predict_worker,
+							 initargs=(predictor,)) as executor:
+		futures = [executor.submit(predict_worker_files, test_folder, files[i:i+chunk_size], results_folder)
+				   for i in range(0, len(files), chunk_size)]
+		for future in as_completed(futures):
+			chunk_failed, new_names = future.result()
+			failed.extend(chunk_failed)
+			name_cache.update(new_names)
+			logger.debug(f"Chunk of files finished, {len(failed)} files failed until now")
+	return failed
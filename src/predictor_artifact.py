@@ -0,0 +1,177 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from src.rating_history import HISTORY_COLUMNS, KEY_BASE, get_history_years
+
+logger = logging.getLogger(__name__)
+
+'''
+Compiled ratings of all the years of a version in a single file, so the predictor starts with one read.
+It keeps the sorted table of the names of all the years (the id of a player is its position in the table),
+the table of the latest year with ratings for every game year and the values of HISTORY_COLUMNS of every
+player and year, sorted by the key year_index * KEY_BASE + player_id. The players of many games are found
+with binary searches over the names and over the keys, without building any dictionary.
+@author: A. Rosa Castillo
+'''
+ARTIFACT_FILE = 'predictor.npz'
+
+def get_artifact_file(ratings_version):
+	# TODO yaml config file with data path
+	return './data/ratings/' + ratings_version + '/' + ARTIFACT_FILE
+
+def remove_artifact(ratings_version):
+	'''
+	Function to remove the compiled ratings of a version, called when the ratings of a year change
+	'''
+	artifact_file = get_artifact_file(ratings_version)
+	if os.path.exists(artifact_file):
+		os.remove(artifact_file)
+		logger.info(f"Compiled ratings of version {ratings_version} removed, they need to be compiled again")
+
+def get_year_values(players, rapid_ratings):
+	'''
+	:param players: the dataframe with the players of a ratings pickle file
+	:param rapid_ratings: True if the players have two ratings
+	:return: array with the values of HISTORY_COLUMNS of every player
+	'''
+	values = np.zeros((len(players), len(HISTORY_COLUMNS)), dtype=np.int64)
+	if len(players) == 0:
+		return values
+	values[:, 0] = players['rating']
+	if rapid_ratings:
+		values[:, 1] = players['rapid_rating']
+		values[:, 2] = players['classic_wins']
+		values[:, 3] = players['classic_games']
+		values[:, 4] = players['rapid_wins']
+		values[:, 5] = players['rapid_games']
+	else:
+		values[:, 2] = players['wins']
+		values[:, 3] = players['nr_games']
+	return values
+
+def compile_predictor(ratings_version):
+	'''
+	Function to compile the ratings pickle files of every year of a version into one file
+	:param ratings_version: the version of the ratings
+	:return: the list of compiled years
+	'''
+	folder = './data/ratings/' + ratings_version + '/'
+	years = sorted([int(file.split('.')[0][-4:]) for file in os.listdir(folder) if file.endswith('.pickle')])
+	years_players = [pd.DataFrame(pd.read_pickle(folder + 'ratings_' + str(year) + '.pickle')) for year in years]
+	# the versions with two ratings save the rapid rating of every player
+	rapid_ratings = any('rapid_rating' in players.columns for players in years_players)
+	years_names = list()
+	years_values = list()
+	for year, players in zip(years, years_players):
+		logger.info(f"Compiling the ratings of year {year}")
+		# fixed width unicode arrays, saved without pickle and searched with numpy
+		names = np.array(players['name'].astype(str).tolist() if len(players) else [], dtype=str)
+		values = get_year_values(players, rapid_ratings)
+		# if a name is repeated the last one is kept, as the dictionaries of get_year_ratings do
+		reversed_names = names[::-1]
+		_, last = np.unique(reversed_names, return_index=True)
+		keep = np.sort(len(names) - 1 - last)
+		years_names.append(names[keep])
+		years_values.append(values[keep])
+
+	names = np.unique(np.concatenate(years_names)) if years_names else np.zeros(0, dtype=str)
+	keys = list()
+	for year_index, year_names in enumerate(years_names):
+		keys.append(year_index * KEY_BASE + np.searchsorted(names, year_names))
+	keys = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+	values = np.vstack(years_values) if years_values else np.zeros((0, len(HISTORY_COLUMNS)), dtype=np.int64)
+	order = np.argsort(keys, kind='stable')
+
+	# for every year from the first one to the last one, the index of the latest year with ratings
+	first_year = years[0] if years else 0
+	fallback = np.full(years[-1] - first_year + 1 if years else 0, -1, dtype=np.int32)
+	for year_index, year in enumerate(years):
+		fallback[year - first_year:] = year_index
+	# the statistics are only used with two ratings, as in check_player_win_prob
+	has_stats = np.array([rapid_ratings and len(year_names) > 0 for year_names in years_names], dtype=bool)
+
+	artifact_file = get_artifact_file(ratings_version)
+	with open(artifact_file + '.tmp', 'wb') as file:
+		np.savez(file, names=names, years=np.array(years, dtype=np.int32), first_year=np.int32(first_year),
+				 fallback=fallback, keys=keys[order], values=values[order].astype(np.int32), has_stats=has_stats,
+				 history_years=np.array([int(y) for y in get_history_years(ratings_version)], dtype=np.int32),
+				 rapid_ratings=np.bool_(rapid_ratings))
+		file.close()
+	os.replace(artifact_file + '.tmp', artifact_file)
+	logger.info(f"Compiled {len(years)} years and {len(names)} players of version {ratings_version}")
+	return years
+
+class PredictorArtifact:
+	def __init__(self, ratings_version):
+		with open(get_artifact_file(ratings_version), 'rb') as file:
+			data = np.load(file)
+			# all the arrays are read at once
+			arrays = {name: data[name] for name in data.files}
+			file.close()
+		self.names = arrays['names']
+		self.years = arrays['years']
+		self.first_year = int(arrays['first_year'])
+		self.fallback = arrays['fallback']
+		self.keys = arrays['keys']
+		self.values = arrays['values']
+		self.has_stats = arrays['has_stats']
+		self.history_years = [str(year) for year in arrays['history_years'].tolist()]
+		self.rapid_ratings = bool(arrays['rapid_ratings'])
+
+	def get_year_indices(self, game_years):
+		'''
+		:param game_years: array with the years of the games
+		:return: array with the index of the latest year with ratings until every game year, -1 if there is no one
+		'''
+		game_years = np.asarray(game_years, dtype=np.int64)
+		if len(self.fallback) == 0:
+			return np.full(len(game_years), -1, dtype=np.int64)
+		positions = np.clip(game_years - self.first_year, 0, len(self.fallback) - 1)
+		return np.where(game_years < self.first_year, -1, self.fallback[positions]).astype(np.int64)
+
+	def get_player_ids(self, names):
+		'''
+		:param names: array with the names of the players
+		:return: array with the id of every player, -1 for the unknown ones
+		'''
+		names = np.asarray(names).astype(str)
+		if len(self.names) == 0:
+			return np.full(len(names), -1, dtype=np.int64)
+		positions = np.minimum(np.searchsorted(self.names, names), len(self.names) - 1)
+		return np.where(self.names[positions] == names, positions, -1)
+
+	def lookup(self, player_ids, year_indices):
+		'''
+		:param player_ids: array with the ids of the players, see get_player_ids
+		:param year_indices: array with the index of the year of every player, see get_year_indices
+		:return: boolean array, True for the players with ratings in the year, and the array with their values
+		(one row per player and one column per column of HISTORY_COLUMNS)
+		'''
+		found = (player_ids >= 0) & (year_indices >= 0)
+		values = np.zeros((len(player_ids), len(HISTORY_COLUMNS)), dtype=np.int64)
+		if len(self.keys) == 0 or not found.any():
+			return np.zeros(len(player_ids), dtype=bool), values
+		keys = year_indices * KEY_BASE + player_ids
+		positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+		found &= self.keys[positions] == keys
+		values[found] = self.values[positions[found]]
+		return found, values
+
+	def get_year_data(self, year):
+		'''
+		Same as get_year_ratings with stats for a compiled year
+		:param year: the year of the ratings as a string
+		:return: the ratings, the classic statistics and the rapid statistics of the year, None if not compiled
+		'''
+		matches = np.flatnonzero(self.years == int(year))
+		if len(matches) == 0:
+			return None
+		year_index = int(matches[0])
+		start, end = np.searchsorted(self.keys, [year_index * KEY_BASE, (year_index + 1) * KEY_BASE])
+		names = self.names[self.keys[start:end] - year_index * KEY_BASE].tolist()
+		values = self.values[start:end].tolist()
+		if self.rapid_ratings:
+			return dict(zip(names, [(v[0], v[1]) for v in values])), \
+				dict(zip(names, [(v[2], v[3]) for v in values])), dict(zip(names, [(v[4], v[5]) for v in values]))
+		return dict(zip(names, [v[0] for v in values])), dict(zip(names, [(v[2], v[3]) for v in values])), dict()
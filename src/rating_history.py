@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import shutil
+import numpy as np
+from src.snapshots import load_names, save_names
+
+logger = logging.getLogger(__name__)
+
+'''
+History of the ratings of the players during a year, to know the rating of a player as of any date and not only
+at the end of the year. For every player it keeps one point per day played with the values after the last game
+of that day. The points are saved sorted by player and date, with the key player_row * KEY_BASE + day, so the
+points of many players are found with one binary search over the keys.
+@author: A. Rosa Castillo
+'''
+HISTORY_COLUMNS = ['rating', 'rapid_rating', 'classic_wins', 'classic_games', 'rapid_wins', 'rapid_games']
+
+# larger than any day number (days since 1970-01-01)
+KEY_BASE = 1 << 32
+
+META_FILE = 'meta.json'
+KEYS_FILE = 'keys.npy'
+VALUES_FILE = 'values.npy'
+
+def get_history_folder(ratings_version, year):
+	# TODO yaml config file with data path
+	return './data/ratings/' + ratings_version + '/history/' + str(year) + '/'
+
+def get_history_years(ratings_version):
+	'''
+	:param ratings_version: the version of the ratings
+	:return: the list of years with a rating history
+	'''
+	folder = './data/ratings/' + ratings_version + '/history/'
+	if not os.path.isdir(folder):
+		return list()
+	return sorted([year for year in os.listdir(folder) if os.path.exists(folder + year + '/' + META_FILE)])
+
+def get_days(dates):
+	'''
+	:param dates: array of dates, as strings with format %Y-%m-%d or as timestamps
+	:return: the array with the number of days since 1970-01-01 of every date
+	'''
+	return np.asarray(dates).astype('datetime64[D]').astype(np.int64)
+
+'''
+Recorder of the values of the players after every game, filled by the rating engines while they process the
+games of a year. Every event is the position of the game in the games of the year, the player id in the registry
+and the values of HISTORY_COLUMNS.
+@author: A. Rosa Castillo
+'''
+class HistoryRecorder:
+	def __init__(self):
+		self.events = list()
+		self.chunks = list()
+
+	def add_player(self, game, player_id, player):
+		self.events.append((game, player_id, player.rating, player.r_rating, player.c_wins, player.nr_c_games,
+							player.r_wins, player.nr_r_games))
+
+	def add(self, game, player_id, rating, r_rating, c_wins, c_games, r_wins, r_games):
+		self.events.append((game, player_id, rating, r_rating, c_wins, c_games, r_wins, r_games))
+
+	def add_arrays(self, games, player_ids, values):
+		'''
+		:param games: array with the position of every game
+		:param player_ids: array with the id of the player of every game
+		:param values: array with one row per column of HISTORY_COLUMNS and one column per game
+		'''
+		self.chunks.append(np.column_stack([games, player_ids, np.asarray(values).T]).astype(np.int64))
+
+	def get_events(self):
+		chunks = list(self.chunks)
+		if self.events:
+			chunks.append(np.array(self.events, dtype=np.int64))
+		if not chunks:
+			return np.zeros((0, 2 + len(HISTORY_COLUMNS)), dtype=np.int64)
+		return np.vstack(chunks)
+
+	def clear(self):
+		self.events = list()
+		self.chunks = list()
+
+def save_history(ratings_version, year, recorder, game_dates, registry):
+	'''
+	Function to save the rating history of a year from the events of the recorder
+	:param ratings_version: version of the ratings
+	:param year: the year of the games
+	:param recorder: the HistoryRecorder with the events of the games of the year
+	:param game_dates: the dates of the games of the year, in the order of the games
+	:param registry: the registry of players, to get the names of the player ids
+	'''
+	events = recorder.get_events()
+	days = get_days(game_dates)[events[:, 0]]
+	player_ids = events[:, 1]
+	# sorted by player, day and game, only the last event of every player and day is kept
+	order = np.lexsort((events[:, 0], days, player_ids))
+	player_ids = player_ids[order]
+	days = days[order]
+	values = events[order, 2:]
+	day_keys = player_ids * KEY_BASE + days
+	last = np.ones(len(day_keys), dtype=bool)
+	last[:-1] = day_keys[1:] != day_keys[:-1]
+	ids, rows = np.unique(player_ids[last], return_inverse=True)
+	keys = rows.astype(np.int64) * KEY_BASE + days[last]
+
+	folder = get_history_folder(ratings_version, year)
+	tmp_folder = folder.rstrip('/') + '.tmp/'
+	shutil.rmtree(tmp_folder, ignore_errors=True)
+	os.makedirs(tmp_folder)
+	save_names(tmp_folder, [registry.get_by_id(player_id).name for player_id in ids.tolist()])
+	np.save(tmp_folder + KEYS_FILE, keys)
+	np.save(tmp_folder + VALUES_FILE, values[last].astype(np.int32))
+	meta = {'ratings_version': ratings_version,
+			'year': int(year),
+			'nr_players': len(ids),
+			'nr_points': int(last.sum()),
+			'columns': HISTORY_COLUMNS}
+	with open(tmp_folder + META_FILE, 'w') as fp:
+		json.dump(meta, fp)
+		fp.close()
+	# the old history is replaced only when the new one is complete
+	shutil.rmtree(folder, ignore_errors=True)
+	os.replace(tmp_folder, folder)
+	logger.debug(f"Rating history saved for year {year} with {meta['nr_points']} points")
+
+class RatingHistory:
+	def __init__(self, ratings_version, year):
+		self.folder = get_history_folder(ratings_version, year)
+		with open(self.folder + META_FILE) as fp:
+			self.meta = json.load(fp)
+			fp.close()
+		self.keys = np.load(self.folder + KEYS_FILE, mmap_mode='r')
+		self.values = np.load(self.folder + VALUES_FILE, mmap_mode='r')
+		self.index = None
+
+	def get_index(self):
+		'''
+		:return: dictionary with the row of every player name, built the first time it is needed
+		'''
+		if self.index is None:
+			self.index = {name: row for row, name in enumerate(load_names(self.folder))}
+		return self.index
+
+	def as_of(self, names, days):
+		'''
+		It searches the values of many players before the given dates, the games of the same day are not included
+		:param names: array with the names of the players
+		:param days: array with the dates as number of days since 1970-01-01, see get_days
+		:return: boolean array, True for the players with some game in the year before the date, and the array
+		with their values (one row per player and one column per column of HISTORY_COLUMNS)
+		'''
+		index = self.get_index()
+		rows = np.array([index.get(name, -1) for name in names], dtype=np.int64)
+		found = rows >= 0
+		positions = np.searchsorted(self.keys, rows * KEY_BASE + np.asarray(days, dtype=np.int64)) - 1
+		# the previous point has to be of the same player
+		found &= positions >= 0
+		found[found] = self.keys[positions[found]] // KEY_BASE == rows[found]
+		values = np.zeros((len(rows), len(HISTORY_COLUMNS)), dtype=np.int64)
+		values[found] = self.values[positions[found]]
+		return found, values
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import shutil
+from collections.abc import Mapping
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+'''
+Columnar snapshot of the ratings of a year. Every column is saved as a numpy file that can be memory-mapped,
+so only the columns used are read from disk. The names are saved as one utf-8 buffer plus the offsets of
+every name inside it.
+@author: A. Rosa Castillo
+'''
+META_FILE = 'meta.json'
+NAMES_FILE = 'names.npy'
+OFFSETS_FILE = 'name_offsets.npy'
+
+def get_snapshot_folder(ratings_version, year):
+	# TODO yaml config file with data path
+	return './data/ratings/' + ratings_version + '/snapshots/' + str(year) + '/'
+
+def get_snapshot_years(ratings_version):
+	'''
+	:param ratings_version: the version of the ratings
+	:return: the list of years with a snapshot
+	'''
+	folder = './data/ratings/' + ratings_version + '/snapshots/'
+	if not os.path.isdir(folder):
+		return list()
+	return sorted([year for year in os.listdir(folder) if os.path.exists(folder + year + '/' + META_FILE)])
+
+def get_column_array(values):
+	values = np.asarray(values)
+	if values.dtype.kind in 'iub' and (len(values) == 0 or
+									   (values.min() >= np.iinfo(np.int32).min and
+										values.max() <= np.iinfo(np.int32).max)):
+		# fixed width integers, the ratings and the counters are small numbers
+		return values.astype(np.int32)
+	return values.astype(np.float64)
+
+def save_names(folder, names):
+	'''
+	Function to save a list of names as one utf-8 buffer plus the offsets of every name inside it
+	'''
+	encoded = [name.encode('utf-8') for name in names]
+	save_names_buffer(folder, b''.join(encoded), np.array([len(name) for name in encoded], dtype=np.int64))
+
+def save_names_buffer(folder, buffer, lengths):
+	'''
+	Same as save_names with the names already encoded
+	:param buffer: the utf-8 names one after the other
+	:param lengths: array with the number of bytes of every name
+	'''
+	offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+	offsets[1:] = np.cumsum(lengths)
+	np.save(folder + NAMES_FILE, np.frombuffer(buffer, dtype=np.uint8))
+	np.save(folder + OFFSETS_FILE, offsets)
+
+def load_names(folder):
+	'''
+	:return: the list of names saved by save_names
+	'''
+	buffer = np.load(folder + NAMES_FILE, mmap_mode='r').tobytes()
+	offsets = np.load(folder + OFFSETS_FILE).tolist()
+	return [buffer[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+
+def save_snapshot(ratings_version, year, players_dict_list, first_date, last_date):
+	'''
+	Function to save the ratings of a year as a columnar snapshot
+	:param ratings_version: version of the ratings
+	:param year: the year of the ratings
+	:param players_dict_list: list with the dictionary of every player, as given by get_players
+	:param first_date: first date of historical data
+	:param last_date: last date of the games of the year
+	'''
+	writer = SnapshotWriter(ratings_version, year)
+	writer.add(players_dict_list)
+	writer.save(first_date, last_date)
+
+class SnapshotWriter:
+	'''
+	Writer of a snapshot from chunks of players, the dictionaries of all the players are not needed at once.
+	Every chunk is kept as numpy arrays until the snapshot is saved.
+	'''
+	def __init__(self, ratings_version, year):
+		self.ratings_version = ratings_version
+		self.year = year
+		self.columns = None
+		self.name_buffers = list()
+		self.name_lengths = list()
+		self.arrays = dict()
+		self.nr_players = 0
+
+	def add(self, players_dict_list):
+		'''
+		:param players_dict_list: list with the dictionaries of some players, in the order of the snapshot
+		'''
+		if not players_dict_list:
+			return
+		if self.columns is None:
+			self.columns = list(players_dict_list[0].keys())
+			self.arrays = {column: list() for column in self.columns[1:]}
+		encoded = [player['name'].encode('utf-8') for player in players_dict_list]
+		self.name_buffers.append(b''.join(encoded))
+		self.name_lengths.append(np.array([len(name) for name in encoded], dtype=np.int64))
+		for column in self.columns[1:]:
+			self.arrays[column].append(get_column_array([player[column] for player in players_dict_list]))
+		self.nr_players += len(players_dict_list)
+
+	def save(self, first_date, last_date):
+		'''
+		:param first_date: first date of historical data
+		:param last_date: last date of the games of the year
+		'''
+		folder = get_snapshot_folder(self.ratings_version, self.year)
+		tmp_folder = folder.rstrip('/') + '.tmp/'
+		shutil.rmtree(tmp_folder, ignore_errors=True)
+		os.makedirs(tmp_folder)
+		columns = self.columns if self.columns is not None else ['name']
+		save_names_buffer(tmp_folder, b''.join(self.name_buffers),
+						  np.concatenate(self.name_lengths) if self.name_lengths else np.zeros(0, dtype=np.int64))
+		for column in columns[1:]:
+			# the chunks of a column with integers and with floats are saved as floats, as in one chunk
+			np.save(tmp_folder + column + '.npy', np.concatenate(self.arrays[column]))
+		meta = {'ratings_version': self.ratings_version,
+				'year': int(self.year),
+				'first_date': str(first_date),
+				'last_date': str(last_date),
+				'nr_players': self.nr_players,
+				'columns': columns}
+		with open(tmp_folder + META_FILE, 'w') as fp:
+			json.dump(meta, fp)
+			fp.close()
+		# the old snapshot is replaced only when the new one is complete
+		shutil.rmtree(folder, ignore_errors=True)
+		os.replace(tmp_folder, folder)
+		logger.debug(f"Snapshot saved for year {self.year}")
+
+class RatingsSnapshot:
+	def __init__(self, ratings_version, year):
+		self.folder = get_snapshot_folder(ratings_version, year)
+		with open(self.folder + META_FILE) as fp:
+			self.meta = json.load(fp)
+			fp.close()
+		self.columns = dict()
+		self.names = None
+		self.index = None
+
+	def __len__(self):
+		return self.meta['nr_players']
+
+	def column(self, column):
+		'''
+		:param column: the name of the column
+		:return: the memory-mapped numpy array of the column, the names are given by get_names
+		'''
+		if column not in self.columns:
+			self.columns[column] = np.load(self.folder + column + '.npy', mmap_mode='r')
+		return self.columns[column]
+
+	def get_names(self):
+		if self.names is None:
+			self.names = load_names(self.folder)
+		return self.names
+
+	def get_index(self):
+		'''
+		:return: dictionary with the row of every player name, built the first time it is needed
+		'''
+		if self.index is None:
+			self.index = dict()
+			for row, name in enumerate(self.get_names()):
+				# if a name is repeated we keep the first one, as the registry does
+				self.index.setdefault(name, row)
+		return self.index
+
+	def view(self, *columns):
+		return SnapshotView(self, columns)
+
+	def to_dicts(self):
+		'''
+		:return: the list of dictionaries of the players, the same ones that were saved
+		'''
+		return list(self.iter_dicts())
+
+	def iter_dicts(self, chunk_size=10000):
+		'''
+		:param chunk_size: number of players read from the columns at once
+		:return: generator of the dictionaries of the players, see to_dicts
+		'''
+		columns = self.meta['columns']
+		buffer = np.load(self.folder + NAMES_FILE, mmap_mode='r')
+		offsets = np.load(self.folder + OFFSETS_FILE)
+		for start in range(0, len(self), chunk_size):
+			end = min(start + chunk_size, len(self))
+			chunk = buffer[offsets[start]:offsets[end]].tobytes()
+			names = [chunk[first - offsets[start]:last - offsets[start]].decode('utf-8')
+					 for first, last in zip(offsets[start:end].tolist(), offsets[start + 1:end + 1].tolist())]
+			values = [names] + [self.column(column)[start:end].tolist() for column in columns[1:]]
+			for player in zip(*values):
+				yield dict(zip(columns, player))
+
+	def export(self, file='json'):
+		'''
+		Function to generate the export of the ratings of the year from the snapshot
+		:param file: the format of the export, only json is available
+		'''
+		logger.info(f"Exporting ratings in {file} format")
+		if file != 'json':
+			logger.error("Other formats not implemented yet")
+			return
+		folder = './data/ratings/' + self.meta['ratings_version'] + "/"
+		with open(folder + "ratings_" + str(self.meta['year']) + ".json", "w") as fp:
+			# the same text as json.dump of the whole dictionary, written player by player
+			fp.write('{"players": [')
+			for row, player in enumerate(self.iter_dicts()):
+				fp.write((', ' if row else '') + json.dumps(player, ensure_ascii=False))
+			fp.write('], ' + json.dumps({'first_date': self.meta['first_date'],
+										 'last_date': self.meta['last_date'],
+										 'nr_players': len(self)}, ensure_ascii=False)[1:])
+			fp.close()
+
+'''
+Read-only dictionary over some columns of a snapshot. The value of a player is the value of the column
+or a tuple with the values of all the columns.
+'''
+class SnapshotView(Mapping):
+	def __init__(self, snapshot, columns):
+		self.snapshot = snapshot
+		self.arrays = [snapshot.column(column) for column in columns]
+
+	def __getitem__(self, name):
+		row = self.snapshot.get_index()[name]
+		if len(self.arrays) == 1:
+			return self.arrays[0][row].item()
+		return tuple(array[row].item() for array in self.arrays)
+
+	def __contains__(self, name):
+		return name in self.snapshot.get_index()
+
+	def __iter__(self):
+		return iter(self.snapshot.get_index())
+
+	def __len__(self):
+		return len(self.snapshot.get_index())
+
+def get_snapshot_ratings(year, rapid_ratings, ratings_version, stats=False):
+	'''
+	Same as get_year_ratings reading the snapshot of the year. The returned dictionaries read the
+	memory-mapped columns when a player is searched.
+	:param year: the year of the ratings
+	:param rapid_ratings: True if the players have two ratings
+	:param ratings_version: version of the ratings
+	:param stats: True to return also the winning statistics
+	:return: the ratings, the classic statistics and the rapid statistics or None if there is no snapshot
+	'''
+	try:
+		snapshot = RatingsSnapshot(ratings_version, year)
+		r_stats_dict = None
+		c_stats_dict = None
+		if stats:
+			if rapid_ratings:
+				r_stats_dict = snapshot.view('rapid_wins', 'rapid_games')
+				c_stats_dict = snapshot.view('classic_wins', 'classic_games')
+			else:
+				r_stats_dict = dict()
+				c_stats_dict = snapshot.view('wins', 'nr_games')
+		if rapid_ratings: # two ratings
+			return snapshot.view('rating', 'rapid_rating'), c_stats_dict, r_stats_dict
+		return snapshot.view('rating'), c_stats_dict, r_stats_dict
+	except Exception as e:
+		logger.error(f"Error while reading the snapshot of year {year}. Reason {e}")
+		return None
+
+def export_snapshots(ratings_version):
+	'''
+	Function to generate the json export of every year with a snapshot
+	:param ratings_version: version of the ratings
+	:return: the list of exported years
+	'''
+	years = get_snapshot_years(ratings_version)
+	for year in years:
+		RatingsSnapshot(ratings_version, year).export()
+	return years
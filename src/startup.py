@@ -0,0 +1,95 @@
+import importlib
+import os
+import subprocess
+import sys
+import time
+
+'''
+Imports of the actions of main.py. Every action imports only the modules it uses, so the actions that do not
+need pandas or the predictor do not pay for them. STARTUP_BUDGET is the maximum time to import the modules of
+every action, measured on top of the start of a bare python interpreter, as a multiple of the time to import
+pandas measured in the same runs (BASELINE_COMMAND). The budgets follow the speed of the machine and they are
+about 1.25 times the measured times: the actions with pandas take about the time of the baseline, so a new
+eager import as heavy as pandas makes them fail, and the actions without pandas have their own small budgets.
+@author: A. Rosa Castillo
+'''
+ACTION_MODULES = {'get_data': ['src.io_utils'],
+				  'compute_ratings': ['src.io_utils', 'src.elo_ratings'],
+				  'stream_ratings': ['src.io_utils', 'src.elo_ratings'],
+				  'export_ratings': ['src.snapshots'],
+				  'compile_predictor': ['src.predictor_artifact'],
+				  'eval_predictor': ['src.io_utils', 'src.elo_predictor'],
+				  'predict_test_games': ['src.elo_predictor'],
+				  'serve': ['src.prediction_server'],
+				  'online_ratings': ['src.io_utils', 'src.online_ratings'],
+				  'find_optimal_seed': ['src.find_opt_seed'],
+				  'param_search': ['src.param_search'],
+				  'check_startup': [],
+				  'benchmark': ['src.benchmarks']}
+
+# TODO yaml config file with the startup budget
+STARTUP_BUDGET = {'get_data': 1.3,
+				  'compute_ratings': 1.3,
+				  'stream_ratings': 1.3,
+				  'export_ratings': 0.4,
+				  'compile_predictor': 1.35,
+				  'eval_predictor': 1.35,
+				  'predict_test_games': 1.35,
+				  'serve': 1.45,
+				  'online_ratings': 1.35,
+				  'find_optimal_seed': 1.35,
+				  'param_search': 1.3,
+				  'check_startup': 0.15,
+				  'benchmark': 1.3}
+
+# the heaviest import of the project, the budgets are multiples of its time
+BASELINE_COMMAND = 'import pandas'
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+
+def import_action(action):
+	'''
+	Function to import the modules used by an action
+	:param action: the action of main.py
+	:return: the list of imported modules, a ValueError is raised for an unknown action
+	'''
+	if action not in ACTION_MODULES:
+		raise ValueError(f"Action {action} not recognized")
+	return [importlib.import_module(module) for module in ACTION_MODULES[action]]
+
+def get_run_time(command):
+	'''
+	:return: the wall time in seconds of a run of the command
+	'''
+	start = time.perf_counter()
+	subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+	return time.perf_counter() - start
+
+def measure_startup(actions=None, repeats=5):
+	'''
+	Function to measure the startup time of the actions of main.py in new processes, so the modules are not
+	already imported. The runs of every action alternate with runs of the bare interpreter and of the baseline,
+	so the three are measured under the same load of the machine, and the best time of each is kept to ignore
+	the noise.
+	:param actions: the list of actions, all by default
+	:param repeats: number of runs of every action
+	:return: list of dictionaries with the action, the startup time over the bare interpreter, the budget in
+	seconds (the budget of the action times the time of the baseline) and True if the budget is respected
+	'''
+	actions = actions if actions is not None else list(ACTION_MODULES.keys())
+	results = list()
+	for action in actions:
+		commands = [[sys.executable, '-c', 'pass'],
+					[sys.executable, '-c', BASELINE_COMMAND],
+					[sys.executable, MAIN_SCRIPT, action, 'v0', '--imports-only']]
+		times = [[get_run_time(command) for command in commands] for _ in range(repeats)]
+		interpreter, baseline, seconds = [min(column) for column in zip(*times)]
+		baseline -= interpreter
+		seconds -= interpreter
+		budget = STARTUP_BUDGET[action] * baseline
+		results.append({'action': action,
+						'seconds': round(seconds, 4),
+						'baseline': round(baseline, 4),
+						'budget': round(budget, 4),
+						'ok': seconds <= budget})
+	return results
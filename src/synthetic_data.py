@@ -0,0 +1,161 @@
+import json
+import math
+import os
+import random
+
+'''
+Generator of synthetic tournament files with the same layout as the real data: one json file per tournament with
+the games of every round under games.tour_N. The players have a hidden strength that decides the results, some
+of them have Chinese names and some of them have an initial classic rating. With the same seed the same files
+are generated, so the benchmarks of different releases use the same games.
+@author: A. Rosa Castillo
+'''
+# without v, build_name replaces it by u
+LATIN_SYLLABLES = ['ka', 'ro', 'mi', 'sen', 'le', 'an', 'to', 'nic', 'ma', 'gnus', 'ser', 'gei', 'al', 'ex',
+				   'dra', 'ni', 'har', 'ko', 'pa', 'bel']
+CHINESE_FAMILY = ['王', '李', '张', '刘', '陈', '杨', '赵', '黄', '周', '吴', '徐', '孙', '胡', '朱', '高',
+				  '林', '何', '郭', '马', '罗']
+CHINESE_GIVEN = ['伟', '芳', '娜', '敏', '静', '丽', '强', '磊', '军', '洋', '勇', '艳', '杰', '娟', '涛',
+				 '明', '超', '秀', '霞', '平', '刚', '桂', '英', '华', '建', '文', '辉', '力', '浩', '宇']
+
+def get_latin_word(number):
+	'''
+	:return: a word of three syllables, different for every number below 8000
+	'''
+	syllables = list()
+	for _ in range(3):
+		syllables.append(LATIN_SYLLABLES[number % len(LATIN_SYLLABLES)])
+		number //= len(LATIN_SYLLABLES)
+	return ''.join(syllables).capitalize()
+
+def get_player_names(nr_players, chinese_share=0.2, seed=0):
+	'''
+	Function to build the raw names of the players as they are written in the tournament files
+	:param nr_players: number of players
+	:param chinese_share: share of the players with a Chinese name
+	:param seed: the seed of the random generator
+	:return: the list of raw names, all different
+	'''
+	rng = random.Random(seed)
+	names = list()
+	for i in range(nr_players):
+		if rng.random() < chinese_share:
+			# family name and two given names, different for every number below 18000
+			number = i % (len(CHINESE_FAMILY) * len(CHINESE_GIVEN) ** 2)
+			names.append(CHINESE_FAMILY[number % len(CHINESE_FAMILY)] +
+						 CHINESE_GIVEN[(number // len(CHINESE_FAMILY)) % len(CHINESE_GIVEN)] +
+						 CHINESE_GIVEN[number // (len(CHINESE_FAMILY) * len(CHINESE_GIVEN))])
+		else:
+			# "Surname, Name" with an extra space sometimes, as in the real files. The players with the same surname
+			# have different names.
+			names.append(get_latin_word(i % 8000) + ', ' + get_latin_word((i // 8000 + 37 * i) % 8000) +
+						 (' ' if i % 5 == 0 else ''))
+	return names
+
+def get_result(rng, white_strength, black_strength, draw_rate=0.3):
+	'''
+	:return: the result of a game for white, 1, 0.5 or 0, from the strength of the players
+	'''
+	expected = 1 / (1 + math.pow(10, (black_strength - white_strength) / 400))
+	value = rng.random()
+	if value < draw_rate:
+		return 0.5
+	return 1 if (value - draw_rate) / (1 - draw_rate) < expected else 0
+
+def get_tournament(rng, number, names, strengths, year, rounds, tournament_players, rapid_share, results=True):
+	'''
+	:return: the dictionary of a tournament with the layout of the json files
+	'''
+	players = rng.sample(range(len(names)), min(tournament_players, len(names)) // 2 * 2)
+	start_day = rng.randrange(365 - rounds)
+	dates = [f"{year}-{month:02d}-{day:02d}" for month, day in
+			 [get_month_day(year, start_day + tour) for tour in range(rounds)]]
+	games = dict()
+	for tour in range(rounds):
+		rng.shuffle(players)
+		tour_games = list()
+		for white, black in zip(players[0::2], players[1::2]):
+			game = {'date': dates[tour], 'white': names[white], 'black': names[black]}
+			if results:
+				game['result'] = get_result(rng, strengths[white], strengths[black])
+			tour_games.append(game)
+		games['tour_' + str(tour + 1)] = tour_games
+	return {'name': 'Synthetic tournament ' + str(number),
+			'start_date': dates[0],
+			'end_date': dates[-1],
+			'time_control': 'rapid' if rng.random() < rapid_share else 'classic',
+			'tours': rounds,
+			'games': games}
+
+def get_month_day(year, day_of_year):
+	'''
+	:return: the month and the day of a day of the year, starting at 0
+	'''
+	days = [31, 29 if year % 4 == 0 else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+	month = 0
+	while day_of_year >= days[month]:
+		day_of_year -= days[month]
+		month += 1
+	return month + 1, day_of_year + 1
+
+def write_tournaments(folder, names, strengths, years, nr_tournaments, rounds, tournament_players, rapid_share,
+					  results=True, seed=0):
+	'''
+	Function to write the json files of some tournaments spread over some years
+	:return: the number of games written
+	'''
+	os.makedirs(folder, exist_ok=True)
+	rng = random.Random(seed)
+	total_games = 0
+	for number in range(nr_tournaments):
+		tournament = get_tournament(rng, number, names, strengths, years[number * len(years) // nr_tournaments],
+									rounds, tournament_players, rapid_share, results)
+		total_games += sum(len(games) for games in tournament['games'].values())
+		with open(folder + 'tournament_' + str(number).zfill(6) + '.json', 'w', encoding='utf-8') as f:
+			f.write(json.dumps(tournament, ensure_ascii=False))
+			f.close()
+	return total_games
+
+def write_ini_ratings(file, names, strengths, nr_rated):
+	'''
+	Function to write the initial classic ratings of the strongest players with a latin name, in the format read
+	by get_classic_ratings
+	'''
+	os.makedirs(os.path.dirname(file), exist_ok=True)
+	rated = sorted([i for i, name in enumerate(names) if ',' in name], key=lambda i: -strengths[i])[:nr_rated]
+	with open(file, 'w', encoding='utf-8') as f:
+		for i in rated:
+			f.write(f"{names[i].strip()}\t{int(strengths[i])}\n")
+		f.close()
+
+def generate_dataset(root, nr_players=1000, nr_tournaments=200, rounds=9, tournament_players=16, rapid_share=0.3,
+					 chinese_share=0.2, train_years=(2016, 2017, 2018, 2019), eval_year=2020, test_year=2021,
+					 seed=0):
+	'''
+	Function to generate a full data folder: the training files, the evaluation files of the year after the
+	training, the test files without results and the initial ratings file of the io folder
+	:param root: the folder where the data folder is created
+	:param nr_players: number of players
+	:param nr_tournaments: number of training tournaments, a tenth of them is added for evaluation and for test
+	:param rounds: number of rounds of every tournament
+	:param tournament_players: number of players of every tournament, every round has half as many games
+	:param rapid_share: share of the rapid tournaments
+	:param chinese_share: share of the players with a Chinese name
+	:param seed: the seed of the random generator
+	:return: dictionary with the number of games of the training, evaluation and test files
+	'''
+	rng = random.Random(seed)
+	names = get_player_names(nr_players, chinese_share, seed)
+	strengths = [rng.gauss(1600, 300) for _ in names]
+	data_folder = os.path.join(root, 'data') + '/'
+	extra_tournaments = max(1, nr_tournaments // 10)
+	games = {'train': write_tournaments(data_folder + 'train/', names, strengths, list(train_years), nr_tournaments,
+										rounds, tournament_players, rapid_share, seed=seed + 1),
+			 'eval': write_tournaments(data_folder + 'eval/', names, strengths, [eval_year], extra_tournaments,
+									   rounds, tournament_players, rapid_share, seed=seed + 2),
+			 'test': write_tournaments(data_folder + 'test/', names, strengths, [test_year], extra_tournaments,
+									   rounds, tournament_players, rapid_share, results=False, seed=seed + 3)}
+	write_ini_ratings(data_folder + 'io/rating_2014.txt', names, strengths, nr_players // 10)
+	for folder in ['ratings', 'predictions']:
+		os.makedirs(data_folder + folder, exist_ok=True)
+	return games